@@ -16,8 +16,15 @@
 Base PEs implementing typical processing patterns.
 '''
 
+import time
+
 from dispel4py.core import GenericPE, NAME
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class BasePE(GenericPE):
     '''
@@ -145,6 +152,123 @@ class SimpleFunctionPE(IterativePE):
         return self.compute_fn(data, **self.params)
 
 
+def _to_columns(items):
+    if items and isinstance(items[0], tuple):
+        return tuple(np.asarray(column) for column in zip(*items))
+    return np.asarray(items)
+
+
+def _to_items(block):
+    if isinstance(block, tuple):
+        return list(zip(*[_to_items(column) for column in block]))
+    if np is not None and isinstance(block, np.ndarray):
+        return block.tolist()
+    return block
+
+
+class BatchPE(GenericPE):
+    '''
+    A PE that processes blocks of data items at once, for example with
+    vectorised NumPy operations.
+    Subclasses are expected to override
+    :py:func:`~dispel4py.base.BatchPE.process_batch` to implement processing.
+
+    The data items received by the PE are collected and processed in blocks
+    of at most `batch_size` items. A block is processed when it is full,
+    when the oldest item of the block is older than `batch_latency` seconds
+    as the next item arrives, when the mapping has no further input for the
+    PE at the moment (see :py:func:`~dispel4py.base.BatchPE.flush`) and
+    after the last input. Data items are therefore processed in order but
+    the number of items in a block varies.
+
+    If `columnar` is set and NumPy is available, the data items of each
+    input are passed to :py:func:`~dispel4py.base.BatchPE.process_batch` as
+    a NumPy array, or as a tuple of arrays with one array for each element
+    if the data items are tuples.
+
+    :param batch_size: the maximum number of data items in a block
+    :param batch_latency: the maximum time in seconds that a data item
+        waits for its block to be processed while items arrive (optional)
+    :param columnar: whether data items are provided as NumPy arrays
+    '''
+
+    def __init__(self, batch_size=100, batch_latency=None, columnar=False):
+        GenericPE.__init__(self)
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.columnar = columnar
+        self._block = {}
+        self._block_size = 0
+        self._block_time = None
+
+    def process(self, inputs):
+        '''
+        Adds the inputs to the current block and processes the block if it
+        is full or its oldest data item is older than `batch_latency`.
+        '''
+        block = self._block
+        for name, data in inputs.items():
+            try:
+                block[name].append(data)
+            except KeyError:
+                block[name] = [data]
+        self._block_size += 1
+        if self._block_size >= self.batch_size:
+            self.flush()
+        elif self.batch_latency is not None:
+            now = time.time()
+            if self._block_time is None:
+                self._block_time = now
+            elif now - self._block_time >= self.batch_latency:
+                self.flush()
+
+    def flush(self):
+        '''
+        Processes the current block, if it contains any data items, and
+        writes the outputs. This is called by the mappings before waiting for
+        input.
+        '''
+        if not self._block_size:
+            return
+        block = self._block
+        self._block = {}
+        self._block_size = 0
+        self._block_time = None
+        if self.columnar and np is not None:
+            block = dict((name, _to_columns(items))
+                         for name, items in block.items())
+        outputs = self.process_batch(block)
+        if outputs is not None:
+            for name, items in outputs.items():
+                for data in _to_items(items):
+                    self.write(name, data)
+
+    def postprocess(self):
+        '''
+        Processes the last block before calling
+        :py:func:`~dispel4py.core.GenericPE._postprocess`.
+        '''
+        self.flush()
+        self._postprocess()
+
+    def process_batch(self, inputs):
+        '''
+        Processes a block of data items.
+
+        :param inputs: a dictionary mapping the name of each input to the
+            list of data items that were received in order, or to NumPy
+            arrays if the PE is columnar. Note that the lists of different
+            inputs are not aligned if an iteration does not provide data for
+            all inputs.
+        :returns: a dictionary mapping output names to the list of data
+            items that are written, or None. An output may also be a NumPy
+            array, in which each element or row is written as a data item,
+            or a tuple of columns, in which case a tuple is written for each
+            row.
+        '''
+        return None
+
+
 from dispel4py.workflow_graph import WorkflowGraph
 
 
@@ -24,6 +24,7 @@ DESCRIPTION = 'descr'
 META = 'meta'
 GROUPING = 'grouping'
 WRITER = 'writer'
+COMBINER = 'combiner'
 
 
 class GenericPE(object):
@@ -56,6 +57,14 @@ In the example of a filter PE this method would return the input types.
 Custom PEs may implement the method preprocess() to initialise variables or
 data before processing commences.
 
+A PE that aggregates data grouped by key may set the attribute
+``associative`` if partial results can be merged by the PE itself. This
+requires that the PE has one input grouped by attributes and one output, and
+that the data written to the output has the same form as the input, so that
+another instance of the PE combines the partial results for each key.
+The parallel mappings then distribute the data of very frequent keys across
+several instances of the PE and insert this merge step after the PE.
+
 Example implementation::
 
     import traceback
@@ -117,6 +126,7 @@ Example implementation::
         self.pickleIgnore = []
         self.pickleIgnore = list(vars(self).keys())
         self.numprocesses = numprocesses
+        self.associative = False
         self.name = self.__class__.__name__
         self.id = self.name + str(uuid.uuid4())
 
@@ -136,7 +146,7 @@ Example implementation::
         if tuple_type:
             self.inputconnections[name][TYPE] = tuple_type
 
-    def _add_output(self, name, tuple_type=None):
+    def _add_output(self, name, tuple_type=None, combiner=None):
         '''
         Declares an output for this PE.
         This method may be used when initialising a PE instead of modifying
@@ -144,10 +154,15 @@ Example implementation::
 
         :param name: name of the output
         :param tuple_type: type of tuples produced by this output (optional)
+        :param combiner: merges data items with the same key before they
+            are sent, see :py:class:`~dispel4py.new.combiners.Combiner`
+            (optional)
         '''
         self.outputconnections[name] = {NAME: name}
         if tuple_type:
             self.outputconnections[name][TYPE] = tuple_type
+        if combiner is not None:
+            self.outputconnections[name][COMBINER] = combiner
 
     def setInputTypes(self, types):
         '''
@@ -18,7 +18,7 @@ Example PEs for test workflows, implementing various patterns.
 '''
 
 from dispel4py.core import GenericPE
-from dispel4py.base import IterativePE, ProducerPE, ConsumerPE
+from dispel4py.base import IterativePE, ProducerPE, ConsumerPE, BatchPE
 import random
 import time
 from collections import defaultdict
@@ -220,6 +220,29 @@ class WordCounter(GenericPE):
         return {'output': [word, self.mywords[word]]}
 
 
+class CountByKey(GenericPE):
+    '''
+    This PE sums the counts of the (key, count) tuples that it receives and
+    produces the total of each key when it terminates. As the totals have
+    the same form as the input the PE is associative.
+    '''
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input', grouping=[0])
+        self._add_output('output', tuple_type=['key', 'count'])
+        self.associative = True
+        self.counts = defaultdict(int)
+
+    def _process(self, inputs):
+        key, count = inputs['input']
+        self.counts[key] += count
+
+    def _postprocess(self):
+        for key, count in self.counts.items():
+            self.write('output', [key, count])
+
+
 class RandomWordProducer(GenericPE):
     '''
     This PE produces a random word as an output.
@@ -235,3 +258,18 @@ class RandomWordProducer(GenericPE):
         word = random.choice(RandomWordProducer.words)
         outputs = {'output': [word]}
         return outputs
+
+
+class TestBatchOneInOneOut(BatchPE):
+    '''
+    This PE copies the input to an output, processing the data items in
+    blocks of NumPy arrays.
+    '''
+
+    def __init__(self, batch_size=100, batch_latency=None):
+        BatchPE.__init__(self, batch_size, batch_latency, columnar=True)
+        self._add_input('input')
+        self._add_output('output')
+
+    def process_batch(self, inputs):
+        return {'output': inputs['input']}
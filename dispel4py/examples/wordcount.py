@@ -14,8 +14,10 @@
 
 
 from dispel4py.base import IterativePE, ConsumerPE, CompositePE
+from dispel4py.new.combiners import Combiner
 
 from collections import defaultdict
+import operator
 
 
 class SplitTextFile(IterativePE):
@@ -33,6 +35,8 @@ class WordCount(IterativePE):
 
     def __init__(self):
         IterativePE.__init__(self)
+        # the counts of each word are summed before they are sent
+        self._add_output('output', combiner=Combiner(operator.add))
 
     def _process(self, line):
         for w in line.split(' '):
@@ -3,12 +3,41 @@ Processing elements that implement aggregation functions
 (AVG, SUM, COUNT, MIN, MAX).
 These are composite PEs that are automatically parallelised if the mapping
 supports this.
+
+The following sketches accumulate blocks of data items in NumPy arrays and
+their partial states are merged by the reducer of the composite PE:
+
+* :py:class:`Moments` - count, sum, mean, variance, minimum and maximum,
+  see :py:func:`parallelStats`
+* :py:class:`QuantileSketch` - quantiles with a relative accuracy, see
+  :py:func:`parallelQuantiles`
+* :py:class:`Histogram` - counts of values in bins, see
+  :py:func:`parallelHistogram`
+* :py:class:`TopK` - the most frequent values, see :py:func:`parallelTopK`
+* :py:class:`HyperLogLog` - the number of distinct values, see
+  :py:func:`parallelDistinctCount`
+
+Sketches are aggregated per key if a key is given, for example the
+statistics of the samples of each station::
+
+    stats = parallelStats(indexes=[1], key=0)
 '''
 
 from dispel4py.workflow_graph import WorkflowGraph
 from dispel4py.core import GenericPE
+from dispel4py.base import BatchPE
+from dispel4py.utils import stable_hash_array
+from abc import ABC, abstractmethod
+from collections import Counter
+from operator import itemgetter
+import copy
 import math
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class AggregatePE(GenericPE):
     INPUT_NAME = 'input'
@@ -258,3 +287,531 @@ def parallelStdDev(index=0):
     composite.outputmappings = {'output':
                                 (reduceStdDev, reduceStdDev.OUTPUT_NAME)}
     return composite
+
+
+class Sketch(ABC):
+    '''
+    Base class of sketches, which are partial states of an aggregation that
+    can be updated with blocks of values and merged. Sketches require NumPy.
+    '''
+
+    @abstractmethod
+    def update(self, values):
+        '''
+        Adds a block of values.
+
+        :param values: a list or NumPy array of values
+        '''
+
+    @abstractmethod
+    def merge(self, other):
+        '''
+        Adds the values of another sketch of the same type and parameters.
+        '''
+
+    @abstractmethod
+    def result(self):
+        '''
+        Returns the value of the aggregation.
+        '''
+
+
+class Moments(Sketch):
+    '''
+    Count, sum, mean, variance, minimum and maximum of one or more columns
+    of values, which are held in NumPy arrays of 64 bit floats. The mean and
+    the sum of squared differences from the mean of each block are combined
+    with the parallel algorithm of Chan et al, which unlike the sum of
+    squares is numerically stable.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.sum = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def _combine(self, count, total, mean, m2, minimum, maximum):
+        if not count:
+            return
+        if not self.count:
+            self.count, self.sum, self.mean, self.m2, self.min, self.max = \
+                count, total, mean, m2, minimum, maximum
+            return
+        n = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (float(count) / n)
+        self.m2 = self.m2 + m2 + \
+            delta * delta * (float(self.count) * count / n)
+        self.sum = self.sum + total
+        self.min = np.minimum(self.min, minimum)
+        self.max = np.maximum(self.max, maximum)
+        self.count = n
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        values = values.reshape(len(values), -1)
+        mean = values.mean(axis=0)
+        self._combine(len(values), values.sum(axis=0), mean,
+                      ((values - mean) ** 2).sum(axis=0),
+                      values.min(axis=0), values.max(axis=0))
+
+    def merge(self, other):
+        self._combine(other.count, other.sum, other.mean, other.m2,
+                      other.min, other.max)
+
+    def result(self):
+        '''
+        Returns a dictionary with the count and lists of the sum, mean,
+        sample variance, standard deviation, minimum and maximum of each
+        column. The variance is NaN if there are less than two values.
+        '''
+        if not self.count:
+            return {'count': 0}
+        if self.count > 1:
+            variance = self.m2 / (self.count - 1)
+        else:
+            variance = np.full(len(self.m2), np.nan)
+        return {'count': self.count,
+                'sum': self.sum.tolist(),
+                'mean': self.mean.tolist(),
+                'variance': variance.tolist(),
+                'stddev': np.sqrt(variance).tolist(),
+                'min': self.min.tolist(),
+                'max': self.max.tolist()}
+
+
+class QuantileSketch(Sketch):
+    '''
+    Estimates quantiles with a relative error of at most `accuracy`. Values
+    are counted in buckets whose bounds grow geometrically, as in DDSketch
+    (Masson et al, 2019), so the number of buckets grows with the logarithm
+    of the range of the values and sketches are merged exactly.
+
+    :param quantiles: the quantiles that are returned as the result
+    :param accuracy: the relative accuracy of the quantiles
+    '''
+
+    def __init__(self, quantiles=(0.5,), accuracy=0.01):
+        self.quantiles = list(quantiles)
+        self.accuracy = accuracy
+        self.gamma = (1.0 + accuracy) / (1.0 - accuracy)
+        self.count = 0
+        self.zeros = 0
+        self.positive = {}
+        self.negative = {}
+
+    def _add(self, buckets, values):
+        indexes = np.ceil(np.log(values) / math.log(self.gamma))
+        keys, counts = np.unique(indexes.astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        positive = values[values > 0]
+        negative = values[values < 0]
+        self._add(self.positive, positive)
+        self._add(self.negative, -negative)
+        self.zeros += len(values) - len(positive) - len(negative)
+        self.count += len(values)
+
+    def merge(self, other):
+        for buckets, others in [(self.positive, other.positive),
+                                (self.negative, other.negative)]:
+            for key, count in others.items():
+                buckets[key] = buckets.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        '''
+        Returns the estimate of a quantile, or None if there are no values.
+
+        :param q: the quantile between 0 and 1
+        '''
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
+
+    def result(self):
+        return [self.quantile(q) for q in self.quantiles]
+
+
+class Histogram(Sketch):
+    '''
+    Counts the values in bins between sorted edges. The bin `i` contains the
+    values that are at least `edges[i]` and less than `edges[i + 1]`, and
+    values outside the edges are counted as underflow or overflow.
+
+    :param edges: the sorted edges of the bins
+    '''
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        indexes = np.searchsorted(self.edges, values, side='right')
+        self.counts += np.bincount(indexes, minlength=len(self.counts))
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def result(self):
+        '''
+        Returns a dictionary with the edges and the counts of the bins, and
+        the number of values below and above the edges.
+        '''
+        counts = self.counts.tolist()
+        return {'edges': self.edges.tolist(),
+                'counts': counts[1:-1],
+                'underflow': counts[0],
+                'overflow': counts[-1]}
+
+
+def _to_array(values):
+    # returns numbers as a flat NumPy array and other values as a list
+    array = np.asarray(values)
+    if array.dtype.kind in 'biuf':
+        return array.ravel()
+    if isinstance(values, np.ndarray):
+        return values.ravel().tolist()
+    return values
+
+
+class TopK(Sketch):
+    '''
+    Finds the `k` most frequent values with the Misra-Gries summary, which
+    counts at most `capacity` values. The count of a value is underestimated
+    by at most `n / (capacity + 1)` for `n` values, so any value that is
+    more frequent is found. Summaries are merged as described by Agarwal et
+    al, "Mergeable summaries" (2012).
+
+    :param k: the number of values that are returned as the result
+    :param capacity: the number of counters (default is `10 * k`)
+    '''
+
+    def __init__(self, k=10, capacity=None):
+        self.k = k
+        self.capacity = capacity or 10 * k
+        self.counts = {}
+        self.count = 0
+
+    def _prune(self):
+        counts = self.counts
+        if len(counts) > self.capacity:
+            values = np.fromiter(counts.values(), dtype=np.int64,
+                                 count=len(counts))
+            # the (capacity + 1)-th largest count
+            threshold = int(
+                -np.partition(-values, self.capacity)[self.capacity])
+            self.counts = dict((key, count - threshold)
+                               for key, count in counts.items()
+                               if count > threshold)
+
+    def update(self, values):
+        values = _to_array(values)
+        if isinstance(values, np.ndarray):
+            keys, counts = np.unique(values, return_counts=True)
+            counted = zip(keys.tolist(), counts.tolist())
+        else:
+            counted = Counter(values).items()
+        for key, count in counted:
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.count += len(values)
+        self._prune()
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.count += other.count
+        self._prune()
+
+    def result(self):
+        '''
+        Returns a list of `[value, count]` of the most frequent values in
+        order of descending counts.
+        '''
+        top = sorted(self.counts.items(), key=lambda kc: -kc[1])[:self.k]
+        return [[key, count] for key, count in top]
+
+
+def _bit_length(x):
+    length = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = (x >> np.uint64(shift)) != 0
+        x = np.where(high, x >> np.uint64(shift), x)
+        length += high * shift
+    return length + (x != 0)
+
+
+def _finalize_hash(h):
+    # the finaliser of MurmurHash3, so that all bits of the hashes are
+    # mixed
+    with np.errstate(over='ignore'):
+        h = h ^ (h >> np.uint64(33))
+        h = h * np.uint64(0xFF51AFD7ED558CCD)
+        h = h ^ (h >> np.uint64(33))
+        h = h * np.uint64(0xC4CEB9FE1A85EC53)
+        return h ^ (h >> np.uint64(33))
+
+
+class HyperLogLog(Sketch):
+    '''
+    Estimates the number of distinct values with HyperLogLog (Flajolet et
+    al, 2007) using `2 ** precision` registers of one byte. The relative
+    standard error is about `1.04 / sqrt(2 ** precision)`, that is 1.6% for
+    the default precision. Numbers are hashed by their binary
+    representation, so an integer and a float of the same value are
+    distinct. Strings and bytes are hashed with 64 bit digests.
+
+    :param precision: the number of bits that select a register, between 4
+        and 18
+    :param seed: seed of the hash function
+    '''
+
+    def __init__(self, precision=12, seed=0):
+        if not 4 <= precision <= 18:
+            raise ValueError('Precision must be between 4 and 18')
+        self.precision = precision
+        self.seed = seed
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values):
+        values = _to_array(values)
+        if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+            values = values.astype(np.float64).view(np.int64)
+        hashes = _finalize_hash(np.asarray(
+            stable_hash_array(values, self.seed, strong=True),
+            dtype=np.uint64))
+        bits = 64 - self.precision
+        indexes = (hashes >> np.uint64(bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        ranks = bits + 1 - _bit_length(rest)
+        np.maximum.at(self.registers, indexes, ranks.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def result(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(
+            np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+def _get_values(items, index):
+    if isinstance(items[0], np.ndarray):
+        # each data item is a block of values
+        if index is not None:
+            items = [item[:, index] for item in items]
+        return np.concatenate(items)
+    if index is None:
+        return items
+    if isinstance(index, list):
+        return list(map(itemgetter(*index), items))
+    return list(map(itemgetter(index), items))
+
+
+class SketchPE(BatchPE):
+    '''
+    Adds blocks of data items to a sketch and writes the sketch, that is the
+    partial state of the aggregation, when processing is complete.
+    If a key is given the data items are aggregated separately for each
+    key, in a copy of the sketch, and the PE writes `[key, sketch]` for each
+    key.
+    A data item may also be a NumPy array, which is a block of values or
+    of rows. If a key is given, the rows of a block are grouped by the
+    values in the key column.
+
+    :param sketch: the sketch, for example :py:class:`Moments`
+    :param index: the index of the values in each data item, a list of
+        indexes, or None to use the whole data item
+    :param key: the index of the key in each data item (optional)
+    :param batch_size: the number of data items in a block
+    '''
+    INPUT_NAME = 'input'
+    OUTPUT_NAME = 'output'
+
+    def __init__(self, sketch, index=0, key=None, batch_size=1000):
+        BatchPE.__init__(self, batch_size)
+        self._add_input(self.INPUT_NAME)
+        self._add_output(self.OUTPUT_NAME)
+        self.sketch = sketch
+        self.index = index
+        self.key = key
+        self.sketches = {}
+
+    def process_batch(self, inputs):
+        items = inputs[self.INPUT_NAME]
+        if self.key is None:
+            self.sketch.update(_get_values(items, self.index))
+            return
+        if isinstance(items, np.ndarray):
+            # the block was passed as one array of rows
+            items = [items]
+        if isinstance(items[0], np.ndarray):
+            for block in items:
+                self._update_block(block)
+            return
+        groups = {}
+        for item in items:
+            try:
+                groups[item[self.key]].append(item)
+            except KeyError:
+                groups[item[self.key]] = [item]
+        for key, group in groups.items():
+            self._get_sketch(key).update(_get_values(group, self.index))
+
+    def _update_block(self, block):
+        # split the rows of the block by the values of the key column
+        keys, inverse = np.unique(block[:, self.key], return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for i, key in enumerate(keys.tolist()):
+            self._get_sketch(key).update(
+                _get_values([block[inverse == i]], self.index))
+
+    def _get_sketch(self, key):
+        try:
+            return self.sketches[key]
+        except KeyError:
+            sketch = self.sketches[key] = copy.deepcopy(self.sketch)
+            return sketch
+
+    def _postprocess(self):
+        if self.key is None:
+            self.write(self.OUTPUT_NAME, self.sketch)
+        else:
+            for key, sketch in self.sketches.items():
+                self.write(self.OUTPUT_NAME, [key, sketch])
+
+
+class MergeSketchPE(GenericPE):
+    '''
+    Merges the partial sketches written by instances of
+    :py:class:`SketchPE` and writes the result of the aggregation, or
+    `[key, result]` for each key if the sketches are keyed.
+
+    :param keyed: whether the input data items are `[key, sketch]`
+    '''
+    INPUT_NAME = 'input'
+    OUTPUT_NAME = 'output'
+
+    def __init__(self, keyed=False):
+        GenericPE.__init__(self)
+        self._add_input(self.INPUT_NAME,
+                        grouping=[0] if keyed else 'global')
+        self._add_output(self.OUTPUT_NAME)
+        self.keyed = keyed
+        self.sketches = {}
+
+    def _process(self, inputs):
+        if self.keyed:
+            key, sketch = inputs[self.INPUT_NAME]
+        else:
+            key, sketch = None, inputs[self.INPUT_NAME]
+        try:
+            self.sketches[key].merge(sketch)
+        except KeyError:
+            self.sketches[key] = sketch
+
+    def _postprocess(self):
+        for key, sketch in self.sketches.items():
+            if self.keyed:
+                self.write(self.OUTPUT_NAME, [key, sketch.result()])
+            else:
+                self.write(self.OUTPUT_NAME, sketch.result())
+
+
+def parallel_sketch(sketch, index=0, key=None):
+    '''
+    Creates a composite PE that aggregates data items with a sketch and
+    can be parallelised using a map-reduce pattern. Without a key the
+    partial sketches are merged by one process, otherwise the keys are
+    distributed among the reducers.
+
+    :param sketch: the sketch
+    :param index: the index or list of indexes of the values in each data
+        item, or None for the whole data item
+    :param key: the index of the key in each data item (optional)
+    '''
+    if key is None:
+        return parallel_aggregate(SketchPE(sketch, index), MergeSketchPE())
+    composite = WorkflowGraph()
+    inst = SketchPE(sketch, index, key)
+    merge = MergeSketchPE(keyed=True)
+    composite.connect(inst, SketchPE.OUTPUT_NAME,
+                      merge, MergeSketchPE.INPUT_NAME)
+    composite.inputmappings = {'input': (inst, SketchPE.INPUT_NAME)}
+    composite.outputmappings = {'output': (merge, MergeSketchPE.OUTPUT_NAME)}
+    return composite
+
+
+def parallelStats(indexes=[0], key=None):
+    '''
+    Creates a composite PE that computes the count, sum, mean, variance,
+    standard deviation, minimum and maximum of the given columns, see
+    :py:class:`Moments`.
+    '''
+    return parallel_sketch(Moments(), list(indexes), key)
+
+
+def parallelQuantiles(quantiles=[0.5], index=0, key=None, accuracy=0.01):
+    '''
+    Creates a composite PE that estimates quantiles, see
+    :py:class:`QuantileSketch`.
+    '''
+    return parallel_sketch(QuantileSketch(quantiles, accuracy), index, key)
+
+
+def parallelHistogram(edges, index=0, key=None):
+    '''
+    Creates a composite PE that counts values in bins, see
+    :py:class:`Histogram`.
+    '''
+    return parallel_sketch(Histogram(edges), index, key)
+
+
+def parallelTopK(k=10, index=0, key=None, capacity=None):
+    '''
+    Creates a composite PE that finds the most frequent values, see
+    :py:class:`TopK`.
+    '''
+    return parallel_sketch(TopK(k, capacity), index, key)
+
+
+def parallelDistinctCount(index=0, key=None, precision=12):
+    '''
+    Creates a composite PE that estimates the number of distinct values, see
+    :py:class:`HyperLogLog`.
+    '''
+    return parallel_sketch(HyperLogLog(precision), index, key)
@@ -29,9 +29,12 @@ from dispel4py.examples.graph_testing.testing_PEs \
     import NumberProducer
 from dispel4py.new.aggregate \
     import parallelSum, parallelCount, parallelMin, parallelMax, parallelAvg, \
-    parallelStdDev, ContinuousReducePE
+    parallelStdDev, ContinuousReducePE, parallelStats, parallelQuantiles, \
+    parallelHistogram, parallelTopK, parallelDistinctCount, Moments, \
+    QuantileSketch, TopK, HyperLogLog, Sketch, SketchPE
 
 from dispel4py.new import simple_process
+from dispel4py.base import SimpleFunctionPE
 from dispel4py.workflow_graph import WorkflowGraph
 
 from nose import tools
@@ -160,6 +163,116 @@ def testContinuousReduce():
     tools.eq_({test.id: {'output': [[0] for i in range(5)]}}, results)
 
 
+def _aggregate(composite, function=None):
+    prod = NumberProducer(1000)
+    graph = WorkflowGraph()
+    if function is None:
+        graph.connect(prod, 'output', composite, 'input')
+    else:
+        pe = SimpleFunctionPE(function)
+        graph.connect(prod, 'output', pe, 'input')
+        graph.connect(pe, 'output', composite, 'input')
+    graph.flatten()
+    results = simple_process.process_and_return(graph, {prod: [{}]})
+    tools.eq_(1, len(results))
+    return list(results.values())[0]['output']
+
+
+def testStats():
+    result = _aggregate(parallelStats())
+    tools.eq_(1, len(result))
+    stats = result[0]
+    tools.eq_(1000, stats['count'])
+    tools.eq_([499500.0], stats['sum'])
+    tools.eq_([499.5], stats['mean'])
+    tools.assert_almost_equal(1000 * 1001 / 12.0, stats['variance'][0])
+    tools.eq_([0.0], stats['min'])
+    tools.eq_([999.0], stats['max'])
+
+
+@tools.raises(TypeError)
+def testSketchAbstract():
+    Sketch()
+
+
+def testMomentsMerge():
+    # the sum of squares loses all precision with this offset
+    values = [1e9 + i % 3 for i in range(3000)]
+    moments = Moments()
+    for i in range(0, 3000, 700):
+        partial = Moments()
+        partial.update(values[i:i + 700])
+        moments.merge(partial)
+    tools.eq_(3000, moments.result()['count'])
+    tools.assert_almost_equal(2000.0 / 2999, moments.result()['variance'][0])
+
+
+def testQuantiles():
+    result = _aggregate(parallelQuantiles([0, 0.5, 0.9]))
+    low, median, high = result[0]
+    tools.eq_(0, low)
+    tools.ok_(abs(median - 499) <= 0.01 * 499)
+    tools.ok_(abs(high - 899) <= 0.01 * 899)
+    sketch = QuantileSketch([0.5])
+    sketch.update([-3, -2, -1])
+    other = QuantileSketch([0.5])
+    other.update([0, 0])
+    sketch.merge(other)
+    tools.eq_([-1], [round(v, 1) for v in sketch.result()])
+
+
+def testHistogram():
+    result = _aggregate(parallelHistogram([0, 100, 500]))
+    tools.eq_([{'edges': [0, 100, 500], 'counts': [100, 400],
+                'underflow': 0, 'overflow': 500}], result)
+
+
+def testTopK():
+    sketch = TopK(2, capacity=3)
+    sketch.update(['a', 'b', 'a', 'c', 'a', 'd', 'b'])
+    tools.eq_('a', sketch.result()[0][0])
+    other = TopK(2, capacity=3)
+    other.update(['b'] * 5 + ['e'])
+    sketch.merge(other)
+    tools.eq_(['b', 'a'], [key for key, count in sketch.result()])
+    result = _aggregate(parallelTopK(1), lambda data: [min(data[0] % 10, 3)])
+    tools.eq_([[[3, 700]]], result)
+
+
+def testDistinctCount():
+    result = _aggregate(parallelDistinctCount())
+    tools.ok_(abs(result[0] - 1000) < 20)
+    sketch = HyperLogLog()
+    sketch.update(range(50000))
+    other = HyperLogLog()
+    other.update(['w%s' % i for i in range(50000)])
+    sketch.merge(other)
+    tools.ok_(abs(sketch.result() - 100000) < 5000)
+
+
+def testKeyedStats():
+    result = _aggregate(parallelStats(indexes=[1], key=0),
+                        lambda data: [data[0] % 2, data[0]])
+    tools.eq_([0, 1], sorted(key for key, s in result))
+    for key, s in result:
+        tools.eq_(500, s['count'])
+        tools.eq_([499.0 + key], s['mean'])
+
+
+def testKeyedArrayBlock():
+    import numpy as np
+    pe = SketchPE(Moments(), index=1, key=0)
+    # rows of a key, such as a station, and a value
+    block = np.array([[i % 3, i] for i in range(30)], dtype='f8')
+    pe.process_batch({'input': [block]})
+    # a columnar block is one array
+    pe.process_batch({'input': block})
+    tools.eq_([0, 1, 2], sorted(pe.sketches))
+    for key, sketch in pe.sketches.items():
+        tools.eq_(20, sketch.result()['count'])
+        tools.eq_([key + 13.5], sketch.result()['mean'])
+
+
 sum_wf = graph_sum()
 avg_wf = graph_avg()
 min_wf = graph_min_max()
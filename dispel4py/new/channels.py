@@ -0,0 +1,395 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Communication channels between the processes of the multiprocessing mapping.
+
+:py:class:`BoundedQueue` is an input queue with a capacity in messages and
+in bytes for each edge from a producer to the consumer. Producers block
+when their edge is full so that the memory used by the queue remains
+bounded if a consumer falls behind.
+
+:py:class:`SharedMemoryQueue` is a ring buffer in shared memory that can be
+used instead of a `multiprocessing.Queue`. Data is pickled directly into the
+ring without passing through a pipe, and large buffers such as NumPy arrays
+are copied into shared memory without creating an intermediate pickle.
+This requires Python 3.8 or later. Messages that are larger than half of the
+ring are sent through a `multiprocessing.Queue` instead, in order.
+
+Both queues record a high-water mark, the maximum number of messages and
+bytes that were held in the queue at any time. If the consumer fails it
+aborts its queue, and producers raise :py:class:`QueueAborted` instead of
+waiting for space that is never freed.
+'''
+
+import multiprocessing
+import pickle
+import struct
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# the ring header contains the read position, the write position, a flag
+# that is set while a producer is waiting for space, the number of messages
+# written and read, the high-water marks, and a flag that is set when the
+# consumer has aborted.
+# Each field is only updated by one side.
+_LENGTH = struct.Struct('q')
+_HEAD, _TAIL, _WAITING, _PUT, _GET, _MAX_ITEMS, _MAX_BYTES, _ABORTED = \
+    0, 8, 16, 24, 32, 40, 48, 56
+_HEADER_SIZE = 64
+# record header: length of pickle data, number of out-of-band buffers
+_RECORD = struct.Struct('qq')
+_WRAP = -1
+# number of buffers of a record that marks a message sent through the
+# overflow queue
+_OVERFLOW = -1
+_ALIGN = 8
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class QueueAborted(Exception):
+    '''
+    Raised when data is written to a queue whose consumer has aborted.
+    '''
+    pass
+
+
+class BoundedQueue(object):
+    '''
+    The input queue of a consumer with a maximum number of messages and a
+    maximum size in bytes for each edge, that is for each producer that
+    writes to the queue. A producer blocks if its edge is full until the
+    consumer removes data, so a fast producer does not take up the capacity
+    that is available to the other producers. A message that is larger than
+    the maximum size is accepted if the edge is empty.
+
+    Producers write to an edge that is returned by :py:meth:`edge`, or to
+    the edge of producer 0 if they call :py:meth:`put`. Each message is
+    pickled once and sent through a pipe as bytes.
+
+    :param max_items: maximum number of messages of each edge (optional)
+    :param max_bytes: maximum size of the messages of each edge (optional)
+    :param num_edges: number of producers, which are identified by their
+        index in this range
+    '''
+
+    # indexes of the statistics of the queue
+    ITEMS, BYTES, MAX_ITEMS, MAX_BYTES = range(4)
+    # indexes of the statistics of an edge
+    EDGE_ITEMS, EDGE_BYTES, EDGE_WAITING = range(3)
+
+    def __init__(self, max_items=None, max_bytes=None, num_edges=1):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.num_edges = num_edges
+        self._reader, self._writer = multiprocessing.Pipe(duplex=False)
+        self._write_lock = multiprocessing.Lock()
+        self._cond = multiprocessing.Condition()
+        self._aborted = multiprocessing.Event()
+        self._stats = multiprocessing.Array('q', 4 + 3 * num_edges,
+                                            lock=False)
+
+    def edge(self, index):
+        '''
+        Returns the edge of the producer with the given index, which has a
+        method `put` and can be used instead of the queue.
+        '''
+        if not 0 <= index < self.num_edges:
+            raise ValueError('Edge %s does not exist, queue has %s edges'
+                             % (index, self.num_edges))
+        return _Edge(self, index)
+
+    def _is_full(self, offset, size):
+        stats = self._stats
+        if stats[offset + self.EDGE_ITEMS] == 0:
+            return False
+        if self.max_items is not None and \
+                stats[offset + self.EDGE_ITEMS] >= self.max_items:
+            return True
+        return self.max_bytes is not None and \
+            stats[offset + self.EDGE_BYTES] + size > self.max_bytes
+
+    def put(self, obj, edge=0):
+        data = pickle.dumps((edge, obj), pickle.HIGHEST_PROTOCOL)
+        stats = self._stats
+        offset = 4 + 3 * edge
+        with self._cond:
+            while self._is_full(offset, len(data)):
+                if self._aborted.is_set():
+                    raise QueueAborted(
+                        'The consumer of the queue has aborted')
+                stats[offset + self.EDGE_WAITING] += 1
+                # check the abort flag regularly in case the notification
+                # of the consumer was missed
+                self._cond.wait(0.1)
+                stats[offset + self.EDGE_WAITING] -= 1
+            stats[offset + self.EDGE_ITEMS] += 1
+            stats[offset + self.EDGE_BYTES] += len(data)
+            stats[self.ITEMS] += 1
+            stats[self.BYTES] += len(data)
+            stats[self.MAX_ITEMS] = max(stats[self.MAX_ITEMS],
+                                        stats[self.ITEMS])
+            stats[self.MAX_BYTES] = max(stats[self.MAX_BYTES],
+                                        stats[self.BYTES])
+        with self._write_lock:
+            self._writer.send_bytes(data)
+
+    def get(self):
+        data = self._reader.recv_bytes()
+        edge, obj = pickle.loads(data)
+        stats = self._stats
+        offset = 4 + 3 * edge
+        with self._cond:
+            stats[offset + self.EDGE_ITEMS] -= 1
+            stats[offset + self.EDGE_BYTES] -= len(data)
+            stats[self.ITEMS] -= 1
+            stats[self.BYTES] -= len(data)
+            if stats[offset + self.EDGE_WAITING]:
+                self._cond.notify_all()
+        return obj
+
+    def empty(self):
+        '''
+        Returns whether the queue is empty. The result is approximate if
+        other processes access the queue at the same time.
+        '''
+        return not self._reader.poll()
+
+    def abort(self):
+        '''
+        Called by the consumer when it stops reading. Producers that wait
+        for space raise :py:class:`QueueAborted`.
+        '''
+        self._aborted.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def high_water_mark(self):
+        '''
+        Returns the maximum number of messages and bytes that were held in
+        the queue.
+        '''
+        return self._stats[self.MAX_ITEMS], self._stats[self.MAX_BYTES]
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+class _Edge(object):
+    '''
+    The end of a bounded queue that is used by one producer.
+    '''
+
+    def __init__(self, queue, index):
+        self.queue = queue
+        self.index = index
+
+    def put(self, obj):
+        self.queue.put(obj, self.index)
+
+
+def _dumps(obj):
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return data, [b.raw() for b in buffers]
+
+
+class SharedMemoryQueue(object):
+    '''
+    A queue backed by a ring buffer in shared memory.
+    The queue supports one consumer process and either a single producer
+    or, if `multi_producer` is set, many producers which are serialised by
+    a lock.
+
+    :param capacity: size of the ring buffer in bytes
+    :param multi_producer: whether more than one process writes to the queue
+    :param max_items: maximum number of messages in the queue (optional)
+    '''
+
+    def __init__(self, capacity=2**24, multi_producer=False, max_items=None):
+        if shared_memory is None:
+            raise Exception('Shared memory queues require Python 3.8 or later')
+        self.capacity = _align(capacity)
+        self.max_items = max_items
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=_HEADER_SIZE + self.capacity)
+        self._attach()
+        for field in range(0, _HEADER_SIZE, _LENGTH.size):
+            _LENGTH.pack_into(self._header, field, 0)
+        self._items = multiprocessing.Semaphore(0)
+        self._space = multiprocessing.Semaphore(0)
+        self._lock = multiprocessing.Lock() if multi_producer else None
+        # messages that do not fit into the ring
+        self._overflow = multiprocessing.Queue()
+
+    def _attach(self):
+        self._header = self.shm.buf[:_HEADER_SIZE]
+        self._ring = self.shm.buf[_HEADER_SIZE:]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_header']
+        del state['_ring']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def put(self, obj):
+        data, buffers = _dumps(obj)
+        size = _RECORD.size + _LENGTH.size * len(buffers) + _align(len(data))
+        for b in buffers:
+            size += _align(b.nbytes)
+        if self._lock is None:
+            self._put_message(obj, data, buffers, size)
+        else:
+            with self._lock:
+                self._put_message(obj, data, buffers, size)
+        self._items.release()
+
+    def _put_message(self, obj, data, buffers, size):
+        # a record of at most half the ring always fits once the consumer
+        # has freed the space, even if it must skip the end of the ring
+        if 2 * size <= self.capacity:
+            self._put(data, buffers, size)
+        else:
+            # a marker in the ring keeps the order of the messages
+            self._put(b'', [], _RECORD.size, _OVERFLOW)
+            self._overflow.put(obj)
+
+    def _read_field(self, field):
+        return _LENGTH.unpack_from(self._header, field)[0]
+
+    def _write_field(self, field, value):
+        _LENGTH.pack_into(self._header, field, value)
+
+    def _is_full(self, end, num_items):
+        if end - self._read_field(_HEAD) > self.capacity:
+            return True
+        return self.max_items is not None and \
+            num_items - self._read_field(_GET) > self.max_items
+
+    def _put(self, data, buffers, size, num_buffers=None):
+        tail = self._read_field(_TAIL)
+        pos = tail % self.capacity
+        # records are contiguous so skip the end of the ring if required
+        skip = self.capacity - pos if pos + size > self.capacity else 0
+        end = tail + skip + size
+        num_items = self._read_field(_PUT) + 1
+        while self._is_full(end, num_items):
+            if self._read_field(_ABORTED):
+                raise QueueAborted('The consumer of the queue has aborted')
+            # wait for the consumer to free space
+            self._write_field(_WAITING, 1)
+            self._space.acquire(True, 0.01)
+        self._write_field(_WAITING, 0)
+        if skip:
+            _LENGTH.pack_into(self._ring, pos, _WRAP)
+            pos = 0
+        if num_buffers is None:
+            num_buffers = len(buffers)
+        _RECORD.pack_into(self._ring, pos, len(data), num_buffers)
+        offset = pos + _RECORD.size
+        for b in buffers:
+            _LENGTH.pack_into(self._ring, offset, b.nbytes)
+            offset += _LENGTH.size
+        self._ring[offset:offset + len(data)] = data
+        offset += _align(len(data))
+        for b in buffers:
+            self._ring[offset:offset + b.nbytes] = b
+            offset += _align(b.nbytes)
+        self._write_field(_TAIL, end)
+        self._write_field(_PUT, num_items)
+        # the statistics are approximate as the consumer may have removed
+        # messages in the meantime
+        head = self._read_field(_HEAD)
+        self._write_field(_MAX_BYTES,
+                          max(end - head, self._read_field(_MAX_BYTES)))
+        self._write_field(_MAX_ITEMS,
+                          max(num_items - self._read_field(_GET),
+                              self._read_field(_MAX_ITEMS)))
+
+    def get(self):
+        self._items.acquire()
+        head = self._read_field(_HEAD)
+        pos = head % self.capacity
+        if _LENGTH.unpack_from(self._ring, pos)[0] == _WRAP:
+            head += self.capacity - pos
+            pos = 0
+        length, num_buffers = _RECORD.unpack_from(self._ring, pos)
+        offset = pos + _RECORD.size
+        if num_buffers == _OVERFLOW:
+            self._release(head, offset - pos)
+            return self._overflow.get()
+        sizes = []
+        for i in range(num_buffers):
+            sizes.append(_LENGTH.unpack_from(self._ring, offset)[0])
+            offset += _LENGTH.size
+        data = self._ring[offset:offset + length]
+        offset += _align(length)
+        buffers = []
+        for n in sizes:
+            buffers.append(bytearray(self._ring[offset:offset + n]))
+            offset += _align(n)
+        obj = pickle.loads(data, buffers=buffers)
+        data.release()
+        self._release(head, offset - pos)
+        return obj
+
+    def _release(self, head, size):
+        # release the space in the ring and wake up a waiting producer
+        self._write_field(_HEAD, head + size)
+        self._write_field(_GET, self._read_field(_GET) + 1)
+        if self._read_field(_WAITING):
+            self._space.release()
+
+    def empty(self):
+        '''
+        Returns whether the queue is empty. The result is approximate if
+        other processes access the queue at the same time.
+        '''
+        return self._read_field(_PUT) == self._read_field(_GET)
+
+    def abort(self):
+        '''
+        Called by the consumer when it stops reading. Producers that wait
+        for space raise :py:class:`QueueAborted`.
+        '''
+        self._write_field(_ABORTED, 1)
+
+    def high_water_mark(self):
+        '''
+        Returns the maximum number of messages and bytes that were held in
+        the queue.
+        '''
+        return self._read_field(_MAX_ITEMS), self._read_field(_MAX_BYTES)
+
+    def close(self):
+        '''
+        Releases the shared memory. This must be called by the process that
+        created the queue when all processes have finished using it.
+        '''
+        self._header.release()
+        self._ring.release()
+        self.shm.close()
+        self.shm.unlink()
+        self._overflow.close()
@@ -0,0 +1,113 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Combiners merge the data items with the same key that an instance of a PE
+writes to an output before they are sent to the consumers, as the
+combiners of MapReduce. A combiner is declared for an output, for
+example::
+
+    import operator
+    from dispel4py.new.combiners import Combiner
+
+    class WordCount(IterativePE):
+        def __init__(self):
+            IterativePE.__init__(self)
+            # data items are (word, count)
+            self._add_output('output', combiner=Combiner(operator.add))
+
+Each instance holds the merged values of at most `capacity` keys. When
+another key is written all merged data items are written to the output,
+and the remaining data items are written after the PE has been
+postprocessed. The consumers therefore receive partial aggregates, in any
+order, and must merge the values of a key in the same way, for example
+with a grouping by key.
+
+The merge function must be associative and, for the MPI mappings,
+picklable, for example a function of the module :py:mod:`operator`.
+'''
+
+
+class Combiner(object):
+    '''
+    Merges the values of data items with the same key.
+
+    :param merge: a function that merges two values and returns the result
+    :param key: the index of the key in each data item, or a function that
+        returns the key of a data item
+    :param value: the index of the value in each data item, or None if the
+        merge function merges whole data items
+    :param capacity: the maximum number of keys that are held
+    '''
+
+    def __init__(self, merge, key=0, value=1, capacity=10000):
+        self.merge = merge
+        self.key = key
+        self.value = value
+        self.capacity = capacity
+        self._items = {}
+
+    def get_key(self, data):
+        '''
+        Returns the key of a data item.
+        '''
+        if callable(self.key):
+            return self.key(data)
+        return data[self.key]
+
+    def add(self, data):
+        '''
+        Merges a data item with the data items of the same key.
+
+        :rtype: a list of data items that must be written, which is empty
+            unless the capacity was exceeded
+        '''
+        key = self.get_key(data)
+        items = self._items
+        try:
+            merged = items[key]
+        except KeyError:
+            flushed = self.flush() if len(items) >= self.capacity else []
+            self._items[key] = [data, None if self.value is None
+                                else data[self.value]]
+            return flushed
+        except TypeError:
+            # keys that are not hashable are not combined
+            return [data]
+        if self.value is None:
+            merged[0] = self.merge(merged[0], data)
+        else:
+            merged[1] = self.merge(merged[1], data[self.value])
+        return []
+
+    def _get_item(self, data, value):
+        if self.value is None:
+            return data
+        if isinstance(data, tuple):
+            return data[:self.value] + (value,) + data[self.value + 1:]
+        data = type(data)(data)
+        data[self.value] = value
+        return data
+
+    def flush(self):
+        '''
+        Returns the merged data items and removes them.
+        '''
+        items = self._items
+        self._items = {}
+        return [self._get_item(data, value) for data, value in items.values()]
+
+    def __repr__(self):
+        return 'Combiner(%r, key=%r, value=%r, capacity=%r)' % (
+            self.merge, self.key, self.value, self.capacity)
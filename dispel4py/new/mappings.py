@@ -1,5 +1,6 @@
 config = {
     "mpi": "dispel4py.new.mpi_process",
+    "mpi_queue": "dispel4py.new.mpi_queue_process",
     "multi": "dispel4py.new.multi_process",
     "simple": "dispel4py.new.simple_process",
     "storm": "dispel4py.storm.storm_submission",
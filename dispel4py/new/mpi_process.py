@@ -26,6 +26,34 @@ with parameters
 :-f file:   file containing input data in JSON format (optional)
 :-i iter:   number of iterations to compute (default is 1)
 :-h:        print this help page
+:--batch-size size:         maximum number of data items that are sent to a
+                            consumer in one message (default is 1)
+:--batch-latency seconds:   maximum time that a data item is buffered before
+                            it is sent to a consumer (default is 0.1)
+:--send-window num:         maximum number of outstanding non-blocking sends
+                            of a process (default is 100)
+:--dynamic:                 distribute data on inputs without grouping to
+                            the instance with the fewest pending data items
+                            instead of round robin
+:--data-mode mode:          how data is passed to more than one consumer
+                            within a partition: 'copy' (default), 'shared'
+                            or 'checked' (see
+                            :py:class:`~dispel4py.new.processor.SimpleProcessingPE`)
+:--costs file:              file with the costs of the PEs measured by the
+                            simple mapping, used to assign processes so that
+                            the load is balanced (see
+                            :py:func:`~dispel4py.new.processor.get_costs`)
+:--plan:                    print the number of processes of each PE and the
+                            predicted throughput
+:--fuse:                    execute chains of PEs in one process (see
+                            :py:func:`~dispel4py.new.processor.fuse_chains`).
+                            A fused chain may run more instances than its
+                            PEs would on their own, so the order of the
+                            results can change.
+:--plan-cache dir:          directory of compiled plans: the mapping of a
+                            graph is saved and reused by later runs of a
+                            graph with the same structure and options (see
+                            :py:class:`~dispel4py.new.processor.CompiledPlan`)
 
 For example::
 
@@ -55,7 +83,7 @@ rank = comm.Get_rank()
 size = comm.Get_size()
 
 from dispel4py.new.processor\
-    import GenericWrapper, simpleLogger, STATUS_TERMINATED, STATUS_ACTIVE
+    import BatchingWrapper, simpleLogger, STATUS_TERMINATED, STATUS_ACTIVE
 from dispel4py.new import processor
 
 import argparse
@@ -63,6 +91,11 @@ import sys
 import types
 import traceback
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def mpi_excepthook(type, value, trace):
     '''
@@ -81,92 +114,278 @@ def parse_args(args, namespace):
         description='Submit a dispel4py graph to MPI processes.')
     parser.add_argument('-s', '--simple', help='force simple processing',
                         action='store_true')
+    parser.add_argument('--dynamic', action='store_true',
+                        help='balance the load of PE instances dynamically')
+    parser.add_argument('--batch-size', metavar='size', type=int, default=1,
+                        help='maximum number of data items per message')
+    parser.add_argument('--batch-latency', metavar='seconds', type=float,
+                        default=0.1,
+                        help='maximum time that output data is buffered')
+    parser.add_argument('--send-window', metavar='num', type=int,
+                        default=100,
+                        help='maximum number of outstanding sends')
+    parser.add_argument('--data-mode', choices=processor.DATA_MODES,
+                        help='passing of data to more than one consumer '
+                             'within a partition')
+    parser.add_argument('--costs', metavar='file',
+                        help='measured costs of the PEs')
+    parser.add_argument('--fuse', action='store_true',
+                        help='fuse chains of PEs into one process')
+    parser.add_argument('--plan-cache', metavar='dir',
+                        help='directory of compiled plans')
+    parser.add_argument('--plan', action='store_true',
+                        help='print the assignment of processes')
     result = parser.parse_args(args, namespace)
     return result
 
 
 def process(workflow, inputs, args):
-    processes = {}
-    inputmappings = {}
-    outputmappings = {}
-    success = True
-    nodes = [node.getContainedObject() for node in workflow.graph.nodes()]
-    if rank == 0 and not args.simple:
-        try:
-            processes, inputmappings, outputmappings =\
-                processor.assign_and_connect(workflow, size)
-        except:
-            success = False
-    success = comm.bcast(success, root=0)
-
-    if args.simple or not success:
-        ubergraph = processor.create_partitioned(workflow)
-        nodes = [node.getContainedObject() for node in ubergraph.graph.nodes()]
-        if rank == 0:
-            print('Partitions: %s' % ', '.join(('[%s]' % ', '.join(
-                (pe.id for pe in part)) for part in workflow.partitions)))
-            for node in ubergraph.graph.nodes():
-                wrapperPE = node.getContainedObject()
-                print('%s contains %s' % (wrapperPE.id,
-                                          [n.getContainedObject().id for n in
-                                           wrapperPE.workflow.graph.nodes()]))
-            try:
-                processes, inputmappings, outputmappings =\
-                    processor.assign_and_connect(ubergraph, size)
-                inputs = processor.map_inputs_to_partitions(ubergraph, inputs)
-                success = True
-            except:
-                # print traceback.format_exc()
-                print('dispel4py.mpi_process: \
-                    Not enough processes for execution of graph')
-                success = False
-
-    success = comm.bcast(success, root=0)
-
-    if not success:
-        return
-
     try:
-        inputs = {pe.id: v for pe, v in inputs.items()}
+        dynamic = args.dynamic
     except AttributeError:
-        pass
-    processes = comm.bcast(processes, root=0)
-    inputmappings = comm.bcast(inputmappings, root=0)
-    outputmappings = comm.bcast(outputmappings, root=0)
-    inputs = comm.bcast(inputs, root=0)
-
+        dynamic = False
+    plan, planned = None, None
     if rank == 0:
-        print('Processes: %s' % processes)
-        # print 'Inputs: %s' % inputs
+        plan, planned = processor.create_flat_plan(workflow, inputs, args,
+                                                   size, dynamic)
+        if plan is None:
+            print('dispel4py.mpi_process: '
+                  'Not enough processes for execution of graph')
+    # the plan is sent to all processes at once, and each process creates
+    # only its own PE and connections
+    plan = comm.bcast(plan, root=0)
+    if plan is None:
+        return
+    created = processor.create_process(
+        workflow, plan, rank, getattr(args, 'data_mode', None), dynamic,
+        planned)
+
+    # partitioners may prefer consumers on the same host
+    hosts = dict(enumerate(comm.allgather(MPI.Get_processor_name())))
+
+    # consumers acknowledge data items on a separate communicator
+    ack_comm = comm.Dup() if dynamic else None
+    batch_size, batch_latency = processor.get_batch_config(args)
+    window = getattr(args, 'send_window', None) or 100
+
+    if created is not None:
+        pe, inputmappings, outputmappings, provided_inputs = created
+        wrapper = MPIWrapper(pe, provided_inputs,
+                             batch_size, batch_latency, window)
+        wrapper.targets = outputmappings
+        wrapper.sources = inputmappings
+        processor.set_hosts(wrapper.targets, hosts)
+        if ack_comm is not None:
+            wrapper.set_ack_comm(ack_comm)
+        wrapper.process()
+
+    if ack_comm is not None:
+        free_ack_comm(ack_comm)
+
+
+# tags of messages that contain NumPy arrays
+TAG_ARRAY_HEADER = 20
+TAG_ARRAY_DATA = 21
+# arrays smaller than this are pickled
+ARRAY_THRESHOLD = 4096
+
+
+class ArrayPlaceholder(object):
+    '''
+    Replaces a NumPy array in a pickled message. The contents of the array
+    are sent in a separate message using the buffer interface.
+    '''
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getstate__(self):
+        return self.index
+
+    def __setstate__(self, index):
+        self.index = index
+
+
+def _is_array(data):
+    return np is not None and isinstance(data, np.ndarray) \
+        and not data.dtype.hasobject and data.nbytes >= ARRAY_THRESHOLD
+
+
+def _extract(data, arrays):
+    if _is_array(data):
+        arrays.append(np.ascontiguousarray(data))
+        return ArrayPlaceholder(len(arrays) - 1)
+    if isinstance(data, dict) and any(_is_array(v) for v in data.values()):
+        return {k: _extract(v, arrays) for k, v in data.items()}
+    return data
+
+
+def extract_arrays(batch):
+    '''
+    Replaces large NumPy arrays in a batch of data items, or values of
+    dictionaries in the data items, by placeholders.
+    The data items are not modified.
 
-    for pe in nodes:
-        if rank in processes[pe.id]:
-            provided_inputs = processor.get_inputs(pe, inputs)
-            wrapper = MPIWrapper(pe, provided_inputs)
-            wrapper.targets = outputmappings[rank]
-            wrapper.sources = inputmappings[rank]
-            wrapper.process()
+    :rtype: a tuple of the new batch and the list of extracted arrays
+    '''
+    arrays = []
+    result = []
+    for item in batch:
+        result.append({name: _extract(data, arrays)
+                       for name, data in item.items()})
+    return result, arrays
+
+
+def _restore(data, arrays):
+    if isinstance(data, ArrayPlaceholder):
+        return arrays[data.index]
+    if isinstance(data, dict):
+        for k, v in data.items():
+            if isinstance(v, ArrayPlaceholder):
+                data[k] = arrays[v.index]
+    return data
+
+
+def restore_arrays(batch, arrays):
+    '''
+    Replaces the placeholders in a batch of data items by the arrays.
+    '''
+    for item in batch:
+        for name, data in item.items():
+            item[name] = _restore(data, arrays)
+    return batch
+
+
+def receive_arrays(header, source):
+    '''
+    Receives the arrays that follow a header from the given rank directly
+    into new arrays, and returns the batch of data items of the header with
+    the placeholders replaced.
+    '''
+    batch, specs = header
+    arrays = []
+    for dtype, shape in specs:
+        array = np.empty(shape, dtype=dtype)
+        comm.Recv([array, MPI.BYTE], source=source, tag=TAG_ARRAY_DATA)
+        arrays.append(array)
+    return restore_arrays(batch, arrays)
+
+
+class LoadBalancingMixin(object):
+    '''
+    Dynamic load balancing of the MPI wrappers. Consumers acknowledge the
+    data items that they have taken for processing and producers send data
+    on load balancing communications to the consumer with the fewest
+    unacknowledged items.
+    '''
+
+    def set_ack_comm(self, ack_comm, ack_interval=10):
+        '''
+        Enables dynamic load balancing. Consumers report the number of data
+        items received from each producer on the given communicator, at
+        least every `ack_interval` items and whenever they are idle.
+        Producers use the number of unacknowledged items of each consumer
+        for load balancing communications.
+        '''
+        self.ack_comm = ack_comm
+        self.ack_interval = ack_interval
+        self.acks = {}
+        self.ack_requests = []
+        self.load = {}
+        for targets in self.targets.values():
+            for inputName, communication in targets:
+                for i in communication.destinations:
+                    self.load[i] = 0
+                if isinstance(communication,
+                              processor.LoadBalancingCommunication):
+                    communication.load = self.load
+
+    def _send_ack(self, source):
+        num = self.acks.pop(source)
+        self.ack_requests.append(self.ack_comm.isend(num, dest=source))
+        if len(self.ack_requests) >= 1000:
+            MPI.Request.Waitall(self.ack_requests)
+            self.ack_requests = []
+
+    def _receive_acks(self):
+        status = MPI.Status()
+        while self.ack_comm.Iprobe(source=MPI.ANY_SOURCE, status=status):
+            num = self.ack_comm.recv(source=status.Get_source())
+            self.load[status.Get_source()] -= num
+
+    def _acknowledge(self, source, num):
+        self.acks[source] = self.acks.get(source, 0) + num
+        if self.acks[source] >= self.ack_interval:
+            self._send_ack(source)
+
+    def _send_all_acks(self):
+        for source in list(self.acks):
+            self._send_ack(source)
 
 
-class MPIWrapper(GenericWrapper):
+def free_ack_comm(ack_comm):
+    '''
+    Waits for all processes and frees the communicator of the
+    acknowledgements, discarding those that were sent to producers after
+    they terminated.
+    '''
+    comm.Barrier()
+    status = MPI.Status()
+    while ack_comm.Iprobe(source=MPI.ANY_SOURCE, status=status):
+        ack_comm.recv(source=status.Get_source())
+    ack_comm.Free()
+
+
+class MPIWrapper(LoadBalancingMixin, BatchingWrapper):
+    '''
+    Sends data to consumers in batches using non-blocking sends.
+    At most `window` sends may be outstanding before the wrapper waits for
+    some of them to complete.
+
+    Large NumPy arrays, either as data items or as values of dictionaries,
+    are not pickled. Instead the wrapper sends a header followed by the
+    contents of each array in a separate message, which the consumer
+    receives directly into a new array. Arrays must not be modified by a PE
+    after they were written, as they are sent asynchronously.
+    '''
 
-    def __init__(self, pe, provided_inputs=None):
-        GenericWrapper.__init__(self, pe)
+    def __init__(self, pe, provided_inputs=None,
+                 batch_size=1, batch_latency=None, window=100):
+        BatchingWrapper.__init__(self, pe, batch_size, batch_latency)
         self.pe.log = types.MethodType(simpleLogger, pe)
         self.pe.rank = rank
         self.provided_inputs = provided_inputs
         self.terminated = 0
+        self.ack_comm = None
+        self.window = max(1, window)
+        self.requests = []
 
     def _read(self):
+        self._flush_if_due()
         result = super(MPIWrapper, self)._read()
         if result is not None:
             return result
+        if self.input_buffer:
+            return self.input_buffer.popleft(), STATUS_ACTIVE
+        if not comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG):
+            self._flush_pe()
+        # deliver any buffered output before waiting for input
+        self._flush()
 
         status = MPI.Status()
+        if self.ack_comm is not None and self.acks and \
+                not comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG):
+            # idle so send all acknowledgements
+            self._send_all_acks()
         msg = comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
         tag = status.Get_tag()
         while tag == STATUS_TERMINATED:
             self.terminated += 1
+            # the producer has finished so it does not expect any more
+            # acknowledgements
+            if self.ack_comm is not None:
+                self.acks.pop(status.Get_source(), None)
             if self.terminated >= self._num_sources:
                 break
             else:
@@ -174,7 +393,16 @@ class MPIWrapper(GenericWrapper):
                                 tag=MPI.ANY_TAG,
                                 status=status)
                 tag = status.Get_tag()
-        return msg, tag
+        if tag == STATUS_TERMINATED:
+            return msg, tag
+        if tag == TAG_ARRAY_HEADER:
+            msg = receive_arrays(msg, status.Get_source())
+            tag = STATUS_ACTIVE
+        if self.ack_comm is not None:
+            self._acknowledge(status.Get_source(), len(msg))
+        # each message contains a batch of data items
+        self.input_buffer.extend(msg)
+        return self.input_buffer.popleft(), tag
 
     def _write(self, name, data):
         try:
@@ -183,26 +411,59 @@ class MPIWrapper(GenericWrapper):
             # no targets
             # self.pe.log('Produced output: %s' % {name: data})
             return
+        if self.ack_comm is not None:
+            self._receive_acks()
         for (inputName, communication) in targets:
             output = {inputName: data}
             dest = communication.getDestination(output)
             for i in dest:
-                try:
-                    # self.pe.log('Sending %s to %s' % (output, i))
-                    request = comm.isend(output, tag=STATUS_ACTIVE, dest=i)
-                    status = MPI.Status()
-                    request.Wait(status)
-                except:
-                    self.pe.log(
-                        'Failed to send data stream "%s" to rank %s: %s'
-                        % (name, i, traceback.format_exc()))
+                if self.ack_comm is not None:
+                    self.load[i] += 1
+                self._buffer(i, output)
+
+    def _wait_window(self):
+        if len(self.requests) >= self.window:
+            # wait for the older half of the outstanding sends to complete
+            num = max(1, len(self.requests) // 2)
+            MPI.Request.Waitall(self.requests[:num])
+            del self.requests[:num]
+
+    def _isend(self, data, tag, dest):
+        self._wait_window()
+        self.requests.append(comm.isend(data, tag=tag, dest=dest))
+
+    def _Isend(self, array, dest):
+        self._wait_window()
+        self.requests.append(
+            comm.Isend([array, MPI.BYTE], tag=TAG_ARRAY_DATA, dest=dest))
+
+    def _send_batch(self, dest, batch):
+        # errors are not caught so that the job is aborted instead of
+        # losing data (see mpi_excepthook)
+        # self.pe.log('Sending %s to %s' % (batch, dest))
+        if np is not None:
+            header, arrays = extract_arrays(batch)
+        else:
+            arrays = None
+        if arrays:
+            specs = [(a.dtype.str, a.shape) for a in arrays]
+            self._isend((header, specs), TAG_ARRAY_HEADER, dest)
+            for array in arrays:
+                self._Isend(array, dest)
+        else:
+            self._isend(batch, STATUS_ACTIVE, dest)
 
     def _terminate(self):
+        self._flush()
         for output, targets in self.targets.items():
             for (inputName, communication) in targets:
                 for i in communication.destinations:
                     # self.pe.log('Terminating consumer %s' % i)
-                    comm.isend(None, tag=STATUS_TERMINATED, dest=i)
+                    self._isend(None, STATUS_TERMINATED, i)
+        MPI.Request.Waitall(self.requests)
+        self.requests = []
+        if self.ack_comm is not None:
+            MPI.Request.Waitall(self.ack_requests)
 
 
 def main():
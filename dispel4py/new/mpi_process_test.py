@@ -12,17 +12,137 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dispel4py.new.mpi_process import process
+'''
+Tests for the MPI mappings.
+
+The unit tests can be run with nose. The workflow tests require MPI and are
+executed as follows::
+
+    mpiexec -n 3 python -m dispel4py.new.mpi_process_test
+'''
+
+import argparse
+
+import numpy as np
+
+from dispel4py.core import GenericPE
+from dispel4py.base import ProducerPE
+from dispel4py.new import mpi_process, mpi_queue_process
+from dispel4py.new.mpi_process import rank, comm, \
+    extract_arrays, restore_arrays, ArrayPlaceholder
 from dispel4py.workflow_graph import WorkflowGraph
 from dispel4py.examples.graph_testing.testing_PEs\
     import TestProducer, TestOneInOneOut
 
-prod = TestProducer()
-cons1 = TestOneInOneOut()
-cons2 = TestOneInOneOut()
+from nose import tools
+
+ARRAY_SIZE = 10000
+
+
+def test_extract_arrays():
+    large = np.arange(ARRAY_SIZE)
+    small = np.arange(3)
+    batch = [{'output': large},
+             {'output': {'data': large, 'small': small, 'n': 1}},
+             {'output': 'text'}]
+    header, arrays = extract_arrays(batch)
+    tools.eq_(2, len(arrays))
+    tools.ok_(isinstance(header[0]['output'], ArrayPlaceholder))
+    tools.ok_(isinstance(header[1]['output']['data'], ArrayPlaceholder))
+    tools.ok_(header[1]['output']['small'] is small)
+    tools.eq_('text', header[2]['output'])
+    # the original data items are unchanged
+    tools.ok_(batch[1]['output']['data'] is large)
+    result = restore_arrays(header, arrays)
+    tools.ok_(np.array_equal(large, result[0]['output']))
+    tools.ok_(np.array_equal(large, result[1]['output']['data']))
+
+
+def test_extract_non_contiguous():
+    data = np.arange(4 * ARRAY_SIZE).reshape(2 * ARRAY_SIZE, 2)[:, 1]
+    header, arrays = extract_arrays([{'output': data}])
+    tools.ok_(arrays[0].flags['C_CONTIGUOUS'])
+    tools.ok_(np.array_equal(data, arrays[0]))
+
+
+def test_extract_object_arrays():
+    data = np.array([object()] * ARRAY_SIZE)
+    header, arrays = extract_arrays([{'output': data}])
+    tools.eq_([], arrays)
+
+
+class ArrayProducer(ProducerPE):
+
+    def __init__(self, num_arrays):
+        ProducerPE.__init__(self)
+        self.num_arrays = num_arrays
+
+    def _process(self, inputs):
+        for i in range(self.num_arrays):
+            self.write('output',
+                       {'index': i, 'data': np.full(ARRAY_SIZE, i, 'f8')})
+
+
+class ArrayChecker(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self.count = 0
+        self.errors = 0
+
+    def _process(self, inputs):
+        data = inputs['input']
+        array = data['data']
+        if array.shape != (ARRAY_SIZE,) or array.dtype != np.float64 \
+                or not (array == data['index']).all():
+            self.errors += 1
+        self.count += 1
+
+    def _postprocess(self):
+        self.log('Received %s arrays, %s errors' % (self.count, self.errors))
+        assert self.errors == 0
+
+
+def _args(**kwargs):
+    args = argparse.Namespace(simple=False, dynamic=False,
+                              batch_size=None, batch_latency=None,
+                              send_window=None, prefetch=None,
+                              send_queue=None, recv_batch=None)
+    vars(args).update(kwargs)
+    return args
+
+
+def run_pipeline(mapping=mpi_process):
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    mapping.process(graph, {prod: 3}, _args())
+
+
+def run_arrays(mapping=mpi_process, **kwargs):
+    prod = ArrayProducer(50)
+    cons = ArrayChecker()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    mapping.process(graph, {prod: 1}, _args(**kwargs))
 
-graph = WorkflowGraph()
-graph.connect(prod, 'output', cons1, 'input')
-graph.connect(cons1, 'output', cons2, 'input')
 
-process(graph, {prod: [{}, {}, {}]})
+if __name__ == '__main__':
+    # a process must not receive messages from the previous workflow
+    for run in (run_pipeline, run_arrays,
+                lambda: run_arrays(batch_size=10),
+                lambda: run_arrays(dynamic=True),
+                lambda: run_pipeline(mpi_queue_process),
+                lambda: run_arrays(mpi_queue_process),
+                lambda: run_arrays(mpi_queue_process, batch_size=10,
+                                   prefetch=2, recv_batch=3),
+                lambda: run_arrays(mpi_queue_process, dynamic=True,
+                                   batch_size=3)):
+        run()
+        comm.Barrier()
+    if rank == 0:
+        print('MPI tests completed')
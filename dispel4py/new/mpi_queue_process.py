@@ -12,6 +12,72 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+'''
+Enactment of dispel4py graphs with MPI, using threads for communication.
+
+Each process receives data in a background thread which places the
+messages into a bounded prefetch queue, and sends data in a second thread,
+so that communication in both directions overlaps with the processing of
+data items by the PE.
+This requires an MPI library that supports `MPI_THREAD_MULTIPLE`.
+
+As in the :py:mod:`~dispel4py.new.mpi_process` mapping, large NumPy arrays
+are sent using the buffer interface instead of being pickled, and data can
+be distributed dynamically according to the load of the consumers. Here
+consumers acknowledge data items when the PE takes them from the prefetch
+queue, so data items that are waiting in the queue count as pending.
+
+From the commandline, run the following command::
+
+    dispel4py mpi_queue <module> [-h] [-a attribute] [-f inputfile] \
+        [-i iterations]
+
+with parameters
+
+:module:    module that creates a Dispel4Py graph
+:-a attr:   name of the graph attribute within the module (optional)
+:-f file:   file containing input data in JSON format (optional)
+:-i iter:   number of iterations to compute (default is 1)
+:-h:        print this help page
+:--prefetch num:            maximum number of received messages waiting to
+                            be processed (default is 100)
+:--dynamic:                 distribute data on inputs without grouping to
+                            the instance with the fewest pending data items
+                            instead of round robin
+:--send-queue num:          maximum number of messages waiting to be sent
+                            (default is 100)
+:--recv-batch num:          maximum number of messages that the receiving
+                            thread collects in one step (default is 10)
+:--batch-size size:         maximum number of data items that are sent to a
+                            consumer in one message (default is 1)
+:--batch-latency seconds:   maximum time that a data item is buffered before
+                            it is sent to a consumer (default is 0.1)
+:--data-mode mode:          how data is passed to more than one consumer
+                            within a partition: 'copy' (default), 'shared'
+                            or 'checked' (see
+                            :py:class:`~dispel4py.new.processor.SimpleProcessingPE`)
+:--costs file:              file with the costs of the PEs measured by the
+                            simple mapping, used to assign processes so that
+                            the load is balanced (see
+                            :py:func:`~dispel4py.new.processor.get_costs`)
+:--plan:                    print the number of processes of each PE and the
+                            predicted throughput
+:--fuse:                    execute chains of PEs in one process (see
+                            :py:func:`~dispel4py.new.processor.fuse_chains`).
+                            A fused chain may run more instances than its
+                            PEs would on their own, so the order of the
+                            results can change.
+:--plan-cache dir:          directory of compiled plans: the mapping of a
+                            graph is saved and reused by later runs of a
+                            graph with the same structure and options (see
+                            :py:class:`~dispel4py.new.processor.CompiledPlan`)
+
+For example::
+
+    mpiexec -n 6 dispel4py mpi_queue \
+        dispel4py.examples.graph_testing.pipeline_test -i 5
+'''
+
 from mpi4py import MPI
 
 comm = MPI.COMM_WORLD
@@ -19,111 +85,230 @@ rank = comm.Get_rank()
 size = comm.Get_size()
 
 from dispel4py.new.processor \
-    import GenericWrapper, simpleLogger, STATUS_TERMINATED, STATUS_ACTIVE
+    import BatchingWrapper, simpleLogger, STATUS_TERMINATED, STATUS_ACTIVE
 from dispel4py.new import processor
+from dispel4py.new.mpi_process import LoadBalancingMixin, free_ack_comm, \
+    extract_arrays, receive_arrays, TAG_ARRAY_HEADER, TAG_ARRAY_DATA
+
+import argparse
 import types
+from threading import Thread
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def process(workflow, inputs, args):
-    processes = {}
-    inputmappings = {}
-    outputmappings = {}
-    success = True
-    nodes = [node.getContainedObject() for node in workflow.graph.nodes()]
-    if rank == 0 and not args.simple:
-        try:
-            processes, inputmappings, outputmappings =\
-                processor.assign_and_connect(workflow, size)
-        except:
-            success = False
-    success = comm.bcast(success, root=0)
-
-    if args.simple or not success:
-        ubergraph = processor.create_partitioned(workflow)
-        nodes = [node.getContainedObject() for node in ubergraph.graph.nodes()]
-        if rank == 0:
-            print('Partitions: %s' % ', '.join(
-                ('[%s]' % ', '.join((pe.id for pe in part))
-                    for part in workflow.partitions)))
-            for node in ubergraph.graph.nodes():
-                wrapperPE = node.getContainedObject()
-                ns = [n.getContainedObject().id
-                      for n in wrapperPE.workflow.graph.nodes()]
-                print('%s contains %s' % (wrapperPE.id, ns))
-
-            try:
-                processes, inputmappings, outputmappings = \
-                    processor.assign_and_connect(ubergraph, size)
-                inputs = processor.map_inputs_to_partitions(ubergraph, inputs)
-                success = True
-            except:
-                print('dispel4py.mpi_process: '
-                      'Not enough processes for execution of graph')
-                success = False
-
-    success = comm.bcast(success, root=0)
-
-    if not success:
-        return
 
-    inputs = {pe.id: v for pe, v in inputs.items()}
-    processes = comm.bcast(processes, root=0)
-    inputmappings = comm.bcast(inputmappings, root=0)
-    outputmappings = comm.bcast(outputmappings, root=0)
-    inputs = comm.bcast(inputs, root=0)
+def parse_args(args, namespace):
+    parser = argparse.ArgumentParser(
+        description='Submit a dispel4py graph to MPI processes with '
+                    'communication threads.')
+    parser.add_argument('-s', '--simple', help='force simple processing',
+                        action='store_true')
+    parser.add_argument('--dynamic', action='store_true',
+                        help='balance the load of PE instances dynamically')
+    parser.add_argument('--prefetch', metavar='num', type=int, default=100,
+                        help='maximum number of received messages')
+    parser.add_argument('--send-queue', metavar='num', type=int,
+                        default=100,
+                        help='maximum number of messages waiting to be sent')
+    parser.add_argument('--recv-batch', metavar='num', type=int, default=10,
+                        help='maximum number of messages received per step')
+    parser.add_argument('--batch-size', metavar='size', type=int, default=1,
+                        help='maximum number of data items per message')
+    parser.add_argument('--batch-latency', metavar='seconds', type=float,
+                        default=0.1,
+                        help='maximum time that output data is buffered')
+    parser.add_argument('--data-mode', choices=processor.DATA_MODES,
+                        help='passing of data to more than one consumer '
+                             'within a partition')
+    parser.add_argument('--costs', metavar='file',
+                        help='measured costs of the PEs')
+    parser.add_argument('--fuse', action='store_true',
+                        help='fuse chains of PEs into one process')
+    parser.add_argument('--plan-cache', metavar='dir',
+                        help='directory of compiled plans')
+    parser.add_argument('--plan', action='store_true',
+                        help='print the assignment of processes')
+    result = parser.parse_args(args, namespace)
+    return result
 
+
+def process(workflow, inputs, args):
+    if MPI.Query_thread() < MPI.THREAD_MULTIPLE:
+        return 'dispel4py.mpi_queue_process: ' \
+            'The MPI library does not support MPI_THREAD_MULTIPLE'
+    dynamic = getattr(args, 'dynamic', False)
+    plan, planned = None, None
     if rank == 0:
-        print('Processes: %s' % processes)
-        # print('Inputs: %s' % inputs)
+        plan, planned = processor.create_flat_plan(workflow, inputs, args,
+                                                   size, dynamic)
+        if plan is None:
+            print('dispel4py.mpi_queue_process: '
+                  'Not enough processes for execution of graph')
+    # the plan is sent to all processes at once, and each process creates
+    # only its own PE and connections
+    plan = comm.bcast(plan, root=0)
+    if plan is None:
+        return
+    created = processor.create_process(
+        workflow, plan, rank, getattr(args, 'data_mode', None), dynamic,
+        planned)
 
-    for pe in nodes:
-        if rank in processes[pe.id]:
-            provided_inputs = processor.get_inputs(pe, inputs)
-            wrapper = MPIWrapper(pe, provided_inputs)
-            wrapper.targets = outputmappings[rank]
-            wrapper.sources = inputmappings[rank]
-            wrapper.process()
+    # partitioners may prefer consumers on the same host
+    hosts = dict(enumerate(comm.allgather(MPI.Get_processor_name())))
 
+    # consumers acknowledge data items on a separate communicator
+    ack_comm = comm.Dup() if dynamic else None
+    batch_size, batch_latency = processor.get_batch_config(args)
+    prefetch = getattr(args, 'prefetch', None) or 100
+    send_queue = getattr(args, 'send_queue', None) or 100
+    recv_batch = getattr(args, 'recv_batch', None) or 10
 
-import Queue
-from threading import Thread
+    if created is not None:
+        pe, inputmappings, outputmappings, provided_inputs = created
+        wrapper = MPIWrapper(pe, provided_inputs,
+                             batch_size, batch_latency,
+                             prefetch, send_queue, recv_batch)
+        wrapper.targets = outputmappings
+        wrapper.sources = inputmappings
+        processor.set_hosts(wrapper.targets, hosts)
+        if ack_comm is not None:
+            wrapper.set_ack_comm(ack_comm)
+        wrapper.process()
+
+    if ack_comm is not None:
+        free_ack_comm(ack_comm)
 
 
 def receive(wrapper):
+    '''
+    Receives messages until all sources have terminated and places them in
+    the input queue of the wrapper. After blocking for one message, any
+    messages that have arrived in the meantime are received as well, up to
+    `recv_batch` messages, and placed into the queue together.
+    The queue is bounded so this thread stops receiving when the PE falls
+    behind.
+
+    Each message is placed into the queue with the rank of its source, and
+    a message of `None` records that a source has terminated.
+    '''
+    status = MPI.Status()
     while wrapper.terminated < wrapper._num_sources:
-        status = MPI.Status()
+        messages = []
         msg = comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
-        tag = status.Get_tag()
-        # print('Received %s, %s' % (msg, tag))
-        if tag == STATUS_TERMINATED:
-            wrapper.terminated += 1
-        else:
-            wrapper.input_data.put((msg, tag))
-        # self.wrapper.pe.log('Queue size: %s'%self.wrapper.input_data.qsize())
+        while True:
+            # print('Received %s, %s' % (msg, status.Get_tag()))
+            tag = status.Get_tag()
+            source = status.Get_source()
+            if tag == STATUS_TERMINATED:
+                wrapper.terminated += 1
+                msg = None
+            elif tag == TAG_ARRAY_HEADER:
+                msg = receive_arrays(msg, source)
+            messages.append((source, msg))
+            if wrapper.terminated >= wrapper._num_sources or \
+                    len(messages) >= wrapper.recv_batch or \
+                    not comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG):
+                break
+            msg = comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG,
+                            status=status)
+        if messages:
+            wrapper.input_data.put(messages)
     # put the final terminate block into the queue
-    wrapper.input_data.put((None, STATUS_TERMINATED))
+    wrapper.input_data.put(None)
+
+
+def send(wrapper):
+    '''
+    Sends the messages in the output queue of the wrapper until it receives
+    `None`. Large NumPy arrays in a batch are sent after a header using the
+    buffer interface.
+    '''
+    while True:
+        item = wrapper.output_data.get()
+        if item is None:
+            break
+        data, tag, dest = item
+        arrays = None
+        if np is not None and tag == STATUS_ACTIVE:
+            header, arrays = extract_arrays(data)
+        if arrays:
+            specs = [(a.dtype.str, a.shape) for a in arrays]
+            comm.send((header, specs), tag=TAG_ARRAY_HEADER, dest=dest)
+            for array in arrays:
+                comm.Send([array, MPI.BYTE], tag=TAG_ARRAY_DATA, dest=dest)
+        else:
+            comm.send(data, tag=tag, dest=dest)
 
 
-class MPIWrapper(GenericWrapper):
+class MPIWrapper(LoadBalancingMixin, BatchingWrapper):
+    '''
+    Receives and sends data in background threads. Received messages are
+    held in a prefetch queue of at most `prefetch` messages, and a PE blocks
+    when writing data if more than `send_queue` messages are waiting to be
+    sent. Data items are sent after they were written, so a PE must not
+    modify them, or arrays within them, after writing.
+    '''
 
-    def __init__(self, pe, provided_inputs=None):
-        GenericWrapper.__init__(self, pe)
+    def __init__(self, pe, provided_inputs=None,
+                 batch_size=1, batch_latency=None,
+                 prefetch=100, send_queue=100, recv_batch=10):
+        BatchingWrapper.__init__(self, pe, batch_size, batch_latency)
         self.pe.log = types.MethodType(simpleLogger, pe)
         self.pe.rank = rank
         self.provided_inputs = provided_inputs
         self.terminated = 0
-        self.input_data = Queue.Queue()
+        self.ack_comm = None
+        self.recv_batch = max(1, recv_batch)
+        self.input_data = queue.Queue(max(1, prefetch))
+        self.output_data = queue.Queue(max(1, send_queue))
 
     def process(self):
         self.reader = Thread(target=receive, args=(self,))
+        self.reader.daemon = True
         self.reader.start()
+        self.sender = Thread(target=send, args=(self,))
+        self.sender.daemon = True
+        self.sender.start()
         super(MPIWrapper, self).process()
 
     def _read(self):
+        self._flush_if_due()
         result = super(MPIWrapper, self)._read()
         if result is not None:
             return result
-        return self.input_data.get()
+        if self.input_buffer:
+            return self.input_buffer.popleft(), STATUS_ACTIVE
+        while not self.input_buffer:
+            if self.input_data.empty():
+                self._flush_pe()
+                if self.ack_comm is not None and self.acks:
+                    # idle so send all acknowledgements
+                    self._send_all_acks()
+            # deliver any buffered output before waiting for input
+            self._flush()
+            messages = self.input_data.get()
+            if messages is None:
+                return None, STATUS_TERMINATED
+            # each message contains a batch of data items
+            for source, msg in messages:
+                if msg is None:
+                    # the producer has finished so it does not expect any
+                    # more acknowledgements
+                    if self.ack_comm is not None:
+                        self.acks.pop(source, None)
+                    continue
+                if self.ack_comm is not None:
+                    self._acknowledge(source, len(msg))
+                self.input_buffer.extend(msg)
+        return self.input_buffer.popleft(), STATUS_ACTIVE
 
     def _write(self, name, data):
         try:
@@ -132,19 +317,29 @@ class MPIWrapper(GenericWrapper):
             # no targets
             # self.pe.log('Produced output: %s' % {name: data})
             return
+        if self.ack_comm is not None:
+            self._receive_acks()
         for (inputName, communication) in targets:
             output = {inputName: data}
             dest = communication.getDestination(output)
             for i in dest:
-                # self.pe.log('Sending %s to %s' % (output, i))
-                request = comm.isend(output, tag=STATUS_ACTIVE, dest=i)
-                status = MPI.Status()
-                request.Wait(status)
+                if self.ack_comm is not None:
+                    self.load[i] += 1
+                self._buffer(i, output)
+
+    def _send_batch(self, dest, batch):
+        # self.pe.log('Sending %s to %s' % (batch, dest))
+        self.output_data.put((batch, STATUS_ACTIVE, dest))
 
     def _terminate(self):
+        self._flush()
         self.reader.join()
         for output, targets in self.targets.items():
             for (inputName, communication) in targets:
                 for i in communication.destinations:
                     # self.pe.log('Terminating consumer %s' % i)
-                    comm.isend(None, tag=STATUS_TERMINATED, dest=i)
+                    self.output_data.put((None, STATUS_TERMINATED, i))
+        self.output_data.put(None)
+        self.sender.join()
+        if self.ack_comm is not None:
+            MPI.Request.Waitall(self.ack_requests)
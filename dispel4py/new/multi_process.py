@@ -28,6 +28,50 @@ with parameters
 :-f file:   file containing input data in JSON format (optional)
 :-i iter:   number of iterations to compute (default is 1)
 :-h:        print this help page
+:--batch-size size:         maximum number of data items that are sent to a
+                            consumer in one message (default is 1)
+:--batch-latency seconds:   maximum time that a data item is buffered before
+                            it is sent to a consumer (default is 0.1)
+:--channel type:            type of the input queues of the processes, either
+                            'queue' (default) or 'shm' for ring buffers in
+                            shared memory (requires Python 3.8 or later)
+:--shm-size bytes:          size of each shared memory ring buffer
+:--queue-size num:          maximum number of messages from each producer
+                            in an input queue
+:--queue-bytes bytes:       maximum size in bytes of the messages from each
+                            producer in an input queue
+:--dynamic:                 distribute data on inputs without grouping to
+                            the instance with the fewest pending data items
+                            instead of round robin
+:--data-mode mode:          how data is passed to more than one consumer
+                            within a partition: 'copy' (default), 'shared'
+                            or 'checked' (see
+                            :py:class:`~dispel4py.new.processor.SimpleProcessingPE`)
+:--costs file:              file with the costs of the PEs measured by the
+                            simple mapping, used to assign processes so that
+                            the load is balanced (see
+                            :py:func:`~dispel4py.new.processor.get_costs`)
+:--plan:                    print the number of processes of each PE and the
+                            predicted throughput
+:--fuse:                    execute chains of PEs in one process (see
+                            :py:func:`~dispel4py.new.processor.fuse_chains`).
+                            A fused chain may run more instances than its
+                            PEs would on their own, so the order of the
+                            results can change.
+:--plan-cache dir:          directory of compiled plans: the mapping of a
+                            graph is saved and reused by later runs of a
+                            graph with the same structure and options (see
+                            :py:class:`~dispel4py.new.processor.CompiledPlan`)
+
+If the input queues are bounded a producer blocks when the queue of its
+consumer is full. This keeps the memory usage constant if a consumer is
+slower than its producers. Note that bounded queues may deadlock graphs that
+contain cycles. The maximum number of messages and bytes that each queue held
+during the run is reported at the end.
+
+Batching reduces the cost of communication between processes for workflows
+that produce many small data items. Buffered data is always sent before a
+process waits for input or terminates.
 
 For example::
 
@@ -46,17 +90,37 @@ For example::
 
 
 import argparse
-import copy
 import multiprocessing
+import pickle
 import traceback
 import types
+from threading import Thread
+from dispel4py.core import WRITER
 from dispel4py.new.processor \
-    import GenericWrapper, simpleLogger, STATUS_ACTIVE, STATUS_TERMINATED
+    import BatchingWrapper, simpleLogger, STATUS_ACTIVE, STATUS_TERMINATED
 from dispel4py.new import processor
+from dispel4py.new.channels import QueueAborted
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+class WorkerError(Exception):
+    '''
+    Raised when a PE failed in a worker process.
+    '''
+    pass
 
 
 def _processWorker(wrapper):
-    wrapper.process()
+    try:
+        wrapper.process()
+    except Exception:
+        # release the consumers, the process exits with an error
+        wrapper._abort()
+        raise
 
 
 def parse_args(args, namespace):    # pragma: no cover
@@ -67,33 +131,99 @@ def parse_args(args, namespace):    # pragma: no cover
                         action='store_true')
     parser.add_argument('-n', '--num', metavar='num_processes', required=True,
                         type=int, help='number of processes to run')
+    parser.add_argument('--batch-size', metavar='size', type=int, default=1,
+                        help='maximum number of data items per message')
+    parser.add_argument('--batch-latency', metavar='seconds', type=float,
+                        default=0.1,
+                        help='maximum time that output data is buffered')
+    parser.add_argument('--channel', choices=['queue', 'shm'],
+                        default='queue',
+                        help='type of the communication channels')
+    parser.add_argument('--shm-size', metavar='bytes', type=int,
+                        default=2**24,
+                        help='size of each shared memory ring buffer')
+    parser.add_argument('--queue-size', metavar='num', type=int,
+                        help='maximum number of messages from a producer '
+                             'in an input queue')
+    parser.add_argument('--queue-bytes', metavar='bytes', type=int,
+                        help='maximum size of the messages from a producer '
+                             'in an input queue')
+    parser.add_argument('--dynamic', action='store_true',
+                        help='balance the load of PE instances dynamically')
+    parser.add_argument('--data-mode', choices=processor.DATA_MODES,
+                        help='passing of data to more than one consumer '
+                             'within a partition')
+    parser.add_argument('--costs', metavar='file',
+                        help='measured costs of the PEs')
+    parser.add_argument('--plan', action='store_true',
+                        help='print the assignment of processes')
+    parser.add_argument('--fuse', action='store_true',
+                        help='fuse chains of PEs into one process')
+    parser.add_argument('--plan-cache', metavar='dir',
+                        help='directory of compiled plans')
     result = parser.parse_args(args, namespace)
     return result
 
 
-def process(workflow, inputs, args):
-    size = args.num
+def _create_mapping(workflow, inputs, args, size):
+    '''
+    Assigns the PEs of the workflow to processes. Chains of PEs are fused
+    into one process unless this is disabled. If the graph cannot be
+    mapped directly, or simple processing is requested, the graph is
+    partitioned first.
+    Returns an error message if the mapping failed.
+    '''
     success = True
-    nodes = [node.getContainedObject() for node in workflow.graph.nodes()]
+    dynamic = _get_arg(args, 'dynamic', False)
+    costs = None
+    fused = None
     if not args.simple:
+        costs = processor.get_cost_config(workflow, args)
+        workflow = processor.plan_merge_steps(workflow, size, costs)
+    plan = processor.load_plan_config(workflow, args, size, costs)
+    cached = plan is not None and plan.processes is not None
+    if cached:
+        fused = plan.get_fused(workflow)
+        success = not plan.partitioned
+    elif not args.simple and _get_arg(args, 'fuse', False):
+        fused = processor.fuse_chains(workflow)
+        if plan is not None:
+            plan.set_fused(fused)
+    nodes = [node.getContainedObject() for node in workflow.graph.nodes()]
+    planned = workflow
+    if cached and success:
+        processes, inputmappings, outputmappings = plan.get_mapping(workflow)
+    elif not args.simple and not fused:
         try:
-            result = processor.assign_and_connect(workflow, size)
+            result = processor.assign_and_connect(workflow, size, dynamic,
+                                                  costs)
             processes, inputmappings, outputmappings = result
-        except:
+        except Exception:
             success = False
 
-    if args.simple or not success:
-        ubergraph = processor.create_partitioned(workflow)
-        print('Partitions: %s' % ', '.join(('[%s]' % ', '.join(
-            (pe.id for pe in part)) for part in workflow.partitions)))
+    if args.simple or fused or not success:
+        ubergraph = processor.create_partitioned(
+            workflow, getattr(args, 'data_mode', None), fused, bool(fused),
+            plan.partitions if plan is not None else None)
+        if fused:
+            print('Fused: %s' % processor.format_fused(fused))
+        else:
+            print('Partitions: %s' % ', '.join(('[%s]' % ', '.join(
+                (pe.id for pe in part)) for part in workflow.partitions)))
         for node in ubergraph.graph.nodes():
             wrapperPE = node.getContainedObject()
             pes = [n.getContainedObject().id for
                    n in wrapperPE.workflow.graph.nodes()]
             print('%s contains %s' % (wrapperPE.id, pes))
+        if costs:
+            costs = processor.get_partition_costs(ubergraph, costs)
 
         try:
-            result = processor.assign_and_connect(ubergraph, size)
+            if cached:
+                result = plan.get_mapping(ubergraph)
+            else:
+                result = processor.assign_and_connect(ubergraph, size,
+                                                      dynamic, costs)
             if result is None:
                 return 'dispel4py.multi_process: ' \
                        'Not enough processes for execution of graph'
@@ -102,42 +232,66 @@ def process(workflow, inputs, args):
             success = True
             nodes = [node.getContainedObject()
                      for node in ubergraph.graph.nodes()]
-        except:
+            planned = ubergraph
+        except Exception:
             print(traceback.format_exc())
             return 'dispel4py.multi_process: ' \
                    'Could not create mapping for execution of graph'
 
     print('Processes: %s' % processes)
+    if _get_arg(args, 'plan', False):
+        print(processor.format_plan(planned, processes, costs))
+    if plan is not None and not cached:
+        plan.set_processes(planned, processes)
+        processor.save_plan_config(plan, args)
+    return nodes, processes, inputmappings, outputmappings, inputs
 
-    process_pes = {}
-    queues = {}
-    result_queue = None
+
+def _wants_results(args):
     try:
-        if args.results:
-            result_queue = multiprocessing.Queue()
+        return args.results
     except AttributeError:
-        pass
+        return False
+
+
+def _start(workflow, inputs, args, result_queue):
+    mapping = _create_mapping(workflow, inputs, args, args.num)
+    if not isinstance(mapping, tuple):
+        return mapping
+    nodes, processes, inputmappings, outputmappings, inputs = mapping
+
+    process_pes = {}
+    queues = {}
+    batch_size, batch_latency = processor.get_batch_config(args)
+    load = None
+    if _get_arg(args, 'dynamic', False):
+        # number of pending data items of each process
+        load = multiprocessing.Array('l', len(outputmappings))
     for pe in nodes:
         provided_inputs = processor.get_inputs(pe, inputs)
         for proc in processes[pe.id]:
-            cp = copy.deepcopy(pe)
+            cp = processor.copy_pe(pe)
             cp.rank = proc
             cp.log = types.MethodType(simpleLogger, cp)
-            wrapper = MultiProcessingWrapper(proc, cp, provided_inputs)
+            wrapper = MultiProcessingWrapper(proc, cp, provided_inputs,
+                                             batch_size, batch_latency)
             process_pes[proc] = wrapper
-            wrapper.input_queue = multiprocessing.Queue()
+            wrapper.targets = outputmappings[proc]
+            wrapper.sources = inputmappings[proc]
+            if load is not None:
+                wrapper.set_load(load)
+            wrapper.input_queue = _create_queue(args, wrapper._num_sources,
+                                                len(outputmappings))
             wrapper.input_queue.name = 'Queue_%s_%s' % (cp.id, cp.rank)
             wrapper.result_queue = result_queue
             queues[proc] = wrapper.input_queue
-            wrapper.targets = outputmappings[proc]
-            wrapper.sources = inputmappings[proc]
     for proc in process_pes:
         wrapper = process_pes[proc]
         wrapper.output_queues = {}
         for target in wrapper.targets.values():
             for inp, comm in target:
                 for i in comm.destinations:
-                    wrapper.output_queues[i] = queues[i]
+                    wrapper.output_queues[i] = _get_edge(queues[i], proc)
 
     jobs = []
     for wrapper in process_pes.values():
@@ -146,48 +300,364 @@ def process(workflow, inputs, args):
 
     for j in jobs:
         j.start()
+    return jobs, queues
 
+
+def _finish(jobs, queues, result_queue, errors=None):
     for j in jobs:
         j.join()
 
+    _print_high_water_marks(queues)
+    for queue in queues.values():
+        queue.close()
+
+    failed = [j.name for j in jobs if j.exitcode]
+    if failed and errors is not None:
+        errors.append('dispel4py.multi_process: '
+                      'Processes failed: %s' % ', '.join(failed))
+
     if result_queue:
         result_queue.put(STATUS_TERMINATED)
+
+
+def process(workflow, inputs, args):
+    result_queue = None
+    if _wants_results(args):
+        result_queue = multiprocessing.Queue()
+    started = _start(workflow, inputs, args, result_queue)
+    if not isinstance(started, tuple):
+        return started
+    jobs, queues = started
+    errors = []
+    _finish(jobs, queues, result_queue, errors)
+    if errors:
+        return errors[0]
     return result_queue
 
 
-class MultiProcessingWrapper(GenericWrapper):
+def iter_results(workflow, inputs, args, buffer_size=100):
+    '''
+    Executes the graph and returns a generator of the data written to
+    unconnected outputs, which is available as soon as it has been produced.
+    At most `buffer_size` results are held in the result queue, and
+    processes producing results wait until the consumer of the generator has
+    caught up.
+
+    :rtype: a generator of tuples (PE id, output name, data)
+    '''
+    result_queue = multiprocessing.Queue(max(1, buffer_size or 1))
+    started = _start(workflow, inputs, args, result_queue)
+    if not isinstance(started, tuple):
+        raise Exception(started)
+    jobs, queues = started
+    # wait for the processes in the background while results are consumed
+    errors = []
+    finisher = Thread(target=_finish,
+                      args=(jobs, queues, result_queue, errors))
+    finisher.start()
+    while True:
+        item = result_queue.get()
+        if item == STATUS_TERMINATED:
+            break
+        yield item
+    finisher.join()
+    if errors:
+        raise WorkerError(errors[0])
+
+
+def _get_arg(args, name, default=None):
+    try:
+        value = getattr(args, name)
+    except AttributeError:
+        return default
+    return default if value is None else value
+
+
+def _create_queue(args, num_producers, num_processes):
+    channel = _get_arg(args, 'channel', 'queue')
+    max_items = _get_arg(args, 'queue_size')
+    max_bytes = _get_arg(args, 'queue_bytes')
+    if channel == 'shm':
+        from dispel4py.new.channels import SharedMemoryQueue
+        capacity = _get_arg(args, 'shm_size', 2**24)
+        if max_bytes is not None:
+            capacity = min(capacity, max_bytes)
+        return SharedMemoryQueue(capacity,
+                                 multi_producer=num_producers > 1,
+                                 max_items=max_items)
+    if max_items is not None or max_bytes is not None:
+        from dispel4py.new.channels import BoundedQueue
+        # each process that writes to the queue has its own edge
+        return BoundedQueue(max_items, max_bytes, num_processes)
+    return multiprocessing.Queue()
+
+
+def _get_edge(queue, proc):
+    # bounded queues limit the data written by each producer
+    try:
+        return queue.edge(proc)
+    except AttributeError:
+        return queue
+
 
-    def __init__(self, rank, pe, provided_inputs=None):
-        GenericWrapper.__init__(self, pe)
+def _print_high_water_marks(queues):
+    marks = []
+    for proc in sorted(queues):
+        queue = queues[proc]
+        try:
+            items, size = queue.high_water_mark()
+        except AttributeError:
+            # this queue does not record any statistics
+            return
+        marks.append('%s: %s messages, %s bytes' % (queue.name, items, size))
+    print('Queue high-water marks: %s' % ', '.join(marks))
+
+
+def _poolWorker(index, tasks, queues, result_queue, load):
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        pe, provided_inputs, targets, sources, results, \
+            batch_size, batch_latency, dynamic = pickle.loads(task)
+        wrapper = MultiProcessingWrapper(index, pe, provided_inputs,
+                                         batch_size, batch_latency)
+        wrapper.targets = targets
+        wrapper.sources = sources
+        if dynamic:
+            wrapper.set_load(load)
+        wrapper.input_queue = queues[index]
+        wrapper.result_queue = result_queue if results else None
+        wrapper.output_queues = {}
+        for target in targets.values():
+            for inp, comm in target:
+                for i in comm.destinations:
+                    wrapper.output_queues[i] = _get_edge(queues[i], index)
+        try:
+            wrapper.process()
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+            wrapper._abort()
+            result_queue.put(WorkerError(
+                'PE %s failed in process %s:\n%s' % (pe.id, index, error)))
+        # notify the executor that this worker has finished
+        result_queue.put(STATUS_TERMINATED)
+
+
+class MultiProcessingExecutor(object):
+    '''
+    A pool of worker processes that enacts dispel4py graphs repeatedly.
+    The worker processes and their input queues are created once and reused
+    for each graph execution, so modules that are imported by the PEs are
+    only loaded once. The graphs may differ between executions but they must
+    not require more processes than the size of the pool. If an execution
+    fails, the input queues may still hold its data, so the workers and
+    their queues are replaced before the error is reported.
+
+    For example::
+
+        executor = MultiProcessingExecutor(4)
+        for data in requests:
+            result_queue = executor.process(graph, {prod: data}, args)
+            ...
+        executor.close()
+
+    :param num: number of worker processes
+    :param args: options for the input queues of the worker processes, as
+        for :py:func:`process` (optional)
+    '''
+
+    def __init__(self, num, args=None):
+        self.num = num
+        self.args = args
+        self._start_workers()
+
+    def _start_workers(self):
+        num = self.num
+        self.queues = []
+        for i in range(num):
+            # queues are shared by many producers
+            queue = _create_queue(self.args, num, num)
+            queue.name = 'Queue_%s' % i
+            self.queues.append(queue)
+        self.tasks = [multiprocessing.Queue() for i in range(num)]
+        self.result_queue = multiprocessing.Queue()
+        self.load = multiprocessing.Array('l', num)
+        self.workers = []
+        for i in range(num):
+            p = multiprocessing.Process(
+                target=_poolWorker,
+                args=(i, self.tasks[i], self.queues, self.result_queue,
+                      self.load))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+    def process(self, workflow, inputs, args):
+        '''
+        Executes the graph with the given inputs in the worker processes
+        and waits until the execution has completed. The arguments are the
+        same as for :py:func:`process`, except that the number of processes
+        is the size of the pool.
+
+        :rtype: if results are requested, a queue containing the output
+            data of unconnected outputs followed by STATUS_TERMINATED
+        '''
+        results = _wants_results(args)
+        num_tasks = self._submit(workflow, inputs, args, results)
+        if isinstance(num_tasks, str):
+            return num_tasks
+        result_queue = Queue() if results else None
+        try:
+            for item in self._collect(num_tasks):
+                if result_queue is not None:
+                    result_queue.put(item)
+        except WorkerError as e:
+            return 'dispel4py.multi_process: %s' % e
+        if result_queue is not None:
+            result_queue.put(STATUS_TERMINATED)
+        return result_queue
+
+    def iter_results(self, workflow, inputs, args):
+        '''
+        Executes the graph with the given inputs in the worker processes
+        and returns a generator of the data written to unconnected outputs
+        as soon as it is available.
+
+        :rtype: a generator of tuples (PE id, output name, data)
+        '''
+        num_tasks = self._submit(workflow, inputs, args, True)
+        if isinstance(num_tasks, str):
+            raise Exception(num_tasks)
+        return self._collect(num_tasks)
+
+    def _submit(self, workflow, inputs, args, results):
+        mapping = _create_mapping(workflow, inputs, args, self.num)
+        if not isinstance(mapping, tuple):
+            return mapping
+        nodes, processes, inputmappings, outputmappings, inputs = mapping
+        batch_size, batch_latency = processor.get_batch_config(args)
+        dynamic = _get_arg(args, 'dynamic', False)
+        num_tasks = 0
+        for pe in nodes:
+            provided_inputs = processor.get_inputs(pe, inputs)
+            for proc in processes[pe.id]:
+                cp = processor.copy_pe(pe)
+                cp.rank = proc
+                # remove state that is left from previous executions
+                cp.__dict__.pop('log', None)
+                for output in cp.outputconnections.values():
+                    output.pop(WRITER, None)
+                task = (cp, provided_inputs,
+                        outputmappings[proc], inputmappings[proc], results,
+                        batch_size, batch_latency, dynamic)
+                self.tasks[proc].put(
+                    pickle.dumps(task, pickle.HIGHEST_PROTOCOL))
+                num_tasks += 1
+        return num_tasks
+
+    def _collect(self, num_tasks):
+        # wait until all tasks have completed
+        error = None
+        while num_tasks > 0:
+            item = self.result_queue.get()
+            if isinstance(item, WorkerError):
+                error = error or item
+            elif item == STATUS_TERMINATED:
+                num_tasks -= 1
+            else:
+                yield item
+        if error is not None:
+            self._restart()
+            raise error
+
+    def _restart(self):
+        # the workers are idle but the queues may contain data of the failed
+        # execution, which must not be read by the next execution
+        for p in self.workers:
+            p.terminate()
+            p.join()
+        for queue in self.queues:
+            queue.close()
+        self._start_workers()
+
+    def close(self):
+        '''
+        Stops the worker processes.
+        '''
+        for tasks in self.tasks:
+            tasks.put(None)
+        for p in self.workers:
+            p.join()
+        _print_high_water_marks(dict(enumerate(self.queues)))
+        for queue in self.queues:
+            queue.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MultiProcessingWrapper(BatchingWrapper):
+
+    def __init__(self, rank, pe, provided_inputs=None,
+                 batch_size=1, batch_latency=None):
+        BatchingWrapper.__init__(self, pe, batch_size, batch_latency)
         self.pe.log = types.MethodType(simpleLogger, pe)
         self.pe.rank = rank
         self.provided_inputs = provided_inputs
         self.terminated = 0
+        self.load = None
+
+    def set_load(self, load):
+        '''
+        Sets the shared array that records the number of pending data items
+        of each process, and uses it for load balancing communications.
+        '''
+        self.load = load
+        for targets in self.targets.values():
+            for inputName, communication in targets:
+                if isinstance(communication,
+                              processor.LoadBalancingCommunication):
+                    communication.load = load
+
+    def _update_load(self, rank, num):
+        with self.load.get_lock():
+            self.load[rank] += num
+
+    def _next_input(self):
+        if self.load is not None:
+            self._update_load(self.pe.rank, -1)
+        return self.input_buffer.popleft(), STATUS_ACTIVE
 
     def _read(self):
+        self._flush_if_due()
         result = super(MultiProcessingWrapper, self)._read()
         if result is not None:
             return result
+        if self.input_buffer:
+            return self._next_input()
+        if self.input_queue.empty():
+            self._flush_pe()
+        # deliver any buffered output before waiting for input
+        self._flush()
         # read from input queue
-        no_data = True
-        while no_data:
-            try:
-                data, status = self.input_queue.get()
-                no_data = False
-            except:
-                self.pe.log('Failed to read item from queue')
-                pass
-        while status == STATUS_TERMINATED:
-            self.terminated += 1
-            if self.terminated >= self._num_sources:
-                return data, status
+        while True:
+            data, status = self._get()
+            if status == STATUS_TERMINATED:
+                self.terminated += 1
+                if self.terminated >= self._num_sources:
+                    return data, status
             else:
-                try:
-                    data, status = self.input_queue.get()
-                except:
-                    self.pe.log('Failed to read item from queue')
-                    pass
-        return data, status
+                # each message contains a batch of data items
+                self.input_buffer.extend(data)
+                return self._next_input()
+
+    def _get(self):
+        return self.input_queue.get()
 
     def _write(self, name, data):
         # self.pe.log('Writing %s to %s' % (data, name))
@@ -196,23 +666,54 @@ class MultiProcessingWrapper(GenericWrapper):
         except KeyError:
             # no targets
             if self.result_queue:
-                self.result_queue.put((self.pe.id, name, data))
+                if getattr(self.pe, 'fused', False):
+                    # report the results of the PEs in a fused chain
+                    pe_id, output_name = name
+                    for block in data:
+                        self.result_queue.put((pe_id, output_name, block))
+                else:
+                    self.result_queue.put(
+                        (processor.get_result_id(self.pe), name, data))
             return
         for (inputName, communication) in targets:
             output = {inputName: data}
             dest = communication.getDestination(output)
             for i in dest:
                 # self.pe.log('Writing out %s' % output)
-                try:
-                    self.output_queues[i].put((output, STATUS_ACTIVE))
-                except:
-                    self.pe.log("Failed to write item to output '%s'" % name)
+                if self.load is not None:
+                    self._update_load(i, 1)
+                self._buffer(i, output)
+
+    def _send_batch(self, dest, batch):
+        self.output_queues[dest].put((batch, STATUS_ACTIVE))
 
     def _terminate(self):
+        self._flush()
+        self._send_terminate()
+
+    def _abort(self):
+        '''
+        Terminates the consumers after the PE failed so that they do not
+        wait for more input, and aborts the input queue so that producers
+        do not wait for space in it. Buffered data items are discarded.
+        '''
+        try:
+            self.input_queue.abort()
+        except AttributeError:
+            # the queue is unbounded so producers never wait
+            pass
+        self.output_buffers.clear()
+        self._send_terminate()
+
+    def _send_terminate(self):
         for output, targets in self.targets.items():
             for (inputName, communication) in targets:
                 for i in communication.destinations:
-                    self.output_queues[i].put((None, STATUS_TERMINATED))
+                    try:
+                        self.output_queues[i].put((None, STATUS_TERMINATED))
+                    except QueueAborted:
+                        # the consumer has failed and does not wait
+                        pass
 
 
 def main():    # pragma: no cover
@@ -0,0 +1,402 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Partitioners assign the data items of an input to the instances of a PE.
+A partitioner is declared as the grouping of an input, for example::
+
+    from dispel4py.new.partitioners import RangePartitioner
+
+    class SortedWriter(GenericPE):
+        def __init__(self):
+            GenericPE.__init__(self)
+            # timestamps are in the first element of each data item
+            self._add_input('input',
+                            grouping=RangePartitioner([100, 200, 300], key=0))
+
+The following partitioners are provided:
+
+* :py:class:`RangePartitioner` sends keys within the same range to the same
+  instance, and instances with a higher rank receive higher keys.
+* :py:class:`ConsistentHashPartitioner` groups data by key such that few
+  keys move to another instance when the number of instances changes.
+* :py:class:`KeyAffinityPartitioner` groups data by key but distributes the
+  data items of frequent ("hot") keys across several instances.
+* :py:class:`LocalityPartitioner` prefers instances on the same host as the
+  producer.
+
+Custom partitioners extend :py:class:`Partitioner` and override
+:py:func:`Partitioner.partition`, which by default assigns keys by their
+stable hash. Partitioners that keep state while data is partitioned
+override :py:func:`Partitioner.clone` as well.
+'''
+
+import bisect
+import copy
+
+from dispel4py.utils import stable_hash, stable_hash_array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Partitioner(object):
+    '''
+    Base class of partitioners.
+
+    :param key: the part of each data item that is used as the key. This is
+        an index or the name of an element of the data item, a list of
+        indexes or names, a function that returns the key of a data item, or
+        `None` to use the whole data item.
+    '''
+
+    def __init__(self, key=None):
+        self.key = key
+
+    def get_key(self, data):
+        '''
+        Returns the key of a data item.
+        '''
+        key = self.key
+        if key is None:
+            return data
+        if callable(key):
+            return key(data)
+        if isinstance(key, list):
+            return tuple([data[k] for k in key])
+        return data[key]
+
+    def setup(self, rank, destinations, hosts=None):
+        '''
+        Called for each producer before data is partitioned.
+
+        :param rank: the process that sends the data
+        :param destinations: the processes of the PE instances
+        :param hosts: a dictionary mapping each process to the name of its
+            host, if it is known
+        '''
+        pass
+
+    def clone(self):
+        '''
+        Returns a partitioner for one producer. The clone shares the
+        configuration of this partitioner, and subclasses that change their
+        state while partitioning must reset that state in the clone.
+        '''
+        return copy.copy(self)
+
+    def partition(self, key, num):
+        '''
+        Returns the index of the instance that receives data with the given
+        key. By default keys are assigned by their stable hash, as with a
+        grouping by key.
+
+        :param key: the key of the data item
+        :param num: the number of instances
+        :rtype: an integer between 0 and `num` - 1
+        '''
+        return stable_hash(key) % num
+
+    def partition_keys(self, keys, num):
+        '''
+        Returns the indexes of the instances for a list of keys.
+        Subclasses may override this method for efficiency.
+        '''
+        if type(self).partition is not Partitioner.partition:
+            # a subclass that only implements partition
+            return [self.partition(key, num) for key in keys]
+        if np is None:
+            return [stable_hash(key) % num for key in keys]
+        return (stable_hash_array(keys) % np.uint64(num)).tolist()
+
+    def __repr__(self):
+        return '%s(key=%r)' % (self.__class__.__name__, self.key)
+
+
+class RangePartitioner(Partitioner):
+    '''
+    Assigns keys to instances by comparing them with sorted split points.
+    With `n` split points there are `n + 1` ranges, which are assigned to
+    the instances in order, so that each instance receives a contiguous
+    range of keys and the outputs of the instances can be concatenated in
+    order of rank without merging.
+
+    :param split_points: sorted list of the lowest key of each range except
+        the first
+    :param key: the key of a data item (see :py:class:`Partitioner`)
+    '''
+
+    def __init__(self, split_points, key=None):
+        Partitioner.__init__(self, key)
+        self.split_points = list(split_points)
+
+    def _to_instance(self, index, num):
+        return index * num // (len(self.split_points) + 1)
+
+    def partition(self, key, num):
+        return self._to_instance(
+            bisect.bisect_right(self.split_points, key), num)
+
+    def partition_keys(self, keys, num):
+        if np is None or not self.split_points:
+            return Partitioner.partition_keys(self, keys, num)
+        try:
+            indexes = np.searchsorted(np.asarray(self.split_points),
+                                      np.asarray(keys), side='right')
+        except TypeError:
+            return Partitioner.partition_keys(self, keys, num)
+        return (indexes * num // (len(self.split_points) + 1)).tolist()
+
+
+class ConsistentHashPartitioner(Partitioner):
+    '''
+    Places each instance at `replicas` points of a hash ring and assigns a
+    key to the instance that follows the hash of the key on the ring.
+
+    :param key: the key of a data item (see :py:class:`Partitioner`)
+    :param replicas: number of points of each instance on the ring
+    :param seed: seed of the hash function
+    '''
+
+    def __init__(self, key=None, replicas=100, seed=0):
+        Partitioner.__init__(self, key)
+        self.replicas = replicas
+        self.seed = seed
+        # the rings only depend on the configuration so clones share them
+        self._rings = {}
+
+    def _ring(self, num):
+        try:
+            return self._rings[num]
+        except KeyError:
+            pass
+        points = sorted((stable_hash((i, r), self.seed), i)
+                        for i in range(num) for r in range(self.replicas))
+        ring = [p for p, i in points], [i for p, i in points]
+        self._rings[num] = ring
+        return ring
+
+    def partition(self, key, num):
+        hashes, owners = self._ring(num)
+        pos = bisect.bisect_right(hashes, stable_hash(key, self.seed))
+        return owners[pos % len(owners)]
+
+    def partition_keys(self, keys, num):
+        if np is None:
+            return Partitioner.partition_keys(self, keys, num)
+        hashes, owners = self._ring(num)
+        positions = np.searchsorted(np.array(hashes, dtype=np.uint64),
+                                    stable_hash_array(keys, self.seed),
+                                    side='right') % len(owners)
+        return np.array(owners)[positions].tolist()
+
+
+class KeyAffinityPartitioner(Partitioner):
+    '''
+    Sends all data items with the same key to the same instance, except for
+    the given hot keys whose data items are distributed in turn across
+    several instances.
+    The consumer must therefore be able to combine partial results for hot
+    keys, for example with a downstream aggregation.
+
+    :param key: the key of a data item (see :py:class:`Partitioner`)
+    :param hot_keys: a dictionary mapping each hot key to the number of
+        instances that it is distributed to, or a list of hot keys which are
+        distributed to all instances
+    :param seed: seed of the hash function
+    '''
+
+    def __init__(self, key=None, hot_keys=None, seed=0):
+        Partitioner.__init__(self, key)
+        if hot_keys is None:
+            hot_keys = {}
+        elif not isinstance(hot_keys, dict):
+            hot_keys = {k: None for k in hot_keys}
+        self.hot_keys = hot_keys
+        self.seed = seed
+        self._counters = {}
+
+    def clone(self):
+        clone = Partitioner.clone(self)
+        clone._counters = {}
+        return clone
+
+    def partition(self, key, num):
+        index = stable_hash(key, self.seed) % num
+        try:
+            spread = self.hot_keys[key]
+        except (KeyError, TypeError):
+            return index
+        if spread is None or spread > num:
+            spread = num
+        count = self._counters.get(key, 0)
+        self._counters[key] = count + 1
+        return (index + count % spread) % num
+
+
+class HotKeyDetector(object):
+    '''
+    Estimates the frequency of keys from a sample of the data items and
+    reports the keys whose share of the sample exceeds a threshold.
+    At most `capacity` keys are counted at a time, using the Misra-Gries
+    algorithm, so the memory used is bounded for any number of keys.
+    Once a key is detected it remains hot.
+
+    :param threshold: minimum share of the data items with the same key
+    :param sample_rate: every `sample_rate`-th data item is sampled
+    :param min_samples: minimum number of samples before a key is hot
+    :param capacity: maximum number of keys that are counted
+    '''
+
+    def __init__(self, threshold=0.1, sample_rate=4, min_samples=50,
+                 capacity=64):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.min_samples = min_samples
+        self.capacity = capacity
+        self.hot_keys = set()
+        self.counts = {}
+        self.samples = 0
+        self._seen = 0
+
+    def _sample(self, key):
+        self.samples += 1
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+        elif len(counts) < self.capacity:
+            counts[key] = 1
+        else:
+            for k in list(counts):
+                counts[k] -= 1
+                if not counts[k]:
+                    del counts[k]
+            return
+        if self.samples >= self.min_samples and \
+                counts[key] >= self.threshold * self.samples:
+            self.hot_keys.add(key)
+
+    def is_hot(self, key):
+        '''
+        Records a key and returns whether it is hot.
+        '''
+        self._seen += 1
+        try:
+            if self._seen % self.sample_rate == 0:
+                self._sample(key)
+            return key in self.hot_keys
+        except TypeError:
+            # keys that are not hashable are never hot
+            return False
+
+
+class LocalityPartitioner(Partitioner):
+    '''
+    Sends data to the instances on the same host as the producer, if there
+    are any, and otherwise to all instances. Data is distributed among
+    these instances in turn, or with the given partitioner. Note that with a
+    partitioner, data with the same key is only sent to the same instance
+    by producers on the same host.
+
+    :param partitioner: a partitioner that selects one of the local
+        instances (optional)
+    '''
+
+    def __init__(self, partitioner=None):
+        Partitioner.__init__(self)
+        self.partitioner = partitioner
+        self._local = None
+        self._next = 0
+
+    def clone(self):
+        clone = Partitioner.clone(self)
+        if self.partitioner is not None:
+            clone.partitioner = self.partitioner.clone()
+        return clone
+
+    def get_key(self, data):
+        if self.partitioner is None:
+            return None
+        return self.partitioner.get_key(data)
+
+    def setup(self, rank, destinations, hosts=None):
+        self._local = None
+        if hosts and rank in hosts:
+            local = [i for i, d in enumerate(destinations)
+                     if hosts.get(d) == hosts[rank]]
+            if local:
+                self._local = local
+        self._next = rank
+
+    def partition(self, key, num):
+        local = self._local
+        if local is None:
+            local = range(num)
+        if self.partitioner is not None:
+            return local[self.partitioner.partition(key, len(local))]
+        self._next = (self._next + 1) % len(local)
+        return local[self._next]
+
+
+class PartitionerCommunication(object):
+    '''
+    Sends data to destinations selected by a partitioner.
+
+    :param rank: the process that sends the data
+    :param destinations: the processes of the consumer instances
+    :param input_name: the name of the input of the consumer
+    :param partitioner: the partitioner declared by the input
+    '''
+
+    def __init__(self, rank, destinations, input_name, partitioner):
+        self.rank = rank
+        self.destinations = destinations
+        self.input_name = input_name
+        # partitioners may keep state for each producer
+        self.partitioner = partitioner.clone()
+        self.partitioner.setup(rank, destinations)
+        self.name = partitioner
+
+    def set_hosts(self, hosts):
+        '''
+        Provides the names of the hosts of all processes to the partitioner.
+        '''
+        self.partitioner.setup(self.rank, self.destinations, hosts)
+
+    def getDestination(self, data):
+        partitioner = self.partitioner
+        key = partitioner.get_key(data[self.input_name])
+        index = partitioner.partition(key, len(self.destinations))
+        return [self.destinations[index]]
+
+    def route(self, data_items):
+        '''
+        Assigns a list of data items to destinations.
+
+        :rtype: a dictionary mapping each destination to a list of data items
+        '''
+        partitioner = self.partitioner
+        keys = [partitioner.get_key(data[self.input_name])
+                for data in data_items]
+        indexes = partitioner.partition_keys(keys, len(self.destinations))
+        result = {}
+        for data, index in zip(data_items, indexes):
+            dest = self.destinations[index]
+            try:
+                result[dest].append(data)
+            except KeyError:
+                result[dest] = [data]
+        return result
@@ -0,0 +1,140 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Measures the time that the mappings take to plan the execution of large
+generated graphs, that is before any data is processed. The graphs are a
+pipeline, a parameter sweep, where a source feeds many parallel chains
+of PEs that are merged by one sink, and a pipeline of nested composite
+PEs.
+
+Usage::
+
+    python -m dispel4py.new.planning_benchmark [size ...]
+
+where each size is the number of PEs of the graphs (default is 1000 and
+10000). The times of each step are printed in seconds.
+'''
+
+import sys
+import time
+
+from dispel4py.base import CompositePE
+from dispel4py.new import processor
+from dispel4py.workflow_graph import WorkflowGraph
+from dispel4py.examples.graph_testing.testing_PEs \
+    import TestProducer, TestOneInOneOut
+
+
+def create_pipeline(size):
+    '''
+    Creates a pipeline of a producer and `size` - 1 consumers.
+    '''
+    graph = WorkflowGraph()
+    prev = TestProducer()
+    for i in range(size - 1):
+        cons = TestOneInOneOut()
+        graph.connect(prev, 'output', cons, 'input')
+        prev = cons
+    return graph
+
+
+def create_sweep(size, length=10):
+    '''
+    Creates a parameter sweep of about `size` PEs, with chains of `length`
+    PEs between the producer and the sink.
+    '''
+    graph = WorkflowGraph()
+    prod = TestProducer()
+    sink = TestOneInOneOut()
+    for i in range(max(1, (size - 2) // length)):
+        prev = prod
+        for j in range(length):
+            cons = TestOneInOneOut()
+            graph.connect(prev, 'output', cons, 'input')
+            prev = cons
+        graph.connect(prev, 'output', sink, 'input')
+    return graph
+
+
+def _create_composite(depth):
+    composite = CompositePE()
+    first = TestOneInOneOut()
+    last = TestOneInOneOut() if depth <= 1 else _create_composite(depth - 1)
+    composite.connect(first, 'output', last, 'input')
+    composite._map_input('input', first, 'input')
+    composite._map_output('output', last, 'output')
+    return composite
+
+
+def create_composites(size, depth=4):
+    '''
+    Creates a pipeline of composite PEs that contain `depth` levels of
+    nested composites, with about `size` PEs in total.
+    '''
+    graph = WorkflowGraph()
+    prev = TestProducer()
+    for i in range(max(1, (size - 1) // (depth + 1))):
+        comp = _create_composite(depth)
+        graph.connect(prev, 'output', comp, 'input')
+        prev = comp
+    return graph
+
+
+def _time(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def run(graph):
+    '''
+    Plans the execution of a graph as the simple and the parallel mappings
+    do and returns the time of each step.
+    '''
+    times = []
+    _, t = _time(graph.flatten)
+    times.append(('flatten', t))
+    size = len(graph.graph.nodes())
+    _, t = _time(graph.propagate_types)
+    times.append(('types', t))
+    result, t = _time(processor.assign_and_connect, graph, size)
+    times.append(('assign', t))
+    processes, inputmappings, outputmappings = result
+    _, t = _time(processor._order_by_dependency, inputmappings,
+                 outputmappings)
+    times.append(('order', t))
+    fused, t = _time(processor.fuse_chains, graph)
+    times.append(('fuse', t))
+    _, t = _time(processor.create_partitioned, graph, None, fused,
+                 bool(fused))
+    times.append(('partition', t))
+    return times
+
+
+def main(sizes):
+    for size in sizes:
+        for name, create in [('pipeline', create_pipeline),
+                             ('sweep', create_sweep),
+                             ('composites', create_composites)]:
+            graph = create(size)
+            times = run(graph)
+            print('%s of %s PEs: %s, total %.3f' % (
+                name, len(graph.graph.nodes()),
+                ', '.join('%s %.3f' % t for t in times),
+                sum(t for _, t in times)))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000])
@@ -37,12 +37,23 @@ number of processes if running in a parallel environment.
 '''
 
 import argparse
+import array
+import copy
+import hashlib
+import heapq
 import os
+import pickle
+import time
 import types
+from collections import deque
 
-from dispel4py.core import GROUPING
-from dispel4py.utils import make_hash
+from dispel4py.core import GenericPE, GROUPING, COMBINER
+from dispel4py.base import BatchPE
+from dispel4py.utils import stable_hash, stable_hash_array
+from dispel4py.new.partitioners import Partitioner, \
+    PartitionerCommunication, HotKeyDetector
 from dispel4py.new.mappings import config
+from dispel4py.workflow_graph import WorkflowGraph
 
 STATUS_ACTIVE = 10
 STATUS_INACTIVE = 11
@@ -84,13 +95,39 @@ class GenericWriter(object):
         self.wrapper._write(self.name, data)
 
 
+class CombiningWriter(GenericWriter):
+    '''
+    Merges the data items written to an output with a combiner, see
+    :py:mod:`dispel4py.new.combiners`.
+    '''
+
+    def __init__(self, wrapper, name, combiner):
+        GenericWriter.__init__(self, wrapper, name)
+        # each instance holds its own merged data items
+        self.combiner = copy.deepcopy(combiner)
+
+    def write(self, data):
+        for item in self.combiner.add(data):
+            self.wrapper._write(self.name, item)
+
+    def flush(self):
+        for item in self.combiner.flush():
+            self.wrapper._write(self.name, item)
+
+
 class GenericWrapper(object):
 
     def __init__(self, pe):
         self.pe = pe
         self.pe.wrapper = self
-        for o in self.pe.outputconnections:
-            self.pe.outputconnections[o]['writer'] = GenericWriter(self, o)
+        self.combiners = {}
+        for o, output in self.pe.outputconnections.items():
+            combiner = output.get(COMBINER)
+            if combiner is None:
+                output['writer'] = GenericWriter(self, o)
+            else:
+                output['writer'] = self.combiners[o] = \
+                    CombiningWriter(self, o, combiner)
         self.targets = {}
         self._sources = {}
 
@@ -120,10 +157,15 @@ class GenericWrapper(object):
                 if outputs is not None:
                     # self.pe.log('Produced output: %s' % outputs)
                     for key, value in outputs.items():
-                        self._write(key, value)
+                        if key in self.combiners:
+                            self.combiners[key].write(value)
+                        else:
+                            self._write(key, value)
             inputs, status = self._read()
             # self.pe.log('Result: %s, status=%s' % (inputs, STATUS[status]))
         self.pe.postprocess()
+        for writer in self.combiners.values():
+            writer.flush()
         self._terminate()
         if num_iterations == 1:
             self.pe.log('Processed 1 iteration.')
@@ -149,6 +191,73 @@ class GenericWrapper(object):
         None
 
 
+def get_batch_config(args):
+    '''
+    Returns the batch size and the batch latency from the commandline
+    arguments. By default data items are not batched.
+    '''
+    batch_size = getattr(args, 'batch_size', None) or 1
+    batch_latency = getattr(args, 'batch_latency', None)
+    return max(1, batch_size), batch_latency
+
+
+class BatchingWrapper(GenericWrapper):
+    '''
+    A wrapper that sends data items to consumer processes in batches.
+    Data items are buffered for each destination and a batch is sent when
+    it contains `batch_size` items or when the oldest buffered item is older
+    than `batch_latency` seconds. Subclasses must call
+    :py:func:`~dispel4py.new.processor.BatchingWrapper._flush` before
+    waiting for input and when terminating, and implement
+    :py:func:`~dispel4py.new.processor.BatchingWrapper._send_batch`.
+    Before waiting for input when no input is available subclasses call
+    :py:func:`~dispel4py.new.processor.BatchingWrapper._flush_pe` so that a
+    :py:class:`~dispel4py.base.BatchPE`, or a partition containing one,
+    processes its partial block.
+    '''
+
+    def __init__(self, pe, batch_size=1, batch_latency=None):
+        GenericWrapper.__init__(self, pe)
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.output_buffers = {}
+        self.flush_time = None
+        # data items of batches that have been received but not processed
+        self.input_buffer = deque()
+
+    def _flush_if_due(self):
+        if self.flush_time is not None and time.time() >= self.flush_time:
+            self._flush()
+
+    def _buffer(self, dest, output):
+        try:
+            buf = self.output_buffers[dest]
+        except KeyError:
+            buf = self.output_buffers[dest] = []
+        buf.append(output)
+        if len(buf) >= self.batch_size:
+            self._send_batch(dest, self.output_buffers.pop(dest))
+        elif self.batch_latency is not None:
+            now = time.time()
+            if self.flush_time is None:
+                self.flush_time = now + self.batch_latency
+            elif now >= self.flush_time:
+                self._flush()
+
+    def _flush_pe(self):
+        # other PEs may define a method flush for their own purposes
+        if isinstance(self.pe, (BatchPE, SimpleProcessingPE)):
+            self.pe.flush()
+
+    def _flush(self):
+        for dest in list(self.output_buffers):
+            self._send_batch(dest, self.output_buffers.pop(dest))
+        self.flush_time = None
+
+    def _send_batch(self, dest, batch):
+        None
+
+
 class ShuffleCommunication(object):
     def __init__(self, rank, sources, destinations):
         self.destinations = destinations
@@ -160,18 +269,123 @@ class ShuffleCommunication(object):
         return [self.destinations[self.currentIndex]]
 
 
+class LoadBalancingCommunication(object):
+    '''
+    Sends each data item to the destination with the smallest number of
+    pending data items, so that faster consumers receive more data.
+    The mapping provides the pending number of items for each destination
+    rank in the attribute `load`, which is a local count by default.
+    Ties are broken in a round robin fashion.
+    '''
+    def __init__(self, rank, sources, destinations):
+        self.destinations = destinations
+        self.currentIndex = sources.index(rank) % len(self.destinations)
+        self.load = {d: 0 for d in destinations}
+        self.name = None
+
+    def getDestination(self, data):
+        load = self.load
+        num = len(self.destinations)
+        dest = None
+        for i in range(self.currentIndex, self.currentIndex + num):
+            d = self.destinations[i % num]
+            if dest is None or load[d] < load[dest]:
+                dest = d
+        self.currentIndex = (self.currentIndex + 1) % num
+        return [dest]
+
+
 class GroupByCommunication(object):
-    def __init__(self, destinations, input_name, groupby):
+    '''
+    Sends data items with the same values of the grouping attributes to the
+    same destination. The values are hashed with
+    :py:func:`~dispel4py.utils.stable_hash`, so the assignment of groups to
+    destinations is the same in all processes and across executions.
+
+    If a :py:class:`~dispel4py.new.partitioners.HotKeyDetector` is provided,
+    the data items of keys that it detects as hot are distributed in turn
+    across all destinations, starting with the destination of the key.
+    '''
+    def __init__(self, destinations, input_name, groupby, seed=0,
+                 detector=None):
         self.groupby = groupby
         self.destinations = destinations
         self.input_name = input_name
         self.name = groupby
+        self.seed = seed
+        self.detector = detector
+        self._counters = {}
+
+    def _key(self, data):
+        block = data[self.input_name]
+        if len(self.groupby) == 1:
+            return block[self.groupby[0]]
+        return tuple([block[x] for x in self.groupby])
+
+    def _split(self, key, index):
+        count = self._counters.get(key, 0)
+        self._counters[key] = count + 1
+        return (index + count) % len(self.destinations)
 
     def getDestination(self, data):
-        output = tuple([data[self.input_name][x] for x in self.groupby])
-        dest_index = abs(make_hash(output)) % len(self.destinations)
+        block = data[self.input_name]
+        if len(self.groupby) == 1:
+            key = block[self.groupby[0]]
+        else:
+            key = tuple([block[x] for x in self.groupby])
+        dest_index = stable_hash(key, self.seed) % len(self.destinations)
+        if self.detector is not None and self.detector.is_hot(key):
+            dest_index = self._split(key, dest_index)
         return [self.destinations[dest_index]]
 
+    def route(self, data_items):
+        '''
+        Assigns a list of data items to destinations, hashing all keys at
+        once.
+
+        :rtype: a dictionary mapping each destination to a list of data items
+        '''
+        keys = [self._key(data) for data in data_items]
+        hashes = stable_hash_array(keys, self.seed)
+        num = len(self.destinations)
+        if isinstance(hashes, list):
+            # NumPy is not available
+            indexes = [h % num for h in hashes]
+        else:
+            indexes = (hashes % num).tolist()
+        detector = self.detector
+        if detector is not None:
+            indexes = [self._split(key, index) if detector.is_hot(key)
+                       else index for key, index in zip(keys, indexes)]
+        result = {}
+        for data, index in zip(data_items, indexes):
+            dest = self.destinations[index]
+            try:
+                result[dest].append(data)
+            except KeyError:
+                result[dest] = [data]
+        return result
+
+
+def route(communication, data_items):
+    '''
+    Assigns a list of data items to the destinations of a communication.
+
+    :rtype: a dictionary mapping each destination to a list of data items
+    '''
+    try:
+        return communication.route(data_items)
+    except AttributeError:
+        pass
+    result = {}
+    for data in data_items:
+        for dest in communication.getDestination(data):
+            try:
+                result[dest].append(data)
+            except KeyError:
+                result[dest] = [data]
+    return result
+
 
 class AllToOneCommunication(object):
     def __init__(self, destinations):
@@ -191,15 +405,20 @@ class OneToAllCommunication(object):
         return self.destinations
 
 
-def _getConnectedInputs(node, graph):
-    names = []
-    for edge in graph.edges(node, data=True):
-        direction = edge[2]['DIRECTION']
-        dest = direction[1]
-        dest_input = edge[2]['TO_CONNECTION']
-        if dest == node.getContainedObject():
-            names.append(dest_input)
-    return names
+def set_hosts(targets, hosts):
+    '''
+    Provides the host name of each process to the communications of a
+    process that support locality, such as partitioners.
+
+    :param targets: the output mappings of a process
+    :param hosts: a dictionary mapping each process to its host name
+    '''
+    for target in targets.values():
+        for input_name, communication in target:
+            try:
+                communication.set_hosts(hosts)
+            except AttributeError:
+                pass
 
 
 def _getNumProcesses(size, numSources, numProcesses, totalProcesses):
@@ -207,17 +426,216 @@ def _getNumProcesses(size, numSources, numProcesses, totalProcesses):
     return int(numProcesses * (size - numSources) / div)
 
 
-def _assign_processes(workflow, size):
-    graph = workflow.graph
+def load_costs(filename):
+    '''
+    Reads the costs of PEs that were measured with the simple mapping (see
+    :py:func:`get_costs`) from a file in JSON format.
+    '''
+    import json
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_costs(costs, filename):
+    '''
+    Writes measured costs of PEs to a file in JSON format.
+    '''
+    import json
+    with open(filename, 'w') as f:
+        json.dump(costs, f, indent=4, sort_keys=True)
+
+
+def get_costs(workflow, measured=None):
+    '''
+    Returns the cost of each PE in the workflow as a tuple of the processing
+    time per data item in seconds and the fan-out, that is the number of
+    data items that the PE writes per data item that it reads. The fan-out
+    is a number or a dictionary mapping each output to a number.
+
+    Costs are taken from measurements, a dictionary that maps PE ids to
+    dictionaries with the keys `time` and `fan_out`, as produced by
+    :py:class:`SimpleProcessingPE`. Otherwise a PE may declare its cost
+    with the attributes `process_time` and `fan_out` (the default fan-out
+    is 1).
+
+    :param workflow: the workflow graph
+    :param measured: measured costs (optional)
+    :rtype: a dictionary mapping PE ids to costs, or `None` if no PE has a
+        cost
+    '''
+    costs = {}
+    for node in workflow.graph.nodes():
+        pe = node.getContainedObject()
+        if measured and pe.id in measured:
+            cost = measured[pe.id]
+            costs[pe.id] = cost['time'], cost['fan_out']
+        elif getattr(pe, 'process_time', None) is not None:
+            costs[pe.id] = pe.process_time, getattr(pe, 'fan_out', 1.0)
+    return costs or None
+
+
+def get_partition_costs(ubergraph, costs):
+    '''
+    Returns the costs of the partitions of a partitioned workflow (see
+    :py:func:`create_partitioned`), which are combined from the costs of
+    their PEs. Partitions that contain PEs without a cost have no cost.
+    '''
+    partition_costs = {}
+    for partition_pe in ubergraph.partition_pes:
+        pes = [node.getContainedObject()
+               for node in partition_pe.workflow.graph.nodes()]
+        if not all(pe.id in costs for pe in pes):
+            continue
+        rates = _get_rates(partition_pe.workflow, costs)
+        process_time = 0.0
+        fan_out = {}
+        for pe in pes:
+            process_time += rates[pe] * costs[pe.id][0]
+            for output_name in pe.outputconnections:
+                fan_out[(pe.id, output_name)] = \
+                    rates[pe] * _get_fan_out(costs[pe.id], output_name)
+        partition_costs[partition_pe.id] = process_time, fan_out
+    return partition_costs or None
+
+
+def get_cost_config(workflow, args):
+    '''
+    Returns the costs of the PEs in the workflow, read from the file given
+    by the commandline argument `--costs` or declared by the PEs.
+    '''
+    filename = getattr(args, 'costs', None)
+    measured = load_costs(filename) if filename else None
+    return get_costs(workflow, measured)
+
+
+def _get_fan_out(cost, output_name):
+    if cost is None:
+        return 1.0
+    fan_out = cost[1]
+    if isinstance(fan_out, dict):
+        return fan_out.get(output_name, 0.0)
+    return fan_out
+
+
+def _get_rates(workflow, costs):
+    '''
+    Returns the number of data items that each PE processes per iteration
+    of the sources of the workflow, following the connections from the
+    sources in topological order. Connections that close a cycle are
+    ignored.
+    '''
+    topology = workflow.topology()
+    num_inputs = dict((pe, len(inputs))
+                      for pe, inputs in topology.inputs.items())
+    rates = dict((pe, 0.0) for pe in topology.nodes)
+    ready = list(topology.sources)
+    for pe in ready:
+        rates[pe] = 1.0
+    while ready:
+        pe = ready.pop()
+        cost = costs.get(pe.id)
+        for output_name, dest, _ in topology.outputs[pe]:
+            rates[dest] += rates[pe] * _get_fan_out(cost, output_name)
+            num_inputs[dest] -= 1
+            if not num_inputs[dest]:
+                ready.append(dest)
+    return rates
+
+
+def _has_global_input(pe):
+    for connection in pe.inputconnections.values():
+        if connection.get(GROUPING) == 'global':
+            return True
+    return False
+
+
+def _assign_by_cost(workflow, size, costs, verbose=True):
+    '''
+    Assigns one process to each PE and then each spare process to the PE
+    with the highest load per process, where the load of a PE is the
+    processing time per iteration of the sources. This maximises the
+    predicted throughput of the workflow. Sources and PEs with a global
+    input are assigned one process, as are PEs without a cost.
+    '''
+    topology = workflow.topology()
+    rates = _get_rates(workflow, costs)
+    sources = []
+    counts = {}
+    loads = []
+    for pe in topology.nodes:
+        counts[pe.id] = 1
+        if not topology.inputs[pe]:
+            sources.append(pe.id)
+        elif pe.id in costs and not _has_global_input(pe):
+            load = rates[pe] * costs[pe.id][0]
+            if load > 0:
+                loads.append((-load, pe.id, load))
+    if len(counts) > size:
+        if verbose:
+            print('Graph is larger than job size: %s > %s.' %
+                  (len(counts), size))
+        return False, sources, {}
+    heapq.heapify(loads)
+    for i in range(size - len(counts)):
+        if not loads:
+            break
+        _, pe_id, load = heapq.heappop(loads)
+        counts[pe_id] += 1
+        heapq.heappush(loads, (-load / counts[pe_id], pe_id, load))
+    processes = {}
+    node_counter = 0
+    for pe in topology.nodes:
+        prcs = counts[pe.id]
+        processes[pe.id] = range(node_counter, node_counter + prcs)
+        node_counter = node_counter + prcs
+    return True, sources, processes
+
+
+def format_plan(workflow, processes, costs=None):
+    '''
+    Describes the assignment of processes to the PEs of the workflow and,
+    if the costs of the PEs are known, the predicted throughput.
+
+    :param workflow: the workflow graph
+    :param processes: the processes assigned to each PE
+    :param costs: the costs of the PEs, see :py:func:`get_costs` (optional)
+    :rtype: a string
+    '''
+    costs = costs or {}
+    rates = _get_rates(workflow, costs)
+    lines = ['Plan:']
+    throughput = None
+    bottleneck = None
+    for pe in sorted(rates, key=lambda pe: pe.id):
+        num = len(processes[pe.id])
+        line = '  %s: %s process%s' % (pe.id, num, '' if num == 1 else 'es')
+        if pe.id in costs:
+            load = rates[pe] * costs[pe.id][0] / num
+            line += ', %.3g items per iteration, %.3g s per item' % \
+                (rates[pe], costs[pe.id][0])
+            if load > 0 and (throughput is None or 1 / load < throughput):
+                throughput = 1 / load
+                bottleneck = pe.id
+        lines.append(line)
+    if throughput is None:
+        lines.append('Predicted throughput: unknown')
+    else:
+        lines.append('Predicted throughput: %.3g iterations/s '
+                     '(bottleneck: %s)' % (throughput, bottleneck))
+    return '\n'.join(lines)
+
+
+def _assign_processes(workflow, size, costs=None, verbose=True):
+    if costs is not None:
+        return _assign_by_cost(workflow, size, costs, verbose)
+    topology = workflow.topology()
     processes = {}
     success = True
     totalProcesses = 0
     numSources = 0
     sources = []
-    for node in graph.nodes():
-        pe = node.getContainedObject()
-        # if pe.inputconnections:
-        if _getConnectedInputs(node, graph):
+    for pe in topology.nodes:
+        if topology.inputs[pe]:
             totalProcesses = totalProcesses + pe.numprocesses
         else:
             sources.append(pe.id)
@@ -227,13 +645,13 @@ def _assign_processes(workflow, size):
     if totalProcesses > size:
         success = False
         # we need at least one process for each node in the graph
-        print('Graph is larger than job size: %s > %s.' %
-              (totalProcesses, size))
+        if verbose:
+            print('Graph is larger than job size: %s > %s.' %
+                  (totalProcesses, size))
     else:
         node_counter = 0
-        for node in graph.nodes():
-            pe = node.getContainedObject()
-            prcs = 1 if pe.id in sources else _getNumProcesses(
+        for pe in topology.nodes:
+            prcs = 1 if not topology.inputs[pe] else _getNumProcesses(
                 size, numSources, pe.numprocesses, totalProcesses)
             processes[pe.id] = range(node_counter, node_counter + prcs)
             node_counter = node_counter + prcs
@@ -241,81 +659,233 @@ def _assign_processes(workflow, size):
 
 
 def _getCommunication(rank, source_processes,
-                      dest, dest_input, dest_processes):
-    communication = ShuffleCommunication(
-        rank, source_processes, dest_processes)
+                      dest, dest_input, dest_processes, dynamic=False,
+                      merged=False):
+    if dynamic:
+        communication = LoadBalancingCommunication(
+            rank, source_processes, dest_processes)
+    else:
+        communication = ShuffleCommunication(
+            rank, source_processes, dest_processes)
     try:
         if GROUPING in dest.inputconnections[dest_input]:
             groupingtype = dest.inputconnections[dest_input][GROUPING]
             if isinstance(groupingtype, list):
+                detector = None
+                if merged and len(dest_processes) > 1:
+                    # a key is hot if it exceeds the share of one instance
+                    detector = HotKeyDetector(1.0 / len(dest_processes))
                 communication = GroupByCommunication(
-                    dest_processes, dest_input, groupingtype)
+                    dest_processes, dest_input, groupingtype,
+                    detector=detector)
             elif groupingtype == 'all':
                 communication = OneToAllCommunication(dest_processes)
             elif groupingtype == 'global':
                 communication = AllToOneCommunication(dest_processes)
+            elif isinstance(groupingtype, Partitioner):
+                communication = PartitionerCommunication(
+                    rank, dest_processes, dest_input, groupingtype)
     except KeyError:
         print("No input '%s' defined for PE '%s'" % (dest_input, dest.id))
         raise
     return communication
 
 
-def _create_connections(graph, node, processes):
-    pe = node.getContainedObject()
-    inputmappings = {i: {} for i in processes[pe.id]}
-    outputmappings = {i: {} for i in processes[pe.id]}
-    for edge in graph.edges(node, data=True):
-        direction = edge[2]['DIRECTION']
-        source = direction[0]
-        source_output = edge[2]['FROM_CONNECTION']
-        dest = direction[1]
-        dest_processes = list(processes[dest.id])
+def _create_connections(topology, pe, processes, dynamic=False, ranks=None):
+    # connects all processes of the PE unless the ranks are given
+    if ranks is None:
+        ranks = processes[pe.id]
+    inputmappings = {i: {} for i in ranks}
+    outputmappings = {i: {} for i in ranks}
+    for dest_input, source, source_output in topology.inputs[pe]:
         source_processes = list(processes[source.id])
-        dest_input = edge[2]['TO_CONNECTION']
-        allconnections = edge[2]['ALL_CONNECTIONS']
-        if dest == pe:
-            for i in processes[pe.id]:
-                for (source_output, dest_input) in allconnections:
-                    try:
-                        inputmappings[i][dest_input] += source_processes
-                    except KeyError:
-                        inputmappings[i][dest_input] = source_processes
-        if source == pe:
-            for i in processes[pe.id]:
-                for (source_output, dest_input) in allconnections:
-                    communication = _getCommunication(
-                        i, source_processes, dest, dest_input, dest_processes)
-                    try:
-                        outputmappings[i][source_output].append(
-                            (dest_input, communication))
-                    except KeyError:
-                        outputmappings[i][source_output] = \
-                            [(dest_input, communication)]
+        for i in ranks:
+            try:
+                inputmappings[i][dest_input] += source_processes
+            except KeyError:
+                inputmappings[i][dest_input] = list(source_processes)
+    for source_output, dest, dest_input in topology.outputs[pe]:
+        dest_processes = list(processes[dest.id])
+        source_processes = list(processes[pe.id])
+        # hot keys are only split if a merge step combines the results
+        merged = any(getattr(consumer, 'merge_of', None) == dest.id
+                     for _, consumer, _ in topology.outputs[dest])
+        for i in ranks:
+            communication = _getCommunication(
+                i, source_processes, dest, dest_input, dest_processes,
+                dynamic, merged)
+            try:
+                outputmappings[i][source_output].append(
+                    (dest_input, communication))
+            except KeyError:
+                outputmappings[i][source_output] = \
+                    [(dest_input, communication)]
     return inputmappings, outputmappings
 
 
-def _connect(workflow, processes):
-    graph = workflow.graph
+def connect(workflow, processes, dynamic=False):
+    '''
+    Creates the mappings of inputs and outputs for each process, given the
+    processes of each PE of the workflow.
+    '''
+    topology = workflow.topology()
     outputmappings = {}
     inputmappings = {}
-    for node in graph.nodes():
-        inc, outc = _create_connections(graph, node, processes)
+    for pe in topology.nodes:
+        inc, outc = _create_connections(topology, pe, processes, dynamic)
         inputmappings.update(inc)
         outputmappings.update(outc)
     return inputmappings, outputmappings
 
 
-def assign_and_connect(workflow, size):
-    success, sources, processes = _assign_processes(workflow, size)
-    if success:
-        inputmappings, outputmappings = _connect(workflow, processes)
+def assign_and_connect(workflow, size, dynamic=False, costs=None):
+    '''
+    Assigns processes to the PEs of the workflow and creates the mappings
+    of inputs and outputs for each process.
+    If `dynamic` is set, data on inputs without grouping is distributed
+    according to the load of the consumers instead of round robin.
+    If the `costs` of the PEs are provided (see :py:func:`get_costs`) the
+    number of processes of each PE is chosen to balance the load, otherwise
+    it is proportional to the attribute `numprocesses`.
+    '''
+    processes = assign_processes(workflow, size, costs)
+    if processes is not None:
+        inputmappings, outputmappings = connect(workflow, processes, dynamic)
         return processes, inputmappings, outputmappings
     else:
         return None
 
-import copy
 
-from dispel4py.workflow_graph import WorkflowGraph
+def assign_processes(workflow, size, costs=None):
+    '''
+    Assigns processes to the PEs of the workflow as
+    :py:func:`assign_and_connect` does, without creating the mappings of
+    the processes.
+
+    :rtype: a dictionary mapping the id of each PE to its processes, or
+        `None` if there are not enough processes
+    '''
+    success, sources, processes = _assign_processes(workflow, size, costs)
+    if success:
+        return processes
+    return None
+
+
+def copy_pe(pe):
+    '''
+    Creates an instance of a PE that shares the attributes of the original,
+    for example large lookup tables or models, and has its own connections.
+    This is sufficient for the parallel mappings as each instance is then
+    executed in its own process, where attributes that the instance modifies
+    are copied by the operating system or by pickling.
+    '''
+    cp = copy.copy(pe)
+    cp.inputconnections = dict((name, dict(connection)) for name, connection
+                               in pe.inputconnections.items())
+    cp.outputconnections = dict((name, dict(connection)) for name, connection
+                                in pe.outputconnections.items())
+    return cp
+
+
+def _get_merge_connections(pe):
+    if len(pe.inputconnections) != 1 or len(pe.outputconnections) != 1:
+        return None
+    input_name = list(pe.inputconnections.keys())[0]
+    output_name = list(pe.outputconnections.keys())[0]
+    grouping = pe.inputconnections[input_name].get(GROUPING)
+    if not isinstance(grouping, list):
+        return None
+    return input_name, output_name
+
+
+def _get_associative_pes(topology):
+    return [pe.id for pe in topology.nodes
+            if getattr(pe, 'associative', False) and
+            _get_merge_connections(pe) is not None]
+
+
+def insert_merge_steps(workflow, pe_ids=None):
+    '''
+    Returns a copy of the graph in which a merge step follows each
+    associative PE (see :py:class:`~dispel4py.core.GenericPE`) with an
+    input grouped by attributes, so that the data of hot keys can be split
+    across the instances of the PE. The merge step is a copy of the PE,
+    which receives the partial results of the PE grouped by the same
+    attributes and is connected to the consumers of the PE instead. Its
+    results are reported with the id of the PE, see
+    :py:func:`get_result_id`.
+    The graph itself is not changed, and the copy contains the same PEs.
+
+    :param workflow: the workflow
+    :param pe_ids: the ids of the PEs that are followed by a merge step, or
+        `None` for all associative PEs
+    :rtype: the copy of the graph, whose attribute `merge_steps` maps the
+        ids of the PEs to their merge steps
+    '''
+    topology = workflow.topology()
+    if pe_ids is None:
+        pe_ids = _get_associative_pes(topology)
+    planned = workflow.subgraph(topology.nodes)
+    planned.merge_steps = {}
+    for pe in topology.nodes:
+        if pe.id not in pe_ids:
+            continue
+        input_name, output_name = _get_merge_connections(pe)
+        consumers = topology.outputs[pe]
+        node = planned.objToNode[pe]
+        for edge in list(planned.graph.edges(node, data=True)):
+            if edge[2]['DIRECTION'][0] is pe:
+                planned.graph.remove_edge(edge[0], edge[1])
+        merge = copy.deepcopy(pe)
+        merge.associative = False
+        # the merge step only receives the partial results of the PE
+        merge.numprocesses = 1
+        merge.name = pe.name + 'Merge'
+        planned.connect(pe, output_name, merge, input_name)
+        # the same id in all processes that create the merge step
+        merge.id = pe.id + 'Merge'
+        merge.merge_of = pe.id
+        for _, dest, dest_input in consumers:
+            planned.connect(merge, output_name, dest, dest_input)
+        planned.merge_steps[pe.id] = merge
+    return planned
+
+
+def plan_merge_steps(workflow, size, costs=None):
+    '''
+    Returns a copy of the graph with merge steps after the associative PEs
+    that are assigned more than one process (see
+    :py:func:`insert_merge_steps`), as only these PEs can split the data of
+    hot keys. The merge steps take up processes too, so the PEs are assigned
+    again until every PE with a merge step has more than one process.
+
+    :param workflow: the workflow
+    :param size: the number of processes
+    :param costs: the costs of the PEs (optional)
+    :rtype: the copy of the graph, or the graph itself if no merge steps
+        are required
+    '''
+    pe_ids = _get_associative_pes(workflow.topology())
+    while pe_ids:
+        planned = insert_merge_steps(workflow, pe_ids)
+        success, _, processes = _assign_processes(planned, size, costs,
+                                                  verbose=False)
+        if not success:
+            break
+        parallel = [pe_id for pe_id in pe_ids
+                    if len(processes[pe_id]) > 1]
+        if parallel == pe_ids:
+            return planned
+        pe_ids = parallel
+    return workflow
+
+
+def get_result_id(pe):
+    '''
+    Returns the id under which the results of a PE are reported, which is
+    the id of the associative PE for a merge step.
+    '''
+    return getattr(pe, 'merge_of', pe.id)
 
 
 def get_partitions(workflow):
@@ -324,10 +894,9 @@ def get_partitions(workflow):
     except AttributeError:
         sourcePartition = []
         otherPartition = []
-        graph = workflow.graph
-        for node in graph.nodes():
-            pe = node.getContainedObject()
-            if not _getConnectedInputs(node, graph):
+        topology = workflow.topology()
+        for pe in topology.nodes:
+            if not topology.inputs[pe]:
                 sourcePartition.append(pe)
             else:
                 otherPartition.append(pe)
@@ -336,84 +905,219 @@ def get_partitions(workflow):
     return partitions
 
 
-def create_partitioned(workflow_all):
-    processes_all, inputmappings_all, outputmappings_all = \
-        assign_and_connect(workflow_all, len(workflow_all.graph.nodes()))
-    proc_to_pe_all = {v[0]: k for k, v in processes_all.items()}
-    partitions = get_partitions(workflow_all)
+def fuse_chains(workflow):
+    '''
+    Finds chains of PEs that can be executed in one process, so that the
+    data passed along a chain is not sent to another process. A PE is
+    appended to a chain if it has one connected input, which has no
+    grouping and is connected to the only output of the previous PE in the
+    chain. Sources are not fused as they are executed in one process.
+    If the workflow defines partitions explicitly no chains are fused.
+
+    :rtype: a list of partitions, that is the fused chains and the other
+        PEs on their own, or `None` if there are no chains to fuse
+    '''
+    if hasattr(workflow, 'partitions'):
+        return None
+    topology = workflow.topology()
+    pes = topology.nodes
+    following = {}
+    for pe in pes:
+        outputs = topology.outputs[pe]
+        if not topology.inputs[pe] or len(outputs) != 1 or \
+                len(pe.outputconnections) != 1:
+            continue
+        _, dest, input_name = outputs[0]
+        if dest is pe or len(topology.inputs[dest]) != 1 or \
+                dest.inputconnections[input_name].get(GROUPING):
+            continue
+        following[pe] = dest
+    heads = set(following) - set(following.values())
+    if not heads:
+        # there are no chains or all fusible PEs form cycles
+        return None
+    chains = {}
+    fused = set()
+    for head in heads:
+        chain = chains[head] = [head]
+        while chain[-1] in following:
+            chain.append(following[chain[-1]])
+        fused.update(chain)
+    partitions = []
+    for pe in pes:
+        if pe in heads:
+            partitions.append(chains[pe])
+        elif pe not in fused:
+            partitions.append([pe])
+    return partitions
+
+
+def format_fused(partitions):
+    '''
+    Describes the chains of PEs that were fused, see :py:func:`fuse_chains`.
+    '''
+    return ', '.join('[%s]' % ', '.join(pe.id for pe in part)
+                     for part in partitions if len(part) > 1)
+
+
+def _get_total_processes(workflow):
+    # the number of processes that assigns at least one process to each PE
+    return sum(max(1, node.getContainedObject().numprocesses)
+               for node in workflow.graph.nodes())
+
+
+def _get_partition_grouping(dest, dest_input):
+    # the grouping of an input of a partition, as used by the communication
+    # between the PEs of different partitions
+    grouping = dest.inputconnections[dest_input].get(GROUPING)
+    if isinstance(grouping, (list, Partitioner)) or \
+            grouping in ('all', 'global'):
+        return grouping
+    return None
+
+
+def _get_external_connections(workflow_all, partitions, pe_to_partition):
+    # the connections between PEs in different partitions, in the order of
+    # the PEs in the partitions and grouped by output
+    topology = workflow_all.topology()
+    pes_all = dict((pe.id, pe) for pe in topology.nodes)
     external_connections = []
+    for index in range(len(partitions)):
+        members = [pes_all[pe.id] for pe in partitions[index]
+                   if pe.id in pes_all]
+        for pe in sorted(members, key=topology.positions.__getitem__):
+            outputs = topology.outputs[pe]
+            first = {}
+            for position, (output_name, _, _) in enumerate(outputs):
+                first.setdefault(output_name, position)
+            for output_name, dest, dest_input in \
+                    sorted(outputs, key=lambda o: first[o[0]]):
+                dest_partition = pe_to_partition[dest.id]
+                if dest_partition != index:
+                    external_connections.append((
+                        _get_partition_grouping(dest, dest_input),
+                        index, pe.id, output_name,
+                        dest_partition, dest.id, dest_input))
+    return external_connections
+
+
+def _create_partition_pe(workflow_all, pes_all, part, index, data_mode,
+                         fused, compiled, result_mappings):
+    # the partition shares the configuration of the PEs with the
+    # workflow instead of copying the whole workflow
+    workflow = workflow_all.subgraph(
+        [pes_all[pe.id] for pe in part if pe.id in pes_all],
+        copy=copy_pe)
+    graph = workflow.graph
+    for node in graph.nodes():
+        # each PE is executed once within the partition
+        node.getContainedObject().numprocesses = 1
+    try:
+        processes, ordered = compiled[index]
+        inputmappings, outputmappings = connect(workflow, processes)
+    except KeyError:
+        processes, inputmappings, outputmappings = \
+            assign_and_connect(workflow, len(graph.nodes()))
+        ordered = None
+    proc_to_pe = {}
+    for node in list(graph.nodes()):
+        pe = node.getContainedObject()
+        proc_to_pe[processes[pe.id][0]] = pe
+        pe.rank = index
+    partition_pe = SimpleProcessingPE(inputmappings,
+                                      outputmappings,
+                                      proc_to_pe,
+                                      ordered)
+    compiled[index] = (processes, partition_pe.ordered)
+
+    # use number of processes if specified in graph
+    try:
+        partition_pe.numprocesses = workflow_all.numprocesses[index]
+    except:
+        # use default assignment of processes
+        if fused:
+            partition_pe.numprocesses = max(pe.numprocesses
+                                            for pe in part)
+    partition_pe.fused = fused
+
+    partition_pe.workflow = workflow
+    partition_pe.partition_id = index
+    partition_pe.data_mode = data_mode
+    if result_mappings:
+        partition_pe.result_mappings = result_mappings
+    partition_pe.map_inputs = _map_inputs_to_pes
+    partition_pe.map_outputs = _map_outputs_from_pes
+    return partition_pe
+
+
+def create_partitioned(workflow_all, data_mode=None, partitions=None,
+                       fused=False, compiled=None, only=None):
+    '''
+    Creates a graph of :py:class:`SimpleProcessingPE` that each execute
+    one partition of the workflow.
+
+    :param workflow_all: the workflow graph
+    :param data_mode: how data is passed to more than one consumer
+    :param partitions: the partitions, a list of lists of PEs (optional,
+        the default is the attribute `partitions` of the workflow or a
+        partition of the sources and a partition of the other PEs)
+    :param fused: whether the partitions are fused chains, see
+        :py:func:`fuse_chains`. The number of processes of a fused chain is
+        the maximum of its PEs, and its results are reported as written by
+        the PEs of the chain.
+    :param compiled: a dictionary with the processes and the order of the
+        PEs of the partitions by index from a previous call for the same
+        workflow, see :py:class:`CompiledPlan`. Partitions that are missing
+        are planned and stored in the dictionary.
+    :param only: the index of a partition (optional). If it is given only
+        this partition is created, and the other partitions are replaced by
+        PEs that declare the inputs and outputs of the partition but cannot
+        be executed. This is sufficient to connect the processes of the
+        partition, see :py:func:`create_process`.
+    '''
+    if compiled is None:
+        compiled = {}
+    if partitions is None:
+        partitions = get_partitions(workflow_all)
     pe_to_partition = {}
-    partition_pes = []
     for i in range(len(partitions)):
         for pe in partitions[i]:
             pe_to_partition[pe.id] = i
-    for index in range(len(partitions)):
-        result_mappings = {}
-        part = partitions[index]
-        partition_id = index
-        component_ids = [pe.id for pe in part]
-        workflow = copy.deepcopy(workflow_all)
-        graph = workflow.graph
-        for node in graph.nodes():
-            if node.getContainedObject().id not in component_ids:
-                graph.remove_node(node)
-        processes, inputmappings, outputmappings = \
-            assign_and_connect(workflow, len(graph.nodes()))
-        proc_to_pe = {}
-        for node in list(graph.nodes()):
-            pe = node.getContainedObject()
-            proc_to_pe[processes[pe.id][0]] = pe
-        for node in graph.nodes():
-            pe = node.getContainedObject()
-            pe.rank = index
-            proc_all = processes_all[pe.id][0]
-            for output_name in outputmappings_all[proc_all]:
-                for dest_input, comm_all in\
-                        outputmappings_all[proc_all][output_name]:
-                    dest = proc_to_pe_all[comm_all.destinations[0]]
-                    if dest not in processes:
-                        # it's an external connection
-                        external_connections.append((comm_all,
-                                                     partition_id,
-                                                     pe.id,
-                                                     output_name,
-                                                     pe_to_partition[dest],
-                                                     dest, dest_input))
-                        try:
-                            result_mappings[pe.id].append(output_name)
-                        except:
-                            result_mappings[pe.id] = [output_name]
-        partition_pe = SimpleProcessingPE(inputmappings,
-                                          outputmappings,
-                                          proc_to_pe)
-
-        # use number of processes if specified in graph
+    external_connections = _get_external_connections(
+        workflow_all, partitions, pe_to_partition)
+    result_mappings = [{} for part in partitions]
+    for _, source_partition, source_id, source_output, _, _, _ in \
+            external_connections:
         try:
-            partition_pe.numprocesses = workflow_all.numprocesses[partition_id]
-        except:
-            # use default assignment of processes
-            pass
-
-        partition_pe.workflow = workflow
-        partition_pe.partition_id = partition_id
-        if result_mappings:
-            partition_pe.result_mappings = result_mappings
-        partition_pe.map_inputs = _map_inputs_to_pes
-        partition_pe.map_outputs = _map_outputs_from_pes
+            result_mappings[source_partition][source_id].append(
+                source_output)
+        except KeyError:
+            result_mappings[source_partition][source_id] = [source_output]
+    pes_all = dict((pe.id, pe) for pe in workflow_all.topology().nodes)
+    partition_pes = []
+    for index in range(len(partitions)):
+        if only is None or only == index:
+            partition_pe = _create_partition_pe(
+                workflow_all, pes_all, partitions[index], index, data_mode,
+                fused, compiled, result_mappings[index])
+        else:
+            partition_pe = GenericPE()
+            partition_pe.name = SimpleProcessingPE.__name__
+            partition_pe.partition_id = index
         partition_pes.append(partition_pe)
     # print 'EXTERNAL CONNECTIONS : %s' % external_connections
     ubergraph = WorkflowGraph()
     ubergraph.pe_to_partition = pe_to_partition
     ubergraph.partition_pes = partition_pes
-    # sort the external connections so that nodes are added in the same order
-    # if doing this in multiple processes in parallel this is important
-    for comm, source_partition, source_id, source_output, dest_partition, \
-        dest_id, dest_input in \
-            sorted(external_connections,
-                   key=lambda connections: len(connections)):
+    ubergraph.partitions = partitions
+    ubergraph.fused = fused
+    # the external connections are in the same order in every process, so
+    # the nodes are added in the same order
+    for grouping, source_partition, source_id, source_output, \
+            dest_partition, dest_id, dest_input in external_connections:
         partition_pes[source_partition]._add_output((source_id, source_output))
         partition_pes[dest_partition]._add_input((dest_id, dest_input),
-                                                 grouping=comm.name)
+                                                 grouping=grouping)
         ubergraph.connect(partition_pes[source_partition],
                           (source_id, source_output),
                           partition_pes[dest_partition],
@@ -421,6 +1125,431 @@ def create_partitioned(workflow_all):
     return ubergraph
 
 
+def _fingerprint_grouping(grouping):
+    if grouping is None or isinstance(grouping, (str, list)):
+        return repr(grouping)
+    try:
+        # partitioners are described by their state
+        return hashlib.sha1(pickle.dumps(grouping, 2)).hexdigest()
+    except Exception:
+        # the grouping cannot be compared with other runs, for example a
+        # function, so the fingerprint is unique
+        return repr(grouping)
+
+
+def get_fingerprint(workflow, options=None):
+    '''
+    Returns a fingerprint of the structure of a workflow, that is the ids,
+    classes and numbers of processes of the PEs, their inputs, outputs and
+    groupings and the connections between them, and of the given options.
+    Workflows with the same fingerprint are mapped to processes in the same
+    way.
+
+    :param workflow: the workflow graph
+    :param options: other parameters of the mapping, which must have a
+        stable representation
+    :rtype: a string
+    '''
+    digest = hashlib.sha1()
+    topology = workflow.topology()
+    for pe in topology.nodes:
+        description = (
+            pe.id, type(pe).__module__, type(pe).__name__, pe.numprocesses,
+            getattr(pe, 'associative', False),
+            sorted((repr(name),
+                    _fingerprint_grouping(connection.get(GROUPING)))
+                   for name, connection in pe.inputconnections.items()),
+            sorted(repr(name) for name in pe.outputconnections),
+            [(output_name, dest.id, input_name)
+             for output_name, dest, input_name in topology.outputs[pe]])
+        digest.update(repr(description).encode('utf-8'))
+    partitions = getattr(workflow, 'partitions', None)
+    if partitions is not None:
+        partitions = [[pe.id for pe in part] for part in partitions]
+    digest.update(repr((partitions, getattr(workflow, 'numprocesses', None),
+                        options)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CompiledPlan(object):
+    '''
+    The mapping of a workflow to processes, which can be saved and reused to
+    enact a workflow with the same fingerprint (see
+    :py:func:`get_fingerprint`) without planning again. The plan refers to
+    PEs by their ids and contains only the assignment of processes, so it is
+    saved as JSON. The connections of the processes are created again when
+    the plan is used.
+
+    :ivar fingerprint: the fingerprint of the workflow and the options
+    :ivar dynamic: whether data is distributed according to the load of the
+        consumers
+    :ivar fused: the ids of the PEs of each partition if chains of PEs were
+        fused (see :py:func:`fuse_chains`), otherwise `None`
+    :ivar partitioned: whether the workflow was partitioned
+    :ivar partitions: the processes and the order of the PEs within each
+        partition, see :py:func:`create_partitioned`
+    :ivar processes: the processes of each PE, or of each partition, or
+        `None` if the mapping is not complete
+    '''
+
+    def __init__(self, fingerprint, dynamic=False):
+        self.fingerprint = fingerprint
+        self.dynamic = dynamic
+        self.fused = None
+        self.partitioned = False
+        self.partitions = {}
+        self.processes = None
+
+    def set_fused(self, partitions):
+        if partitions:
+            self.fused = [[pe.id for pe in part] for part in partitions]
+
+    def get_fused(self, workflow):
+        '''
+        Returns the fused partitions of the PEs of the workflow, or `None`.
+        '''
+        if self.fused is None:
+            return None
+        pes = dict((pe.id, pe) for pe in workflow.topology().nodes)
+        return [[pes[pe_id] for pe_id in part] for part in self.fused]
+
+    def set_processes(self, workflow, processes):
+        '''
+        Stores the processes of the workflow, or of the partitioned workflow
+        that was created by :py:func:`create_partitioned`.
+        '''
+        try:
+            # partitions are identified by their index
+            self.processes = [list(processes[pe.id])
+                              for pe in workflow.partition_pes]
+            self.partitioned = True
+        except AttributeError:
+            self.processes = dict((pe_id, list(procs))
+                                  for pe_id, procs in processes.items())
+            self.partitioned = False
+
+    def get_processes(self, workflow):
+        '''
+        Returns the processes of each PE of the workflow, or of each
+        partition of the partitioned workflow.
+        '''
+        if self.partitioned:
+            return dict((pe.id, procs) for pe, procs
+                        in zip(workflow.partition_pes, self.processes))
+        return self.processes
+
+    def get_mapping(self, workflow):
+        '''
+        Returns the processes, input mappings and output mappings of the
+        workflow, or of the partitioned workflow.
+        '''
+        processes = self.get_processes(workflow)
+        return (processes,) + connect(workflow, processes, self.dynamic)
+
+    def to_dict(self):
+        '''
+        Returns the plan as a dictionary that can be written as JSON.
+        '''
+        return {'fingerprint': self.fingerprint,
+                'dynamic': self.dynamic,
+                'fused': self.fused,
+                'partitioned': self.partitioned,
+                'partitions': dict(
+                    (str(index), [dict((pe_id, list(procs))
+                                       for pe_id, procs in processes.items()),
+                                  list(ordered)])
+                    for index, (processes, ordered)
+                    in self.partitions.items()),
+                'processes': self.processes}
+
+    @staticmethod
+    def from_dict(data):
+        '''
+        Creates a plan from a dictionary returned by :py:meth:`to_dict`.
+        '''
+        plan = CompiledPlan(data['fingerprint'], data['dynamic'])
+        plan.fused = data['fused']
+        plan.partitioned = data['partitioned']
+        plan.partitions = dict(
+            (int(index), (processes, ordered))
+            for index, (processes, ordered) in data['partitions'].items())
+        plan.processes = data['processes']
+        return plan
+
+
+def get_plan_fingerprint(workflow, size, args, costs=None):
+    '''
+    Returns the fingerprint of the workflow and of the commandline
+    arguments that affect its mapping to `size` processes.
+    '''
+    if costs:
+        costs = sorted(costs.items())
+    options = (size, bool(getattr(args, 'simple', False)),
+               bool(getattr(args, 'dynamic', False)),
+               bool(getattr(args, 'fuse', False)), costs)
+    return get_fingerprint(workflow, options)
+
+
+def _get_plan_file(directory, fingerprint):
+    return os.path.join(directory, '%s.json' % fingerprint)
+
+
+def load_plan(directory, fingerprint):
+    '''
+    Reads the compiled plan with the given fingerprint from a directory.
+    Plans are stored as JSON, so reading a plan does not execute any code.
+
+    :rtype: CompiledPlan, or `None` if there is no valid plan
+    '''
+    import json
+    try:
+        with open(_get_plan_file(directory, fingerprint)) as f:
+            plan = CompiledPlan.from_dict(json.load(f))
+    except Exception:
+        return None
+    if plan.fingerprint != fingerprint or plan.processes is None:
+        return None
+    return plan
+
+
+def save_plan(plan, directory):
+    '''
+    Writes a compiled plan to a directory. The file is replaced atomically
+    so that processes that read the plan concurrently see a complete plan.
+    '''
+    import json
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    data = json.dumps(plan.to_dict(), sort_keys=True)
+    filename = _get_plan_file(directory, plan.fingerprint)
+    tmp = '%s.%s' % (filename, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(data)
+    try:
+        os.replace(tmp, filename)
+    except AttributeError:
+        # Python 2
+        os.rename(tmp, filename)
+
+
+def load_plan_config(workflow, args, size, costs=None):
+    '''
+    Returns the compiled plan of the workflow from the directory given by
+    the commandline argument `--plan-cache`. If there is no plan with the
+    fingerprint of the workflow and the arguments a new plan is returned,
+    which is completed by the mapping and saved with
+    :py:func:`save_plan_config`.
+
+    :rtype: CompiledPlan, or `None` if there is no plan cache
+    '''
+    directory = getattr(args, 'plan_cache', None)
+    if not directory:
+        return None
+    fingerprint = get_plan_fingerprint(workflow, size, args, costs)
+    plan = load_plan(directory, fingerprint)
+    if plan is None:
+        return CompiledPlan(fingerprint,
+                            bool(getattr(args, 'dynamic', False)))
+    print('Loaded plan %s' % fingerprint)
+    return plan
+
+
+def save_plan_config(plan, args):
+    '''
+    Saves a new plan to the directory given by the commandline argument
+    `--plan-cache`. Failures are reported but do not stop the enactment.
+    '''
+    directory = getattr(args, 'plan_cache', None)
+    if plan is None or not directory:
+        return
+    try:
+        save_plan(plan, directory)
+        print('Saved plan %s' % plan.fingerprint)
+    except Exception as exc:
+        print('Could not save plan %s: %s' % (plan.fingerprint, exc))
+
+
+class FlatPlan(object):
+    '''
+    A compact description of the mapping of a workflow to processes, which
+    is planned by one process and sent to all processes. Each process then
+    creates only its own PE and connections, see :py:func:`create_process`.
+
+    :param workflow: the workflow
+    :param planned: the graph that was assigned processes, that is the
+        workflow or the graph of partitions created by
+        :py:func:`create_partitioned`
+    :param processes: the processes of each PE of the planned graph
+    :param size: the number of processes
+    :param inputs: the inputs provided to the PEs of the planned graph
+
+    :ivar partitions: the positions of the PEs of each partition in the
+        workflow, or `None` if the workflow is not partitioned
+    :ivar fused: whether the partitions are fused chains
+    :ivar partition_ids: the ids of the partitions, so that the partitions
+        have the same ids in all processes
+    :ivar ranks: an integer array with the index of the PE, or of the
+        partition, of each process or -1 if the process is idle
+    :ivar inputs: the inputs provided to each PE or partition by index
+    :ivar merge_steps: the ids of the PEs that are followed by a merge step
+        (see :py:func:`insert_merge_steps`)
+    '''
+
+    def __init__(self, workflow, planned, processes, size, inputs=None):
+        topology = workflow.topology()
+        try:
+            pes = planned.partition_pes
+            positions = dict((pe.id, i) for i, pe in enumerate(topology.nodes))
+            self.partitions = [[positions[pe.id] for pe in part
+                                if pe.id in positions]
+                               for part in planned.partitions]
+            self.fused = planned.fused
+            self.partition_ids = [pe.id for pe in pes]
+        except AttributeError:
+            pes = topology.nodes
+            self.partitions = None
+            self.fused = False
+            self.partition_ids = None
+        self.ranks = array.array('i', [-1]) * size
+        self.inputs = {}
+        self.merge_steps = list(getattr(workflow, 'merge_steps', ()))
+        for index, pe in enumerate(pes):
+            for proc in processes.get(pe.id, ()):
+                self.ranks[proc] = index
+            if inputs is not None:
+                provided = get_inputs(pe, inputs)
+                if provided is not None:
+                    self.inputs[index] = provided
+
+    def get_processes(self, pes):
+        '''
+        Returns the processes of each PE, given the PEs or partitions in
+        order of their index.
+        '''
+        processes = {}
+        for proc, index in enumerate(self.ranks):
+            if index >= 0:
+                try:
+                    processes[pes[index].id].append(proc)
+                except KeyError:
+                    processes[pes[index].id] = [proc]
+        return processes
+
+
+def create_process(workflow, plan, rank, data_mode=None, dynamic=False,
+                   planned=None):
+    '''
+    Creates the PE that is executed by a process and the mappings of its
+    inputs and outputs from a flat plan. If the workflow is partitioned
+    only the partition of the process is created, unless the planned graph
+    is provided.
+
+    :param workflow: the workflow
+    :param plan: the flat plan, see :py:class:`FlatPlan`
+    :param rank: the process
+    :param data_mode: how data is passed to more than one consumer within
+        a partition
+    :param dynamic: whether data is distributed according to the load of
+        the consumers
+    :param planned: the graph that was planned, if it was planned by this
+        process (optional)
+    :rtype: a tuple of the PE, the mappings of inputs and outputs of the
+        process and the provided inputs, or `None` if the process is idle
+    '''
+    index = plan.ranks[rank]
+    if index < 0:
+        return None
+    if planned is None and plan.merge_steps:
+        workflow = insert_merge_steps(workflow, plan.merge_steps)
+    if plan.partitions is None:
+        graph = workflow if planned is None else planned
+        pes = graph.topology().nodes
+    elif planned is not None:
+        graph = planned
+        pes = planned.partition_pes
+    else:
+        nodes = workflow.topology().nodes
+        partitions = [[nodes[i] for i in part] for part in plan.partitions]
+        graph = create_partitioned(workflow, data_mode, partitions,
+                                   plan.fused, only=index)
+        pes = graph.partition_pes
+        for pe, pe_id in zip(pes, plan.partition_ids):
+            pe.id = pe_id
+    pe = pes[index]
+    inputmappings, outputmappings = _create_connections(
+        graph.topology(), pe, plan.get_processes(pes), dynamic, [rank])
+    return (pe, inputmappings[rank], outputmappings[rank],
+            plan.inputs.get(index))
+
+
+def create_flat_plan(workflow, inputs, args, size, dynamic=False):
+    '''
+    Plans the execution of the workflow with `size` processes as configured
+    by the commandline arguments, in one process. The plan is then sent to
+    all processes, which create their PEs with :py:func:`create_process`.
+
+    :rtype: a tuple of the flat plan (see :py:class:`FlatPlan`) and the
+        planned graph, or of `None` and `None` if the workflow cannot be
+        executed
+    '''
+    fused = None
+    costs = None
+    if not args.simple:
+        costs = get_cost_config(workflow, args)
+        workflow = plan_merge_steps(workflow, size, costs)
+    plan = load_plan_config(workflow, args, size, costs)
+    cached = plan is not None and plan.processes is not None
+    success = True
+    if cached:
+        fused = plan.get_fused(workflow)
+        success = not plan.partitioned
+    elif not args.simple and getattr(args, 'fuse', False):
+        fused = fuse_chains(workflow)
+        if plan is not None:
+            plan.set_fused(fused)
+    planned = workflow
+    if cached and success:
+        processes = plan.get_processes(workflow)
+    elif not args.simple and not fused:
+        # only the root process needs the processes of all PEs, the
+        # connections are created by each process
+        processes = assign_processes(workflow, size, costs)
+        success = processes is not None
+
+    if args.simple or fused or not success:
+        ubergraph = create_partitioned(
+            workflow, getattr(args, 'data_mode', None), fused, bool(fused),
+            plan.partitions if plan is not None else None)
+        if fused:
+            print('Fused: %s' % format_fused(fused))
+        else:
+            print('Partitions: %s' % ', '.join(('[%s]' % ', '.join(
+                (pe.id for pe in part)) for part in ubergraph.partitions)))
+        for node in ubergraph.graph.nodes():
+            wrapperPE = node.getContainedObject()
+            print('%s contains %s' % (wrapperPE.id,
+                                      [n.getContainedObject().id for n in
+                                       wrapperPE.workflow.graph.nodes()]))
+        if costs:
+            costs = get_partition_costs(ubergraph, costs)
+        if cached:
+            processes = plan.get_processes(ubergraph)
+        else:
+            processes = assign_processes(ubergraph, size, costs)
+        if processes is None:
+            return None, None
+        inputs = map_inputs_to_partitions(ubergraph, inputs)
+        planned = ubergraph
+
+    print('Processes: %s' % processes)
+    if getattr(args, 'plan', False):
+        print(format_plan(planned, processes, costs))
+    if plan is not None and not cached:
+        plan.set_processes(planned, processes)
+        save_plan_config(plan, args)
+    return FlatPlan(workflow, planned, processes, size, inputs), planned
+
+
 def map_inputs_to_partitions(ubergraph, inputs):
     mapped_input = {}
     for pe in inputs:
@@ -471,62 +1600,207 @@ def _no_map(data):
     return data
 
 
-from dispel4py.core import GenericPE
-
-
 def _is_root(node, workflow):
-    result = True
-    pe = node.getContainedObject()
-    for edge in workflow.graph[node].values():
-        if pe == edge['DIRECTION'][1]:
-            result = False
-            break
-    return result
+    return not workflow.topology().inputs[node.getContainedObject()]
 
 
-def _get_dependencies(proc, inputmappings):
-    dep = []
-    for input_name, sources in inputmappings[proc].items():
-        for s in sources:
-            sdep = _get_dependencies(s, inputmappings)
-            for n in sdep:
-                if n not in dep:
-                    dep.append(n)
-            if s not in dep:
-                dep.append(s)
-    return dep
+def _get_dependencies(sinks, inputmappings):
+    '''
+    Returns the set of processes that the given processes depend on,
+    including the processes themselves.
+    '''
+    required = set()
+    stack = list(sinks)
+    while stack:
+        proc = stack.pop()
+        if proc in required:
+            continue
+        required.add(proc)
+        for sources in inputmappings[proc].values():
+            stack.extend(sources)
+    return required
 
 
 def _order_by_dependency(inputmappings, outputmappings):
-    ordered = []
-    for proc in outputmappings:
-        if not outputmappings[proc]:
-            dep = _get_dependencies(proc, inputmappings)
-            for n in ordered:
-                try:
-                    dep.remove(n)
-                except:
-                    # never mind if the element wasn't in the list
-                    pass
-            ordered += dep
-            ordered.append(proc)
+    '''
+    Returns the processes that the sinks, that is the processes without
+    outputs, depend on in topological order (Kahn's algorithm). Processes
+    that are part of a cycle or depend on a cycle follow in the order of
+    `outputmappings`.
+    '''
+    procs = list(outputmappings)
+    required = _get_dependencies(
+        [proc for proc in procs if not outputmappings[proc]], inputmappings)
+    consumers = dict((proc, []) for proc in required)
+    num_sources = {}
+    for proc in procs:
+        if proc not in required:
+            continue
+        sources = set()
+        for input_sources in inputmappings[proc].values():
+            sources.update(input_sources)
+        num_sources[proc] = len(sources)
+        for source in sources:
+            consumers[source].append(proc)
+    ordered = [proc for proc in procs
+               if proc in required and not num_sources[proc]]
+    for proc in ordered:
+        for consumer in consumers[proc]:
+            num_sources[consumer] -= 1
+            if not num_sources[consumer]:
+                ordered.append(consumer)
+    if len(ordered) < len(required):
+        done = set(ordered)
+        ordered.extend(proc for proc in procs
+                       if proc in required and proc not in done)
     return ordered
 
 
+# Modes for passing data to more than one consumer within a process.
+# By default each consumer receives a copy of the data.
+DATA_COPY = 'copy'
+# All consumers share the same object, which they must not modify.
+DATA_SHARED = 'shared'
+# As DATA_SHARED but raise an error if a consumer modifies the data.
+DATA_CHECKED = 'checked'
+DATA_MODES = [DATA_COPY, DATA_SHARED, DATA_CHECKED]
+
+
+def _fingerprint(data):
+    try:
+        return hashlib.md5(
+            pickle.dumps(data, pickle.HIGHEST_PROTOCOL)).digest()
+    except:
+        # the data cannot be pickled so modifications cannot be detected
+        return None
+
+
 class SimpleProcessingPE(GenericPE):
     '''
     A PE that processes a subgraph of PEs in sequence.
+
+    If the output of a PE is connected to more than one consumer each
+    consumer receives a deep copy of the data. A PE may declare that its
+    output data is never modified by setting the attribute `data_mode` to
+    `DATA_SHARED`, in which case all consumers receive the same object.
+    The attribute `data_mode` of this PE sets the mode for all PEs in the
+    subgraph that do not declare their own. With `DATA_CHECKED` data is
+    shared and an exception is raised if a consumer modifies it.
+
+    By default each PE processes all of its input data before the next PE
+    in the subgraph is executed, so all intermediate data is held in memory.
+    If `streaming` is set, data written by a PE is processed by its
+    consumers immediately, depth first. Each PE buffers at most
+    `buffer_size` pending data items (the default is 1), unless it is part
+    of a cycle, so the memory usage does not depend on the size of the
+    input.
+
+    If `costs` is set to a dictionary the processing time and the number of
+    data items written by each PE are recorded, see
+    :py:func:`~dispel4py.new.processor.SimpleProcessingPE.measured_costs`.
     '''
-    def __init__(self, input_mappings, output_mappings, proc_to_pe):
+    def __init__(self, input_mappings, output_mappings, proc_to_pe,
+                 ordered=None):
         GenericPE.__init__(self)
         # work out the order of PEs
-        self.ordered = _order_by_dependency(input_mappings, output_mappings)
+        if ordered is None:
+            ordered = _order_by_dependency(input_mappings, output_mappings)
+        self.ordered = ordered
         self.input_mappings = input_mappings
         self.output_mappings = output_mappings
         self.proc_to_pe = proc_to_pe
         self.result_mappings = None
         self.map_inputs = _no_map
         self.map_outputs = _no_map
+        self.data_mode = None
+        # fingerprints of shared data items if checking is enabled
+        self.shared_data = {}
+        self.streaming = False
+        self.buffer_size = 1
+        # data items waiting to be processed by each PE when streaming
+        self._pending = {}
+        self._active = set()
+        self.costs = None
+        # PEs in the subgraph that process data in blocks
+        self._batch_procs = None
+        # combiners of the outputs of each PE
+        self._combiners = {}
+        # time spent in consumers that are processed depth first
+        self._inner_time = 0.0
+
+    def _process_data(self, pe, data):
+        if self.costs is None:
+            _process_data(pe, data)
+        else:
+            self._measure(pe, data)
+        if self.shared_data:
+            self._check_shared(pe, data)
+
+    def _get_combiners(self, pe):
+        try:
+            return self._combiners[pe.id]
+        except KeyError:
+            pass
+        combiners = dict((name, copy.deepcopy(output[COMBINER]))
+                         for name, output in pe.outputconnections.items()
+                         if COMBINER in output)
+        self._combiners[pe.id] = combiners
+        return combiners
+
+    def _get_cost(self, pe):
+        try:
+            return self.costs[pe.id]
+        except KeyError:
+            cost = self.costs[pe.id] = {'count': 0, 'time': 0.0,
+                                        'outputs': {}}
+            return cost
+
+    def _measure(self, pe, data):
+        cost = self._get_cost(pe)
+        inner_time = self._inner_time
+        self._inner_time = 0.0
+        start = time.time()
+        try:
+            _process_data(pe, data)
+        finally:
+            elapsed = time.time() - start
+            cost['time'] += elapsed - self._inner_time
+            cost['count'] += 1
+            self._inner_time = inner_time + elapsed
+
+    def _count_output(self, pe, output_name):
+        outputs = self._get_cost(pe)['outputs']
+        outputs[output_name] = outputs.get(output_name, 0) + 1
+
+    def measured_costs(self):
+        '''
+        Returns the costs of the PEs that were measured, as a dictionary
+        mapping each PE id to the average processing time per data item in
+        seconds (`time`), the average number of data items written to each
+        output per data item processed (`fan_out`) and the number of data
+        items processed (`count`).
+        '''
+        result = {}
+        for pe_id, cost in self.costs.items():
+            count = max(1, cost['count'])
+            result[pe_id] = {
+                'time': cost['time'] / count,
+                'fan_out': dict((output_name, num / float(count))
+                                for output_name, num
+                                in cost['outputs'].items()),
+                'count': cost['count']}
+        return result
+
+    def _check_shared(self, pe, data):
+        for input_name, value in data.items():
+            try:
+                obj, fingerprint, producer = self.shared_data[id(value)]
+            except KeyError:
+                continue
+            if obj is value and _fingerprint(value) != fingerprint:
+                raise Exception(
+                    "PE '%s' modified shared data on input '%s' "
+                    "written by PE '%s'" % (pe.id, input_name, producer))
 
     def _preprocess(self):
         for proc in self.ordered:
@@ -538,7 +1812,83 @@ class SimpleProcessingPE(GenericPE):
             pe.log = types.MethodType(simpleLogger, pe)
             pe.preprocess()
 
+    def _create_writers(self, writer_class):
+        for proc in self.ordered:
+            pe = self.proc_to_pe[proc]
+            pe.writer = writer_class(self, pe,
+                                     self.output_mappings[proc],
+                                     self.result_mappings)
+            pe._write = types.MethodType(_simple_write, pe)
+
+    def _push(self, proc, data):
+        pending = self._pending[proc]
+        pending.append(data)
+        if len(pending) >= self.buffer_size and proc not in self._active:
+            self._drain(proc)
+
+    def _drain(self, proc):
+        pe = self.proc_to_pe[proc]
+        pending = self._pending[proc]
+        # a PE is not reentered if data arrives through a cycle
+        self._active.add(proc)
+        try:
+            while pending:
+                self._process_data(pe, pending.popleft())
+        finally:
+            self._active.discard(proc)
+
+    def _flush_pending(self):
+        # process all buffered data in dependency order
+        flushed = False
+        while not flushed:
+            flushed = True
+            for proc in self.ordered:
+                if self._pending[proc]:
+                    flushed = False
+                    self._drain(proc)
+        self.shared_data = {}
+
+    def stream(self, inputs):
+        '''
+        Processes the given inputs depth first and yields after each data
+        item that was provided to a PE, so that the output written so far can
+        be collected.
+
+        :param inputs: the input data of the subgraph
+        '''
+        inputs = self.map_inputs(inputs)
+        self._pending = {proc: deque() for proc in self.ordered}
+        self._create_writers(StreamingWriter)
+        for proc in self.ordered:
+            pe = self.proc_to_pe[proc]
+            provided_inputs = get_inputs(pe, inputs)
+            if isinstance(provided_inputs, int):
+                provided_inputs = ({} for i in range(provided_inputs))
+            elif provided_inputs is None:
+                if pe.inputconnections:
+                    continue
+                # run at least once for a source of the graph
+                provided_inputs = [{}]
+            for data in provided_inputs:
+                self._push(proc, data)
+                if self.buffer_size == 1:
+                    self.shared_data = {}
+                yield
+        self._flush_pending()
+        yield
+
     def _postprocess(self):
+        if self.streaming:
+            self._pending = {proc: deque() for proc in self.ordered}
+            self._create_writers(StreamingWriter)
+            for proc in self.ordered:
+                # data written during postprocessing is processed
+                # downstream before the consumers terminate
+                pe = self.proc_to_pe[proc]
+                pe.postprocess()
+                pe.writer.flush()
+                self._flush_pending()
+            return
         all_inputs = {}
         results = {}
         for proc in self.ordered:
@@ -551,14 +1901,10 @@ class SimpleProcessingPE(GenericPE):
             # then we need to process that data in the PEs downstream
             if proc in all_inputs:
                 for data in all_inputs[proc]:
-                    # pe.log('Processing input: %s' % data)
-                    result = pe.process(data)
-                    # pe.log('Produced result: %s' % result)
-                    if result is not None:
-                        for output_name in result:
-                            pe.write(output_name, result[output_name])
+                    self._process_data(pe, data)
             # once all the input data is processed this PE can finish
             pe.postprocess()
+            pe.writer.flush()
             # PE might write data during postprocessing
             for p, input_data in pe.writer.all_inputs.items():
                 try:
@@ -569,14 +1915,45 @@ class SimpleProcessingPE(GenericPE):
                 results[pe] = pe.writer.results
             pe.writer.all_inputs = {}
             pe.writer.results = {}
+        self.shared_data = {}
         results = self.map_outputs(results)
         for key, value in results.items():
             self._write(key, value)
 
+    def flush(self):
+        '''
+        Processes the partial blocks of the
+        :py:class:`~dispel4py.base.BatchPE` instances in the subgraph in
+        dependency order and writes the outputs.
+        '''
+        if self._batch_procs is None:
+            self._batch_procs = set(
+                proc for proc in self.ordered
+                if isinstance(self.proc_to_pe[proc], BatchPE))
+        if not self._batch_procs:
+            return
+        if self.streaming:
+            self._pending = {proc: deque() for proc in self.ordered}
+            self._create_writers(StreamingWriter)
+            for proc in self.ordered:
+                if proc in self._batch_procs:
+                    self.proc_to_pe[proc].flush()
+                    self._flush_pending()
+            return
+        results = self._process_all({}, flush=True)
+        for key, value in results.items():
+            self._write(key, value)
+
     def _process(self, inputs):
+        if self.streaming:
+            for _ in self.stream(inputs):
+                pass
+            return None
+        return self._process_all(self.map_inputs(inputs))
+
+    def _process_all(self, inputs, flush=False):
         all_inputs = {}
         results = {}
-        inputs = self.map_inputs(inputs)
         for proc in self.ordered:
             pe = self.proc_to_pe[proc]
             pe.writer = SimpleWriter(self, pe,
@@ -595,11 +1972,11 @@ class SimpleProcessingPE(GenericPE):
 
             if isinstance(provided_inputs, int):
                 for i in range(0, provided_inputs):
-                    _process_data(pe, {})
+                    self._process_data(pe, {})
             else:
 
                 if provided_inputs is None:
-                    if not pe.inputconnections:
+                    if not pe.inputconnections and not flush:
                         # run at least once for a source of the graph
                         provided_inputs = [{}]
                     else:
@@ -607,8 +1984,10 @@ class SimpleProcessingPE(GenericPE):
                         provided_inputs = []
 
                 for data in provided_inputs:
-                    _process_data(pe, data)
+                    self._process_data(pe, data)
 
+            if flush and proc in self._batch_procs:
+                pe.flush()
             for p, input_data in pe.writer.all_inputs.items():
                 try:
                     all_inputs[p].extend(input_data)
@@ -619,6 +1998,7 @@ class SimpleProcessingPE(GenericPE):
             # discard data from the PE writer
             pe.writer.all_inputs = {}
             pe.writer.results = {}
+        self.shared_data = {}
         results = self.map_outputs(results)
         return results
 
@@ -644,38 +2024,112 @@ class SimpleWriter(object):
         self.result_mappings = result_mappings
         self.all_inputs = {}
         self.results = {}
+        self.data_mode = getattr(pe, 'data_mode', None) or \
+            getattr(simple_pe, 'data_mode', None) or DATA_COPY
+        self.combiners = simple_pe._get_combiners(pe)
 
     def write(self, output_name, data):
+        if self.combiners and output_name in self.combiners:
+            for item in self.combiners[output_name].add(data):
+                self._send(output_name, item)
+        else:
+            self._send(output_name, data)
+
+    def flush(self):
+        '''
+        Writes the data items that were merged by the combiners of the
+        outputs of the PE.
+        '''
+        for output_name, combiner in self.combiners.items():
+            for item in combiner.flush():
+                self._send(output_name, item)
+
+    def _send(self, output_name, data):
         # self.pe.log('Writing %s to %s' % (data, output_name))
+        if self.simple_pe.costs is not None:
+            self.simple_pe._count_output(self.pe, output_name)
         try:
             destinations = self.output_mappings[output_name]
             dest_data = data
+            fan_out = len(destinations) > 1 or \
+                any(len(comm.destinations) > 1 for _, comm in destinations)
+            copy_data = fan_out and self.data_mode == DATA_COPY
+            if fan_out and self.data_mode == DATA_CHECKED:
+                self.simple_pe.shared_data[id(data)] = \
+                    (data, _fingerprint(data), self.pe.id)
             for input_name, comm in destinations:
-                copy_data = len(destinations) > 1 or len(comm.destinations) > 1
                 for p in comm.destinations:
                     if copy_data:
                         dest_data = copy.deepcopy(dest_data)
-                    input_data = {input_name: dest_data}
-                    try:
-                        self.all_inputs[p].append(input_data)
-                    except:
-                        self.all_inputs[p] = [input_data]
+                    self._deliver(p, {input_name: dest_data})
         except KeyError:
             # no destinations for this output
-            # if there are no named result outputs
+            # if it is not a named result output
             # the data is added to the results of the PE
-            if self.result_mappings is None:
-                self.simple_pe.wrapper._write((self.pe.id, output_name),
-                                              [data])
+            if self.result_mappings is None or output_name not in \
+                    self.result_mappings.get(self.pe.id, ()):
+                self.simple_pe.wrapper._write(
+                    (get_result_id(self.pe), output_name), [data])
         # now check if the output is in the named results
         # (in case of a Tee) then data gets written to the PE results as well
         try:
             if output_name in self.result_mappings[self.pe.id]:
-                self.simple_pe.wrapper._write((self.pe.id, output_name),
-                                              [data])
+                self.simple_pe.wrapper._write(
+                    (get_result_id(self.pe), output_name), [data])
         except:
             pass
 
+    def _deliver(self, proc, input_data):
+        try:
+            self.all_inputs[proc].append(input_data)
+        except:
+            self.all_inputs[proc] = [input_data]
+
+
+class StreamingWriter(SimpleWriter):
+    '''
+    Passes data to the consumer immediately instead of collecting it.
+    '''
+
+    def _deliver(self, proc, input_data):
+        self.simple_pe._push(proc, input_data)
+
+
+def iter_results(workflow, inputs, mapping='simple', args=None,
+                 buffer_size=100):
+    '''
+    Executes a graph with the given mapping and returns a generator of the
+    data written to unconnected outputs of the graph, as soon as it has been
+    produced. The mapping must provide a function `iter_results`, which is
+    the case for the simple and the multiprocessing mappings.
+
+    For example::
+
+        for pe_id, output_name, data in iter_results(
+                graph, {producer: 10}, 'multi', args):
+            ...
+
+    :param workflow: the dispel4py graph to be enacted
+    :param inputs: inputs for root PEs of the graph
+    :param mapping: name of the mapping or of the mapping module
+    :param args: options of the mapping, for example the number of processes
+    :param buffer_size: maximum number of results that are held until they
+        are consumed, if the mapping executes the graph concurrently
+    :rtype: a generator of tuples (PE id, output name, data)
+    '''
+    from importlib import import_module
+
+    try:
+        target = config[mapping]
+    except KeyError:
+        target = mapping
+    try:
+        iterate = getattr(import_module(target), 'iter_results')
+    except AttributeError:
+        raise Exception("Mapping '%s' does not support iterating over "
+                        "results" % mapping)
+    return iterate(workflow, inputs, args, buffer_size)
+
 
 def create_arg_parser():  # pragma: no cover
     parser = argparse.ArgumentParser(
@@ -35,6 +35,17 @@ with parameters
 :-d data:   input data in JSON format (optional)
 :-i iter:   number of iterations to compute (default is 1)
 :-h:        print this help page
+:--data-mode mode:  how data is passed to more than one consumer: 'copy'
+                    (default), 'shared' or 'checked' (see
+                    :py:class:`~dispel4py.new.processor.SimpleProcessingPE`)
+:--stream:          process each data item depth first as soon as it is
+                    produced and print the output data immediately
+:--stream-buffer num:   maximum number of pending data items of each PE when
+                        streaming (default is 1)
+:--profile file:    measure the processing time and the fan-out of each PE
+                    and write them to a file, which can be used to assign
+                    processes in the parallel mappings (see
+                    :py:func:`~dispel4py.new.processor.get_costs`)
 
 The input data must be a dictionary mapping either a PE name or an PE
 identifier to a list of input data or the number of iterations which is a
@@ -72,7 +83,9 @@ output stream is not connected::
     {'TestOneInOneOut1': {'output': [1, 2, 3, 4, 5]}}
 '''
 
+import argparse
 import types
+from collections import deque
 from dispel4py.new.processor import GenericWrapper, SimpleProcessingPE
 from dispel4py.new import processor
 
@@ -81,18 +94,26 @@ def simpleLogger(self, msg):
     print("%s: %s" % (self.id, msg))
 
 
-def process_and_return(workflow, inputs, resultmappings=None):
-    '''
-    Executes the simple sequential processor for dispel4py graphs and returns
-    the data collected from any unconnected output streams.
-
-    :param workflow: the dispel4py graph to be enacted
-    :param inputs: inputs for root PEs of the graphs.
-        This is a dictionary mapping a PE to either a non-negative integer
-        (the number of iterations) or a list of input data items.
-    :rtype: a dictionary mapping PE ids to the output data produced by that PE
-
-    '''
+def parse_args(args, namespace):    # pragma: no cover
+    parser = argparse.ArgumentParser(
+        prog='dispel4py',
+        description='Submit a dispel4py graph to the simple processor.')
+    parser.add_argument('--data-mode', choices=processor.DATA_MODES,
+                        help='passing of data to more than one consumer')
+    parser.add_argument('--stream', action='store_true',
+                        help='process data depth first as it is produced')
+    parser.add_argument('--stream-buffer', metavar='num', type=int,
+                        default=1,
+                        help='maximum number of pending data items of a PE '
+                             'when streaming')
+    parser.add_argument('--profile', metavar='file',
+                        help='write the measured costs of the PEs to a file')
+    result = parser.parse_args(args, namespace)
+    return result
+
+
+def _create_simple_pe(workflow, resultmappings, data_mode,
+                      streaming, buffer_size, costs=None):
     numnodes = 0
     for node in workflow.graph.nodes():
         numnodes += 1
@@ -110,10 +131,45 @@ def process_and_return(workflow, inputs, resultmappings=None):
     simple = SimpleProcessingPE(inputmappings, outputmappings, proc_to_pe)
     simple.id = 'SimplePE'
     simple.result_mappings = resultmappings
+    simple.data_mode = data_mode
+    simple.streaming = streaming
+    simple.buffer_size = max(1, buffer_size or 1)
+    simple.costs = costs
+    return simple
+
+
+def process_and_return(workflow, inputs, resultmappings=None,
+                       data_mode=None, streaming=False, buffer_size=1,
+                       costs=None):
+    '''
+    Executes the simple sequential processor for dispel4py graphs and returns
+    the data collected from any unconnected output streams.
+
+    :param workflow: the dispel4py graph to be enacted
+    :param inputs: inputs for root PEs of the graphs.
+        This is a dictionary mapping a PE to either a non-negative integer
+        (the number of iterations) or a list of input data items.
+    :param data_mode: how data is passed to more than one consumer, one of
+        :py:data:`~dispel4py.new.processor.DATA_MODES` (optional)
+    :param streaming: whether data is processed depth first as it is
+        produced, instead of one PE after the other
+    :param buffer_size: maximum number of pending data items of each PE
+        when streaming
+    :param costs: a dictionary that receives the measured costs of the PEs
+        (optional, see
+        :py:func:`~dispel4py.new.processor.SimpleProcessingPE.measured_costs`)
+    :rtype: a dictionary mapping PE ids to the output data produced by that PE
+
+    '''
+    simple = _create_simple_pe(workflow, resultmappings, data_mode,
+                               streaming, buffer_size,
+                               None if costs is None else {})
     wrapper = SimpleProcessingWrapper(simple, [inputs])
     wrapper.targets = {}
     wrapper.sources = {}
     wrapper.process()
+    if costs is not None:
+        costs.update(simple.measured_costs())
 
     # now collect output data into a single list for each PE
     outputs = {}
@@ -127,6 +183,48 @@ def process_and_return(workflow, inputs, resultmappings=None):
     return outputs
 
 
+def process_and_yield(workflow, inputs, resultmappings=None,
+                      data_mode=None, buffer_size=1, costs=None):
+    '''
+    Executes the graph in streaming mode and returns a generator of the data
+    written to unconnected output streams, as soon as it is produced.
+    The graph is executed while the generator is consumed.
+
+    The parameters are the same as for :py:func:`process_and_return`.
+
+    :rtype: a generator of tuples (PE id, output name, data)
+    '''
+    simple = _create_simple_pe(workflow, resultmappings, data_mode,
+                               True, buffer_size,
+                               None if costs is None else {})
+    wrapper = SimpleProcessingWrapper(simple)
+    wrapper.targets = {}
+    wrapper.sources = {}
+    wrapper.results = deque()
+    simple.preprocess()
+    for _ in simple.stream(inputs):
+        while wrapper.results:
+            yield wrapper.results.popleft()
+    simple.postprocess()
+    while wrapper.results:
+        yield wrapper.results.popleft()
+    if costs is not None:
+        costs.update(simple.measured_costs())
+
+
+def iter_results(workflow, inputs, args=None, buffer_size=None):
+    '''
+    Executes the graph in streaming mode and returns a generator of the data
+    written to unconnected outputs. Results are not buffered as the graph is
+    executed while the generator is consumed.
+
+    :rtype: a generator of tuples (PE id, output name, data)
+    '''
+    return process_and_yield(workflow, inputs,
+                             data_mode=getattr(args, 'data_mode', None),
+                             buffer_size=getattr(args, 'stream_buffer', None))
+
+
 def process(workflow, inputs, args=None, resultmappings=None):
     '''
     Executes the simple sequential processor for dispel4py graphs and prints
@@ -143,8 +241,22 @@ def process(workflow, inputs, args=None, resultmappings=None):
         print('Inputs: %s' % {pe.id: data for pe, data in inputs.items()})
     except:
         print('Inputs: %s' % {pe: data for pe, data in inputs.items()})
-    results = process_and_return(workflow, inputs, resultmappings)
-    print('Outputs: %s' % results)
+    data_mode = getattr(args, 'data_mode', None)
+    profile = getattr(args, 'profile', None)
+    costs = None if profile is None else {}
+    if getattr(args, 'stream', False):
+        # print the output data as it is produced
+        for pe_id, output_name, data in process_and_yield(
+                workflow, inputs, resultmappings, data_mode,
+                getattr(args, 'stream_buffer', None), costs):
+            print('Output %s.%s: %s' % (pe_id, output_name, data))
+    else:
+        results = process_and_return(workflow, inputs, resultmappings,
+                                     data_mode, costs=costs)
+        print('Outputs: %s' % results)
+    if profile is not None:
+        processor.save_costs(costs, profile)
+        print('Costs written to %s' % profile)
 
 
 class SimpleProcessingWrapper(GenericWrapper):
@@ -154,6 +266,8 @@ class SimpleProcessingWrapper(GenericWrapper):
         self.pe.log = types.MethodType(simpleLogger, pe)
         self.provided_inputs = provided_inputs
         self.outputs = {}
+        # if set, output data is appended as (PE id, output name, data)
+        self.results = None
 
     def _read(self):
         result = super(SimpleProcessingWrapper, self)._read()
@@ -161,6 +275,11 @@ class SimpleProcessingWrapper(GenericWrapper):
 
     def _write(self, name, data):
         # self.pe.log('Writing %s to %s' % (data, name))
+        if self.results is not None:
+            pe_id, output_name = name
+            for block in data:
+                self.results.append((pe_id, output_name, block))
+            return
         try:
             self.outputs[name].extend(data)
         except KeyError:
@@ -125,16 +125,7 @@ def createPackage(graph, args, static_input):
     except:
         pass
 
-    sources = []
-    for node in graph.graph.nodes():
-        pe = node.getContainedObject()
-        is_source = True
-        for edge in graph.graph.edges(node, data=True):
-            if pe == edge[2]['DIRECTION'][1]:
-                is_source = False
-                break
-        if is_source:
-            sources.append(pe)
+    sources = graph.topology().sources
     print("Sources: %s" % [s.id for s in sources])
     for pe in sources:
         pe._static_input = static_input[pe.id]
@@ -21,7 +21,7 @@ Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
 '''
 
 from dispel4py.base import BasePE, IterativePE, ProducerPE, ConsumerPE, \
-    SimpleFunctionPE
+    SimpleFunctionPE, BatchPE
 
 from nose import tools
 
@@ -66,3 +66,64 @@ def testSimpleFunction():
         return a+b
     simp = SimpleFunctionPE(add, {'b': 2})
     tools.eq_({'output': 3}, simp.process({'input': 1}))
+
+
+class BatchSum(BatchPE):
+    def __init__(self, batch_size, columnar=False):
+        BatchPE.__init__(self, batch_size, columnar=columnar)
+        self._add_input('input')
+        self._add_output('output')
+        self.blocks = []
+        self.written = []
+
+    def process_batch(self, inputs):
+        self.blocks.append(inputs['input'])
+        if self.columnar:
+            x, y = inputs['input']
+            return {'output': (x, x + y)}
+        return {'output': [sum(inputs['input'])]}
+
+    def write(self, name, data):
+        self.written.append(data)
+
+
+def testBatch():
+    batch = BatchSum(3)
+    for i in range(7):
+        tools.ok_(batch.process({'input': i}) is None)
+    tools.eq_([[0, 1, 2], [3, 4, 5]], batch.blocks)
+    tools.eq_([3, 12], batch.written)
+    batch.flush()
+    batch.flush()
+    tools.eq_([3, 12, 6], batch.written)
+    batch.process({'input': 7})
+    batch.postprocess()
+    tools.eq_([3, 12, 6, 7], batch.written)
+
+
+def testBatchLatency():
+    batch = BatchSum(100)
+    batch.batch_latency = 0
+    for i in range(5):
+        batch.process({'input': i})
+    # the block is processed when a data item arrives after the latency
+    tools.eq_([[0, 1], [2, 3]], batch.blocks)
+    batch.postprocess()
+    tools.eq_([1, 5, 4], batch.written)
+
+
+def testBatchColumnar():
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    batch = BatchSum(2, columnar=True)
+    for i in range(3):
+        batch.process({'input': (i, 10 * i)})
+    batch.postprocess()
+    tools.eq_(2, len(batch.blocks))
+    x, y = batch.blocks[0]
+    tools.ok_(isinstance(x, np.ndarray))
+    tools.eq_([0, 1], x.tolist())
+    tools.eq_([0, 10], y.tolist())
+    tools.eq_([(0, 0), (1, 11), (2, 22)], batch.written)
@@ -0,0 +1,189 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the communication channels of the multiprocessing mapping.
+
+Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
+
+    $ nosetests dispel4py/test/channels_test.py
+'''
+
+import multiprocessing
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+
+from dispel4py.new import channels
+
+
+def _create_queue(capacity, multi_producer=False, max_items=None):
+    if channels.shared_memory is None:
+        raise SkipTest('Shared memory is not supported')
+    return channels.SharedMemoryQueue(capacity, multi_producer, max_items)
+
+
+def _produce(queue, start, num):
+    for i in range(start, start + num):
+        queue.put(('item', i))
+
+
+def testBoundedQueue():
+    queue = channels.BoundedQueue(max_items=3)
+    producer = multiprocessing.Process(target=_produce, args=(queue, 0, 50))
+    producer.start()
+    results = [queue.get() for i in range(50)]
+    producer.join()
+    tools.eq_([('item', i) for i in range(50)], results)
+    items, size = queue.high_water_mark()
+    tools.ok_(1 <= items <= 3)
+    tools.ok_(size > 0)
+    queue.close()
+
+
+def testBoundedQueueBytes():
+    queue = channels.BoundedQueue(max_bytes=10)
+    # a message larger than the limit is accepted by an empty queue
+    queue.put('x' * 100)
+    tools.eq_('x' * 100, queue.get())
+    producer = multiprocessing.Process(target=_produce, args=(queue, 0, 20))
+    producer.start()
+    results = [queue.get() for i in range(20)]
+    producer.join()
+    tools.eq_([('item', i) for i in range(20)], results)
+    # only one message fits into the queue at a time
+    tools.eq_(1, queue.high_water_mark()[0])
+    queue.close()
+
+
+def testBoundedQueueEdges():
+    queue = channels.BoundedQueue(max_items=1, num_edges=2)
+    try:
+        # a full edge does not block the other producers
+        queue.edge(0).put('a')
+        queue.edge(1).put('b')
+        tools.eq_((2, queue.high_water_mark()[1]), queue.high_water_mark())
+        producer = multiprocessing.Process(
+            target=_produce, args=(queue.edge(0), 0, 20))
+        producer.start()
+        results = [queue.get() for i in range(22)]
+        producer.join()
+        tools.eq_(['a', 'b'] + [('item', i) for i in range(20)], results)
+        tools.ok_(queue.empty())
+    finally:
+        queue.close()
+
+
+@tools.raises(ValueError)
+def testBoundedQueueNoEdge():
+    channels.BoundedQueue(max_items=1, num_edges=2).edge(2)
+
+
+@tools.raises(channels.QueueAborted)
+def testBoundedQueueAbort():
+    queue = channels.BoundedQueue(max_items=1)
+    try:
+        queue.put('a')
+        queue.abort()
+        # the queue is full and the consumer does not free space
+        queue.put('b')
+    finally:
+        queue.close()
+
+
+def testSharedMemoryQueue():
+    queue = _create_queue(1024)
+    try:
+        for i in range(100):
+            queue.put({'input': [i, 'x' * (i % 50)]})
+            tools.eq_({'input': [i, 'x' * (i % 50)]}, queue.get())
+    finally:
+        queue.close()
+
+
+def testSharedMemoryQueueTooLarge():
+    queue = _create_queue(256)
+    try:
+        # messages that do not fit are sent in order through the overflow
+        queue.put('a')
+        queue.put('x' * 1000)
+        queue.put('b')
+        tools.eq_(['a', 'x' * 1000, 'b'], [queue.get() for i in range(3)])
+        tools.ok_(queue.empty())
+    finally:
+        queue.close()
+
+
+@tools.raises(channels.QueueAborted)
+def testSharedMemoryQueueAbort():
+    queue = _create_queue(1024, max_items=1)
+    try:
+        queue.put('a')
+        queue.abort()
+        # the queue is full and the consumer does not free space
+        queue.put('b')
+    finally:
+        queue.close()
+
+
+def testSharedMemoryQueueNumpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest('NumPy is not installed')
+    queue = _create_queue(2**16)
+    try:
+        data = np.arange(1000, dtype='float64')
+        queue.put({'input': data})
+        result = queue.get()['input']
+        tools.ok_(np.array_equal(data, result))
+        # the array must not share memory with the ring buffer
+        queue.put({'input': data * 2})
+        tools.ok_(np.array_equal(data, result))
+        tools.ok_(np.array_equal(data * 2, queue.get()['input']))
+    finally:
+        queue.close()
+
+
+def testSharedMemoryQueueMaxItems():
+    queue = _create_queue(2**16, max_items=2)
+    try:
+        producer = multiprocessing.Process(target=_produce,
+                                           args=(queue, 0, 50))
+        producer.start()
+        results = [queue.get() for i in range(50)]
+        producer.join()
+        tools.eq_([('item', i) for i in range(50)], results)
+        tools.ok_(1 <= queue.high_water_mark()[0] <= 2)
+    finally:
+        queue.close()
+
+
+def testSharedMemoryQueueMultiProducer():
+    # the ring is much smaller than the data so producers have to wait
+    queue = _create_queue(512, multi_producer=True)
+    try:
+        producers = [multiprocessing.Process(target=_produce,
+                                             args=(queue, i * 1000, 200))
+                     for i in range(3)]
+        for p in producers:
+            p.start()
+        results = [queue.get() for i in range(600)]
+        for p in producers:
+            p.join()
+        expected = [('item', i * 1000 + j)
+                    for i in range(3) for j in range(200)]
+        tools.eq_(sorted(expected), sorted(results))
+    finally:
+        queue.close()
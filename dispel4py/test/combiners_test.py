@@ -0,0 +1,124 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for combiners.
+
+Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
+
+    $ nosetests dispel4py/test/combiners_test.py
+'''
+
+import argparse
+import operator
+from collections import Counter
+
+from dispel4py.base import IterativePE
+from dispel4py.examples.graph_testing.testing_PEs import IntegerProducer
+from dispel4py.new import simple_process
+from dispel4py.new.combiners import Combiner
+from dispel4py.new.multi_process import process as multi_process
+from dispel4py.new.multi_process import STATUS_TERMINATED
+from dispel4py.workflow_graph import WorkflowGraph
+
+from nose import tools
+
+
+def test_combiner():
+    combiner = Combiner(operator.add, capacity=2)
+    tools.eq_([], combiner.add(('a', 1)))
+    tools.eq_([], combiner.add(('b', 2)))
+    tools.eq_([], combiner.add(('a', 3)))
+    tools.eq_([('a', 4), ('b', 2)], sorted(combiner.add(('c', 1))))
+    tools.eq_([('c', 1)], combiner.flush())
+    tools.eq_([], combiner.flush())
+
+
+def test_combiner_items():
+    combiner = Combiner(max, key=1, value=0)
+    combiner.add([3, 'x', 'first'])
+    combiner.add([5, 'x', 'second'])
+    tools.eq_([[5, 'x', 'first']], combiner.flush())
+    combiner = Combiner(lambda a, b: {'key': a['key'], 'n': a['n'] + b['n']},
+                        key=lambda data: data['key'], value=None)
+    combiner.add({'key': 1, 'n': 1})
+    combiner.add({'key': 1, 'n': 2})
+    tools.eq_([{'key': 1, 'n': 3}], combiner.flush())
+
+
+class Modulo(IterativePE):
+    def __init__(self, capacity=10000):
+        IterativePE.__init__(self)
+        self._add_output('output',
+                         combiner=Combiner(operator.add, capacity=capacity))
+
+    def _process(self, data):
+        return (data % 3, 1)
+
+
+class Recorder(IterativePE):
+    def __init__(self):
+        IterativePE.__init__(self)
+        self._add_input('input', grouping=[0])
+
+    def _process(self, data):
+        return data
+
+
+def _create_graph(capacity=10000):
+    prod = IntegerProducer(0, 30)
+    mod = Modulo(capacity)
+    rec = Recorder()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', mod, 'input')
+    graph.connect(mod, 'output', rec, 'input')
+    return graph, prod, rec
+
+
+def _counts(items):
+    counts = Counter()
+    for key, count in items:
+        counts[key] += count
+    return counts
+
+
+def test_simple():
+    for streaming in (False, True):
+        graph, prod, rec = _create_graph()
+        results = simple_process.process_and_return(
+            graph, {prod: 1}, streaming=streaming)
+        items = results[rec.id]['output']
+        tools.eq_([(0, 10), (1, 10), (2, 10)], sorted(items))
+    graph, prod, rec = _create_graph(capacity=2)
+    results = simple_process.process_and_return(graph, {prod: 1})
+    items = results[rec.id]['output']
+    tools.ok_(len(items) > 3)
+    tools.eq_({0: 10, 1: 10, 2: 10}, _counts(items))
+
+
+def test_multi():
+    for fuse in (False, True):
+        graph, prod, rec = _create_graph()
+        args = argparse.Namespace(num=5, simple=False, results=True,
+                                  fuse=fuse)
+        result_queue = multi_process(graph, {prod: 1}, args)
+        items = []
+        item = result_queue.get()
+        while item != STATUS_TERMINATED:
+            name, output, data = item
+            items.append(data)
+            item = result_queue.get()
+        # each instance writes one partial count for each key
+        tools.ok_(len(items) <= 9)
+        tools.eq_({0: 10, 1: 10, 2: 10}, _counts(items))
@@ -29,15 +29,17 @@ from collections import Counter, defaultdict
 
 from nose import tools
 
+from dispel4py.base import ProducerPE
 from dispel4py.examples.graph_testing.testing_PEs\
-    import TestProducer, TestOneInOneOut, TestTwoInOneOut, NumberProducer
+    import TestProducer, TestOneInOneOut, TestTwoInOneOut, NumberProducer, \
+    CountByKey, TestBatchOneInOneOut
 from dispel4py.workflow_graph import WorkflowGraph
-from dispel4py.new.multi_process import process, STATUS_TERMINATED
+from dispel4py.new.multi_process import process, STATUS_TERMINATED, \
+    MultiProcessingExecutor, WorkerError
+from dispel4py.new.processor import iter_results
 
 
-args = argparse.Namespace
-args.num = 5
-args.simple = False
+args = argparse.Namespace(num=5, simple=False)
 
 
 def testPipeline():
@@ -47,7 +49,7 @@ def testPipeline():
     graph = WorkflowGraph()
     graph.connect(prod, 'output', cons1, 'input')
     graph.connect(cons1, 'output', cons2, 'input')
-    args = argparse.Namespace
+    args = argparse.Namespace()
     args.num = 4
     args.simple = False
     args.results = True
@@ -63,6 +65,166 @@ def testPipeline():
     tools.eq_(list(range(1, 6)), results)
 
 
+def testPipelineBatched():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    args = argparse.Namespace()
+    args.num = 5
+    args.simple = False
+    args.results = True
+    args.batch_size = 4
+    args.batch_latency = 10
+    result_queue = process(graph, inputs={prod: 25}, args=args)
+    results = []
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        name, output, data = item
+        tools.eq_(cons2.id, name)
+        tools.eq_('output', output)
+        results.append(data)
+        item = result_queue.get()
+    tools.eq_(Counter(range(1, 26)), Counter(results))
+
+
+def testPipelineSharedMemory():
+    from dispel4py.new import channels
+    if channels.shared_memory is None:
+        return
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    args = argparse.Namespace()
+    args.num = 5
+    args.simple = False
+    args.results = True
+    args.channel = 'shm'
+    args.shm_size = 4096
+    result_queue = process(graph, inputs={prod: 100}, args=args)
+    results = []
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        name, output, data = item
+        tools.eq_(cons2.id, name)
+        results.append(data)
+        item = result_queue.get()
+    tools.eq_(Counter(range(1, 101)), Counter(results))
+
+
+def testPipelineBoundedQueues():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    args = argparse.Namespace()
+    args.num = 3
+    args.simple = False
+    args.results = True
+    args.queue_size = 2
+    args.queue_bytes = 1000
+    result_queue = process(graph, inputs={prod: 50}, args=args)
+    results = []
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        name, output, data = item
+        tools.eq_(cons2.id, name)
+        results.append(data)
+        item = result_queue.get()
+    tools.eq_(list(range(1, 51)), results)
+
+
+def _collect(result_queue):
+    results = defaultdict(list)
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        name, output, data = item
+        results[name].append(data)
+        item = result_queue.get()
+    return results
+
+
+def testPipelineDynamic():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons1.numprocesses = 3
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    args = argparse.Namespace()
+    args.num = 5
+    args.simple = False
+    args.results = True
+    args.dynamic = True
+    args.batch_size = 3
+    results = _collect(process(graph, inputs={prod: 50}, args=args))
+    tools.eq_(Counter(range(1, 51)), Counter(results[cons2.id]))
+
+
+def testExecutor():
+    args = argparse.Namespace()
+    args.simple = False
+    args.results = True
+    with MultiProcessingExecutor(4) as executor:
+        prod = TestProducer()
+        cons1 = TestOneInOneOut()
+        cons2 = TestOneInOneOut()
+        graph = WorkflowGraph()
+        graph.connect(prod, 'output', cons1, 'input')
+        graph.connect(cons1, 'output', cons2, 'input')
+        for num in [5, 10]:
+            results = _collect(executor.process(graph, {prod: num}, args))
+            tools.eq_({cons2.id: list(range(1, num + 1))}, results)
+        # a different graph executed by the same workers
+        prod = TestProducer()
+        cons1 = TestOneInOneOut()
+        cons2 = TestOneInOneOut()
+        graph = WorkflowGraph()
+        graph.connect(prod, 'output', cons1, 'input')
+        graph.connect(prod, 'output', cons2, 'input')
+        results = _collect(executor.process(graph, {prod: 3}, args))
+        tools.eq_({cons1.id: [1, 2, 3], cons2.id: [1, 2, 3]}, results)
+
+
+def testIterResults():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    args = argparse.Namespace()
+    args.num = 3
+    args.simple = False
+    # the result buffer is smaller than the number of results
+    results = list(iter_results(graph, {prod: 20}, 'multi', args,
+                                buffer_size=2))
+    tools.eq_([(cons2.id, 'output', i) for i in range(1, 21)], results)
+
+
+def testExecutorIterResults():
+    args = argparse.Namespace()
+    args.simple = False
+    with MultiProcessingExecutor(3) as executor:
+        prod = TestProducer()
+        cons1 = TestOneInOneOut()
+        cons2 = TestOneInOneOut()
+        graph = WorkflowGraph()
+        graph.connect(prod, 'output', cons1, 'input')
+        graph.connect(cons1, 'output', cons2, 'input')
+        results = executor.iter_results(graph, {prod: 5}, args)
+        tools.eq_([(cons2.id, 'output', i) for i in range(1, 6)],
+                  list(results))
+
+
 def testSquare():
     graph = WorkflowGraph()
     prod = TestProducer(2)
@@ -116,7 +278,7 @@ def testPipelineSimple():
     graph = WorkflowGraph()
     graph.connect(prod, 'output', cons1, 'input')
     graph.connect(cons1, 'output', cons2, 'input')
-    args = argparse.Namespace
+    args = argparse.Namespace()
     args.num = 4
     args.simple = True
     args.results = True
@@ -142,7 +304,7 @@ def testPipelineNotEnoughProcesses():
     graph.connect(cons1, 'output', cons2, 'input')
     graph.connect(cons2, 'output', cons3, 'input')
     graph.connect(cons3, 'output', cons4, 'input')
-    args = argparse.Namespace
+    args = argparse.Namespace()
     args.num = 4
     args.simple = False
     args.results = True
@@ -164,7 +326,7 @@ def testNotEnoughProcesses():
     graph = WorkflowGraph()
     graph.connect(prod, 'output', cons1, 'input')
     graph.connect(cons1, 'output', cons2, 'input')
-    args = argparse.Namespace
+    args = argparse.Namespace()
     args.num = 1
     args.simple = False
     args.results = True
@@ -186,7 +348,7 @@ def testGroupings():
     graph.connect(cons1, 'output', cons2, 'input')
     graph.connect(cons2, 'output', cons3, 'input')
     graph.connect(cons3, 'output', cons4, 'input')
-    args = argparse.Namespace
+    args = argparse.Namespace()
     args.num = 5
     args.simple = False
     args.results = True
@@ -202,6 +364,33 @@ def testGroupings():
     tools.eq_(Counter(range(10)), Counter(results))
 
 
+class SkewedKeyProducer(ProducerPE):
+
+    def __init__(self):
+        ProducerPE.__init__(self)
+        self.counter = 0
+
+    def _process(self, inputs):
+        self.counter += 1
+        key = self.counter if self.counter % 5 == 0 else 'hot'
+        return [key, 1]
+
+
+def testHotKeys():
+    prod = SkewedKeyProducer()
+    count = CountByKey()
+    count.numprocesses = 3
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', count, 'input')
+    args = argparse.Namespace(num=7, simple=False, results=True)
+    results = _collect(process(graph, inputs={prod: 500}, args=args))
+    # the results of the merge step are reported for the PE
+    tools.eq_([count.id], list(results))
+    totals = dict(results[count.id])
+    tools.eq_(400, totals.pop('hot'))
+    tools.eq_(dict((k, 1) for k in range(5, 501, 5)), totals)
+
+
 # mokey patch multiprocessing to enable  code coverage
 # NOTE: doesnt work with pytest-xdist (actually execnet)
 # https://bitbucket.org/ned/coveragepy/issue/117/
@@ -236,3 +425,115 @@ import multiprocessing
 ProcessCoverage = coverage_multiprocessing_process()
 if ProcessCoverage:
     multiprocessing.Process = ProcessCoverage
+
+
+def testFusedPipeline():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    cons3 = TestOneInOneOut()
+    cons3.inputconnections['input']['grouping'] = [0]
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    graph.connect(cons2, 'output', cons3, 'input')
+    args = argparse.Namespace(num=5, simple=False, results=True,
+                              fuse=True)
+    results = _collect(process(graph, inputs={prod: 20}, args=args))
+    # the results are reported by the PE that produced them
+    tools.eq_([cons3.id], list(results))
+    # the fused chain of cons1 and cons2 and cons3 run in two processes
+    # each, so the results are not in order
+    tools.eq_(Counter(range(1, 21)), Counter(results[cons3.id]))
+    args.num = 2
+    message = process(graph, inputs={prod: 20}, args=args)
+    tools.ok_('Not enough processes' in message)
+
+
+def testBatchPE():
+    for fuse in (False, True):
+        prod = TestProducer()
+        cons1 = TestOneInOneOut()
+        cons2 = TestBatchOneInOneOut(batch_size=8)
+        cons3 = TestOneInOneOut()
+        graph = WorkflowGraph()
+        graph.connect(prod, 'output', cons1, 'input')
+        graph.connect(cons1, 'output', cons2, 'input')
+        graph.connect(cons2, 'output', cons3, 'input')
+        args = argparse.Namespace(num=5, simple=False, results=True,
+                                  fuse=fuse)
+        results = _collect(process(graph, inputs={prod: 20}, args=args))
+        tools.eq_(Counter(range(1, 21)), Counter(results[cons3.id]))
+
+
+class FailingPE(TestOneInOneOut):
+
+    def process(self, inputs):
+        raise ValueError('failed to process %s' % inputs)
+
+
+def _create_failing_graph():
+    prod = TestProducer()
+    cons1 = FailingPE()
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    return graph, prod
+
+
+def testFailingPE():
+    graph, prod = _create_failing_graph()
+    args = argparse.Namespace(num=3, simple=False, results=True)
+    # the error is reported and the consumers of the failed PE terminate
+    message = process(graph, inputs={prod: 5}, args=args)
+    tools.ok_('Processes failed' in message)
+    with MultiProcessingExecutor(3) as executor:
+        message = executor.process(graph, {prod: 5}, args)
+        tools.ok_('failed to process' in message)
+
+
+@tools.raises(WorkerError)
+def testFailingPEIterResults():
+    prod = TestProducer()
+    cons = FailingPE()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    args = argparse.Namespace(num=2, simple=False)
+    list(iter_results(graph, {prod: 5}, 'multi', args))
+
+
+def testFailingPESharedMemory():
+    from dispel4py.new import channels
+    if channels.shared_memory is None:
+        return
+    graph, prod = _create_failing_graph()
+    # the ring is full after a few messages, and the producer must not
+    # wait for the failed PE to free space
+    args = argparse.Namespace(num=3, simple=False, channel='shm',
+                              shm_size=256)
+    message = process(graph, inputs={prod: 100}, args=args)
+    tools.ok_('Processes failed' in message)
+
+
+def testFailingPEBoundedQueues():
+    graph, prod = _create_failing_graph()
+    # the producer must not wait for the failed PE to free space
+    args = argparse.Namespace(num=3, simple=False, queue_size=2)
+    message = process(graph, inputs={prod: 100}, args=args)
+    tools.ok_('Processes failed' in message)
+
+
+def testExecutorAfterFailure():
+    graph, prod = _create_failing_graph()
+    args = argparse.Namespace(num=3, simple=False, results=True)
+    with MultiProcessingExecutor(3) as executor:
+        message = executor.process(graph, {prod: 20}, args)
+        tools.ok_('failed to process' in message)
+        # the next execution does not receive data of the failed one
+        prod = TestProducer()
+        cons = TestOneInOneOut()
+        graph = WorkflowGraph()
+        graph.connect(prod, 'output', cons, 'input')
+        results = _collect(executor.process(graph, {prod: 3}, args))
+        tools.eq_([1, 2, 3], sorted(results[cons.id]))
@@ -0,0 +1,155 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for partitioners.
+
+Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
+
+    $ nosetests dispel4py/test/partitioners_test.py
+'''
+
+import argparse
+from collections import defaultdict
+
+from dispel4py.base import IterativePE
+from dispel4py.examples.graph_testing.testing_PEs import IntegerProducer
+from dispel4py.new import processor, simple_process
+from dispel4py.new.multi_process import process as multi_process
+from dispel4py.new.multi_process import STATUS_TERMINATED
+from dispel4py.new.partitioners import RangePartitioner, \
+    ConsistentHashPartitioner, KeyAffinityPartitioner, LocalityPartitioner, \
+    PartitionerCommunication, Partitioner
+from dispel4py.utils import stable_hash
+from dispel4py.workflow_graph import WorkflowGraph
+
+from nose import tools
+
+
+def test_default():
+    part = Partitioner(key=0)
+    keys = ['key%s' % i for i in range(100)]
+    indexes = part.partition_keys(keys, 3)
+    tools.eq_([stable_hash(k) % 3 for k in keys], indexes)
+    tools.eq_([part.partition(k, 3) for k in keys], indexes)
+
+
+def test_clone():
+    part = KeyAffinityPartitioner(hot_keys={'hot': 3})
+    part.partition('hot', 8)
+    comm = PartitionerCommunication(0, [1, 2], 'input', part)
+    # the clone shares the configuration but not the counters
+    tools.ok_(comm.partitioner.hot_keys is part.hot_keys)
+    tools.eq_({}, comm.partitioner._counters)
+    tools.eq_({'hot': 1}, part._counters)
+
+
+def test_range():
+    part = RangePartitioner([10, 20], key=0)
+    tools.eq_([0, 0, 1, 1, 2, 2],
+              [part.partition(k, 3) for k in [-5, 9, 10, 19, 20, 100]])
+    # ranges are assigned to instances in order
+    tools.eq_([0, 0, 1], [part.partition(k, 2) for k in [5, 15, 25]])
+    tools.eq_([0, 0, 0], [part.partition(k, 1) for k in [0, 15, 25]])
+    keys = list(range(-5, 30))
+    tools.eq_([part.partition(k, 3) for k in keys],
+              part.partition_keys(keys, 3))
+    tools.eq_(5, part.get_key([5, 'x']))
+
+
+def test_consistent_hash():
+    part = ConsistentHashPartitioner()
+    keys = ['key%s' % i for i in range(1000)]
+    indexes = part.partition_keys(keys, 4)
+    tools.eq_([part.partition(k, 4) for k in keys], indexes)
+    tools.eq_(set(range(4)), set(indexes))
+    # adding an instance moves only the keys that are assigned to it
+    for key, before, after in zip(keys, indexes,
+                                  part.partition_keys(keys, 5)):
+        tools.ok_(after == before or after == 4)
+
+
+def test_key_affinity():
+    part = KeyAffinityPartitioner(hot_keys={'hot': 3})
+    tools.eq_(1, len(set(part.partition('cold', 8) for i in range(10))))
+    tools.eq_(3, len(set(part.partition('hot', 8) for i in range(10))))
+    part = KeyAffinityPartitioner(hot_keys=['hot'])
+    tools.eq_(4, len(set(part.partition('hot', 4) for i in range(10))))
+
+
+def test_locality():
+    part = LocalityPartitioner()
+    hosts = {0: 'a', 1: 'b', 2: 'a', 3: 'b', 4: 'a'}
+    comm = PartitionerCommunication(0, [1, 2, 3, 4], 'input', part)
+    # without host names all instances are used
+    tools.eq_(set([1, 2, 3, 4]),
+              set(comm.getDestination({'input': i})[0] for i in range(8)))
+    comm.set_hosts(hosts)
+    tools.eq_(set([2, 4]),
+              set(comm.getDestination({'input': i})[0] for i in range(8)))
+    # the producer on host 'c' has no local consumers
+    comm = PartitionerCommunication(5, [1, 2, 3, 4], 'input', part)
+    hosts[5] = 'c'
+    comm.set_hosts(hosts)
+    tools.eq_(set([1, 2, 3, 4]),
+              set(comm.getDestination({'input': i})[0] for i in range(8)))
+
+
+def test_route():
+    comm = PartitionerCommunication(0, [3, 4, 5], 'input',
+                                    RangePartitioner([10, 20]))
+    data = [{'input': i} for i in range(0, 30, 5)]
+    tools.eq_({3: data[:2], 4: data[2:4], 5: data[4:]}, comm.route(data))
+    tools.eq_(comm.route(data), processor.route(comm, data))
+
+
+class RankRecorder(IterativePE):
+
+    def __init__(self, partitioner):
+        IterativePE.__init__(self)
+        self.inputconnections['input']['grouping'] = partitioner
+        self.rank = None
+
+    def _process(self, data):
+        return self.rank, data
+
+
+def _range_graph():
+    prod = IntegerProducer(0, 30)
+    cons = RankRecorder(RangePartitioner([10, 20]))
+    cons.numprocesses = 3
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    return graph, prod, cons
+
+
+def test_range_simple():
+    graph, prod, cons = _range_graph()
+    results = simple_process.process_and_return(graph, {prod: 1})
+    tools.eq_(list(range(30)),
+              [data for rank, data in results[cons.id]['output']])
+
+
+def test_range_multi():
+    graph, prod, cons = _range_graph()
+    args = argparse.Namespace(num=4, simple=False, results=True)
+    result_queue = multi_process(graph, {prod: 1}, args)
+    ranges = defaultdict(list)
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        rank, data = item[2]
+        ranges[rank].append(data)
+        item = result_queue.get()
+    tools.eq_([list(range(0, 10)), list(range(10, 20)), list(range(20, 30))],
+              [sorted(ranges[rank]) for rank in sorted(ranges)])
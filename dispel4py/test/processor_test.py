@@ -1,11 +1,17 @@
 from nose import tools
 
 import argparse
+import json
+import os
+import pickle
+import tempfile
 
 from dispel4py.new import processor as p
+from dispel4py.new.simple_process import process_and_return
+from dispel4py.new.partitioners import HotKeyDetector
 from dispel4py.workflow_graph import WorkflowGraph, WorkflowNode
 from dispel4py.examples.graph_testing.testing_PEs \
-    import TestProducer, TestTwoInOneOut
+    import TestProducer, TestTwoInOneOut, TestOneInOneOut, CountByKey
 
 
 def test_roots():
@@ -154,6 +160,119 @@ def test_group_by():
               comm.getDestination({'input': [None, 1, 2]}))
 
 
+def test_group_by_route():
+    destinations = list(range(5))
+    comm = p.GroupByCommunication(destinations, 'input', [0])
+    data = [{'input': [i % 13, i]} for i in range(100)]
+    routed = p.route(comm, data)
+    tools.eq_(100, sum(len(items) for items in routed.values()))
+    for dest, items in routed.items():
+        for item in items:
+            tools.eq_([dest], comm.getDestination(item))
+    words = [{'input': [w, 1]} for w in ['a', 'b', 'a', 'c', 'b']]
+    for dest, items in p.route(comm, words).items():
+        for item in items:
+            tools.eq_([dest], comm.getDestination(item))
+    # communications without a batch API are routed item by item
+    comm = p.OneToAllCommunication(destinations)
+    tools.eq_({d: data[:3] for d in destinations}, p.route(comm, data[:3]))
+
+
+def test_group_by_hot_keys():
+    destinations = list(range(4))
+    detector = HotKeyDetector(0.25, sample_rate=1, min_samples=10)
+    comm = p.GroupByCommunication(destinations, 'input', [0],
+                                  detector=detector)
+    hot = [comm.getDestination({'input': ['hot', i]})[0] for i in range(20)]
+    tools.eq_(1, len(set(hot[:9])))
+    tools.eq_(set(destinations), set(hot[-4:]))
+    cold = [comm.getDestination({'input': [i % 10, i]}) for i in range(20)]
+    tools.eq_(cold[:10], cold[10:])
+    routed = p.route(comm, [{'input': ['hot', i]} for i in range(8)])
+    tools.eq_(set(destinations), set(routed))
+
+
+def test_merge_steps():
+    prod = TestProducer()
+    count = CountByKey()
+    cons = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', count, 'input')
+    graph.connect(count, 'output', cons, 'input')
+    planned = p.insert_merge_steps(graph)
+    merge = planned.merge_steps[count.id]
+    tools.eq_(False, merge.associative)
+    tools.eq_([0], merge.inputconnections['input']['grouping'])
+    tools.eq_(count.id, p.get_result_id(merge))
+    tools.eq_(count.id + 'Merge', merge.id)
+    edges = set((e[2]['DIRECTION'][0], e[2]['DIRECTION'][1])
+                for e in planned.graph.edges(data=True))
+    tools.eq_(set([(prod, count), (count, merge), (merge, cons)]), edges)
+    # the graph is not changed
+    edges = set((e[2]['DIRECTION'][0], e[2]['DIRECTION'][1])
+                for e in graph.graph.edges(data=True))
+    tools.eq_(set([(prod, count), (count, cons)]), edges)
+    tools.eq_(3, len(graph.graph.nodes()))
+
+
+def test_plan_merge_steps():
+    prod = TestProducer()
+    count = CountByKey()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', count, 'input')
+    # a single instance does not need a merge step
+    tools.ok_(p.plan_merge_steps(graph, 2) is graph)
+    # with a merge step only one process would be left for the PE
+    tools.ok_(p.plan_merge_steps(graph, 3) is graph)
+    planned = p.plan_merge_steps(graph, 5)
+    tools.eq_([count.id], list(planned.merge_steps))
+    tools.ok_(planned is not graph)
+
+
+def _ids(partitions):
+    return [[pe.id for pe in part] for part in partitions]
+
+
+def test_fuse_chains():
+    prod = TestProducer()
+    cons = [TestOneInOneOut() for i in range(4)]
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons[0], 'input')
+    graph.connect(cons[0], 'output', cons[1], 'input')
+    graph.connect(cons[1], 'output', cons[2], 'input')
+    # a grouping ends the chain
+    cons[2].inputconnections['input']['grouping'] = [0]
+    graph.connect(cons[2], 'output', cons[3], 'input')
+    partitions = _ids(p.fuse_chains(graph))
+    # sources are not fused
+    tools.ok_([prod.id] in partitions)
+    tools.ok_([cons[0].id, cons[1].id] in partitions)
+    tools.ok_([cons[2].id, cons[3].id] in partitions)
+    tools.eq_('[%s, %s], [%s, %s]' % tuple(pe.id for pe in cons),
+              p.format_fused(p.fuse_chains(graph)))
+
+
+def test_fuse_chains_branches():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    cons3 = TestTwoInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    graph.connect(cons1, 'output', cons3, 'input0')
+    graph.connect(cons2, 'output', cons3, 'input1')
+    # a PE with two consumers or two inputs is not fused
+    tools.eq_(None, p.fuse_chains(graph))
+    # partitions that are defined explicitly are not changed
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    tools.ok_(p.fuse_chains(graph))
+    graph.partitions = [[prod], [cons1, cons2]]
+    tools.eq_(None, p.fuse_chains(graph))
+
+
 def test_all_to_one():
     destinations = list(range(5))
     comm = p.AllToOneCommunication(destinations)
@@ -166,3 +285,287 @@ def test_one_to_all():
     comm = p.OneToAllCommunication(destinations)
     tools.eq_(destinations, comm.getDestination(None))
     tools.eq_(destinations, comm.getDestination({'input': [1, 2, 3]}))
+
+
+def test_load_balancing():
+    destinations = list(range(3, 6))
+    comm = p.LoadBalancingCommunication(0, [0, 1], destinations)
+    # without load the destinations are used in turn
+    tools.eq_([3], comm.getDestination(None))
+    tools.eq_([4], comm.getDestination(None))
+    comm.load = {3: 2, 4: 0, 5: 1}
+    tools.eq_([4], comm.getDestination(None))
+    comm.load[4] = 5
+    tools.eq_([5], comm.getDestination(None))
+    tools.eq_([5], comm.getDestination(None))
+
+
+def _cost_graph(*costs):
+    graph = WorkflowGraph()
+    pes = [TestProducer()]
+    for process_time, fan_out in costs:
+        pe = TestOneInOneOut()
+        pe.process_time = process_time
+        pe.fan_out = fan_out
+        graph.connect(pes[-1], 'output', pe, 'input')
+        pes.append(pe)
+    return graph, pes
+
+
+def _num_processes(processes, pes):
+    return [len(processes[pe.id]) for pe in pes]
+
+
+def test_assign_by_cost():
+    graph, pes = _cost_graph((0.04, 1), (0.01, 1))
+    costs = p.get_costs(graph)
+    tools.eq_({pes[1].id: (0.04, 1), pes[2].id: (0.01, 1)}, costs)
+    processes, _, _ = p.assign_and_connect(graph, 6, costs=costs)
+    tools.eq_([1, 4, 1], _num_processes(processes, pes))
+    tools.eq_(list(range(6)),
+              sorted(i for procs in processes.values() for i in procs))
+    # the consumer receives ten data items for each data item of its producer
+    graph, pes = _cost_graph((0.01, 10), (0.01, 1))
+    processes, _, _ = p.assign_and_connect(graph, 8, costs=p.get_costs(graph))
+    tools.eq_([1, 1, 6], _num_processes(processes, pes))
+    # PEs with a global input are not parallel
+    pes[2].inputconnections['input']['grouping'] = 'global'
+    processes, _, _ = p.assign_and_connect(graph, 8, costs=p.get_costs(graph))
+    tools.eq_([1, 6, 1], _num_processes(processes, pes))
+    tools.eq_(None, p.assign_and_connect(graph, 2, costs=p.get_costs(graph)))
+
+
+def test_format_plan():
+    graph, pes = _cost_graph((0.04, 1), (0.01, 1))
+    processes, _, _ = p.assign_and_connect(graph, 6, costs=p.get_costs(graph))
+    plan = p.format_plan(graph, processes, p.get_costs(graph))
+    tools.ok_('%s: 4 processes' % pes[1].id in plan)
+    tools.ok_('Predicted throughput: 100 iterations/s' in plan)
+    tools.ok_('Predicted throughput: unknown' in
+              p.format_plan(graph, processes))
+
+
+def test_measured_costs():
+    graph, pes = _cost_graph((None, 1), (None, 1))
+    measured = {}
+    process_and_return(graph, {pes[0]: 10}, costs=measured)
+    tools.eq_(10, measured[pes[0].id]['count'])
+    tools.eq_({'output': 1.0}, measured[pes[1].id]['fan_out'])
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        p.save_costs(measured, filename)
+        costs = p.get_costs(graph, p.load_costs(filename))
+    finally:
+        os.remove(filename)
+    tools.eq_(set(pe.id for pe in pes), set(costs))
+    tools.eq_({'output': 1.0}, costs[pes[2].id][1])
+
+
+def test_partitions_share_pes():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    cons1.table = list(range(1000))
+    cons1.numprocesses = 2
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    graph.partitions = [[prod], [cons1, cons2]]
+    ubergraph = p.create_partitioned(graph)
+    partition = ubergraph.partition_pes[1]
+    pes = dict((node.getContainedObject().id, node.getContainedObject())
+               for node in partition.workflow.graph.nodes())
+    tools.eq_(set([cons1.id, cons2.id]), set(pes))
+    copy1 = pes[cons1.id]
+    # the configuration is shared but the instances are separate
+    tools.ok_(copy1 is not cons1)
+    tools.ok_(copy1.table is cons1.table)
+    tools.eq_(1, copy1.numprocesses)
+    tools.eq_(2, cons1.numprocesses)
+    tools.ok_(copy1.outputconnections is not cons1.outputconnections)
+    tools.ok_(copy1.outputconnections['output'] is not
+              cons1.outputconnections['output'])
+
+
+class FlushingPE(TestOneInOneOut):
+    '''
+    A PE that is not a BatchPE but has a method flush.
+    '''
+
+    def flush(self):
+        raise AssertionError('flush must not be called by the mapping')
+
+
+def test_flush_batch_pes_only():
+    prod = TestProducer()
+    cons = FlushingPE()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    p.BatchingWrapper(cons)._flush_pe()
+    graph.partitions = [[prod], [cons]]
+    ubergraph = p.create_partitioned(graph)
+    partition = ubergraph.partition_pes[1]
+    p.BatchingWrapper(partition)._flush_pe()
+
+
+def test_connect_many_sources():
+    prod1 = TestProducer()
+    prod2 = TestProducer()
+    cons = TestOneInOneOut()
+    cons.numprocesses = 2
+    graph = WorkflowGraph()
+    graph.connect(prod1, 'output', cons, 'input')
+    graph.connect(prod2, 'output', cons, 'input')
+    processes, inputmappings, _ = p.assign_and_connect(graph, 4)
+    sources = list(processes[prod1.id]) + list(processes[prod2.id])
+    # each instance of the consumer has its own list of sources
+    for proc in processes[cons.id]:
+        tools.eq_(sorted(sources), sorted(inputmappings[proc]['input']))
+
+
+def test_order_by_dependency():
+    # 0 -> 1 -> 3, 0 -> 2 -> 3, 4 is not connected to a sink
+    inputmappings = {0: {}, 1: {'input': [0]}, 2: {'input': [0]},
+                     3: {'input0': [1], 'input1': [2]}, 4: {'input': [0]}}
+    outputmappings = {0: {'output': []}, 1: {'output': []},
+                      2: {'output': []}, 3: {}, 4: {'output': []}}
+    tools.eq_([0, 1, 2, 3],
+              p._order_by_dependency(inputmappings, outputmappings))
+    # processes in a cycle follow in order
+    inputmappings[1]['input'].append(2)
+    inputmappings[2]['input'].append(1)
+    tools.eq_([0, 1, 2, 3],
+              p._order_by_dependency(inputmappings, outputmappings))
+
+
+def test_order_by_dependency_large():
+    # a long pipeline and a wide sweep with 10000 processes each
+    num = 10000
+    inputmappings = dict((i, {'input': [i - 1]}) for i in range(1, num))
+    inputmappings[0] = {}
+    outputmappings = dict((i, {'output': []}) for i in range(num - 1))
+    outputmappings[num - 1] = {}
+    tools.eq_(list(range(num)),
+              p._order_by_dependency(inputmappings, outputmappings))
+    inputmappings = dict((i, {'input': [0]}) for i in range(1, num - 1))
+    inputmappings[0] = {}
+    inputmappings[num - 1] = {'input': list(range(1, num - 1))}
+    ordered = p._order_by_dependency(inputmappings, outputmappings)
+    tools.eq_(list(range(num)), ordered)
+
+
+def _pipeline(length):
+    graph = WorkflowGraph()
+    prev = TestProducer()
+    for i in range(length):
+        cons = TestOneInOneOut()
+        graph.connect(prev, 'output', cons, 'input')
+        prev = cons
+    return graph, prev
+
+
+def test_fingerprint():
+    graph, last = _pipeline(2)
+    fingerprint = p.get_fingerprint(graph, 4)
+    tools.eq_(fingerprint, p.get_fingerprint(graph, 4))
+    tools.ok_(fingerprint != p.get_fingerprint(graph, 5))
+    last.numprocesses = 3
+    tools.ok_(fingerprint != p.get_fingerprint(graph))
+    last.numprocesses = 1
+    graph.connect(last, 'output', TestOneInOneOut(), 'input')
+    tools.ok_(fingerprint != p.get_fingerprint(graph, 4))
+
+
+def test_save_plan():
+    graph, _ = _pipeline(3)
+    fingerprint = p.get_fingerprint(graph)
+    plan = p.CompiledPlan(fingerprint)
+    fused = p.fuse_chains(graph)
+    plan.set_fused(fused)
+    ubergraph = p.create_partitioned(graph, None, fused, True,
+                                     plan.partitions)
+    mapping = p.assign_and_connect(ubergraph, 4)
+    plan.set_processes(ubergraph, mapping[0])
+    directory = tempfile.mkdtemp()
+    try:
+        p.save_plan(plan, directory)
+        tools.eq_(None, p.load_plan(directory, 'x' + fingerprint))
+        loaded = p.load_plan(directory, fingerprint)
+        # the plan is stored as JSON and pickles are not loaded
+        with open(os.path.join(directory, '%s.json' % fingerprint)) as f:
+            tools.eq_(fingerprint, json.load(f)['fingerprint'])
+        with open(os.path.join(directory, '%s.json' % fingerprint),
+                  'wb') as f:
+            pickle.dump(plan, f)
+        tools.eq_(None, p.load_plan(directory, fingerprint))
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    tools.eq_(_ids(fused), _ids(loaded.get_fused(graph)))
+    # the partitions are not planned again
+    tools.eq_(set(plan.partitions), set(loaded.partitions))
+    reloaded = p.create_partitioned(graph, None, loaded.get_fused(graph),
+                                    True, loaded.partitions)
+    processes, inputmappings, outputmappings = loaded.get_mapping(reloaded)
+    tools.eq_([list(mapping[0][pe.id]) for pe in ubergraph.partition_pes],
+              [list(processes[pe.id]) for pe in reloaded.partition_pes])
+    tools.eq_(sorted(inputmappings), sorted(mapping[1]))
+
+
+def _flat_args(**kwargs):
+    args = argparse.Namespace(simple=False, dynamic=False, costs=None,
+                              plan=False, fuse=True, plan_cache=None,
+                              data_mode=None)
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+    return args
+
+
+def _destinations(outputmappings):
+    return dict((name, [(input_name, comm.destinations)
+                        for input_name, comm in targets])
+                for name, targets in outputmappings.items())
+
+
+def test_flat_plan():
+    graph = WorkflowGraph()
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    cons2.numprocesses = 2
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(prod, 'output', cons2, 'input')
+    processes, inputmappings, outputmappings = p.assign_and_connect(graph, 5)
+    plan, planned = p.create_flat_plan(graph, {prod: 3},
+                                       _flat_args(fuse=False), 5)
+    tools.eq_(None, plan.partitions)
+    tools.eq_(5, len(plan.ranks))
+    for rank in range(5):
+        created = p.create_process(graph, plan, rank)
+        if created is None:
+            tools.ok_(all(rank not in procs for procs in processes.values()))
+            continue
+        pe, inputs, outputs, provided = created
+        tools.ok_(rank in processes[pe.id])
+        tools.eq_(inputmappings[rank], inputs)
+        tools.eq_(_destinations(outputmappings[rank]),
+                  _destinations(outputs))
+        tools.eq_(3 if pe is prod else None, provided)
+
+
+def test_flat_plan_partitioned():
+    graph, _ = _pipeline(3)
+    plan, planned = p.create_flat_plan(graph, {}, _flat_args(), 4)
+    # the producer and the fused chain of consumers
+    tools.eq_([[0], [1, 2, 3]], plan.partitions)
+    inputmappings, outputmappings = p.connect(
+        planned, plan.get_processes(planned.partition_pes))
+    for rank in range(4):
+        pe, inputs, outputs, _ = p.create_process(graph, plan, rank)
+        tools.eq_(planned.partition_pes[plan.ranks[rank]].id, pe.id)
+        tools.eq_(1 if rank == 0 else 3, len(pe.workflow.graph.nodes()))
+        tools.eq_(inputmappings[rank], inputs)
+        tools.eq_(_destinations(outputmappings[rank]),
+                  _destinations(outputs))
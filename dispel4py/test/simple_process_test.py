@@ -28,11 +28,14 @@ Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
 from dispel4py.examples.graph_testing.testing_PEs\
     import TestProducer, TestOneInOneOut, TestOneInOneOutWriter, \
     TestTwoInOneOut, TestIterative, IntegerProducer, PrintDataConsumer, \
-    RandomWordProducer, RandomFilter, WordCounter
+    RandomWordProducer, RandomFilter, WordCounter, TestBatchOneInOneOut
 
 from dispel4py.new import simple_process
+from dispel4py.new.processor import DATA_SHARED, DATA_CHECKED, \
+    iter_results
 from dispel4py.workflow_graph import WorkflowGraph
-from dispel4py.base import create_iterative_chain, CompositePE
+from dispel4py.base import create_iterative_chain, CompositePE, \
+    ProducerPE, IterativePE
 
 from nose import tools
 
@@ -237,3 +240,191 @@ def testWordCount():
     graph.connect(prod, 'output', filt, 'input')
     graph.connect(filt, 'output', count, 'input')
     simple_process.process(graph, inputs={prod: 100})
+
+
+class ListProducer(ProducerPE):
+
+    def _process(self, inputs):
+        return [1, 2, 3]
+
+
+class ListConsumer(IterativePE):
+
+    def __init__(self, modify=False):
+        IterativePE.__init__(self)
+        self.modify = modify
+        self.received = []
+
+    def _process(self, data):
+        self.received.append(data)
+        if self.modify:
+            data.append(4)
+
+
+def _tee(modify=False):
+    prod = ListProducer()
+    cons1 = ListConsumer()
+    cons2 = ListConsumer(modify)
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(prod, 'output', cons2, 'input')
+    return graph, prod, cons1, cons2
+
+
+def testTeeCopy():
+    graph, prod, cons1, cons2 = _tee()
+    simple_process.process_and_return(graph, {prod: 1})
+    tools.eq_(cons1.received, cons2.received)
+    tools.ok_(cons1.received[0] is not cons2.received[0])
+
+
+def testTeeShared():
+    graph, prod, cons1, cons2 = _tee()
+    simple_process.process_and_return(graph, {prod: 1},
+                                      data_mode=DATA_SHARED)
+    tools.ok_(cons1.received[0] is cons2.received[0])
+
+
+def testTeeSharedByPE():
+    graph, prod, cons1, cons2 = _tee()
+    prod.data_mode = DATA_SHARED
+    simple_process.process_and_return(graph, {prod: 1})
+    tools.ok_(cons1.received[0] is cons2.received[0])
+
+
+def testTeeChecked():
+    graph, prod, cons1, cons2 = _tee()
+    simple_process.process_and_return(graph, {prod: 2},
+                                      data_mode=DATA_CHECKED)
+    tools.ok_(cons1.received[0] is cons2.received[0])
+
+
+@tools.raises(Exception)
+def testTeeCheckedModified():
+    graph, prod, cons1, cons2 = _tee(modify=True)
+    simple_process.process_and_return(graph, {prod: 1},
+                                      data_mode=DATA_CHECKED)
+
+
+class OrderRecorder(IterativePE):
+
+    def __init__(self, log):
+        IterativePE.__init__(self)
+        self.log_order = log
+
+    def _process(self, data):
+        self.log_order.append((self.id, data))
+        return data
+
+
+class PostprocessWriter(IterativePE):
+
+    def __init__(self):
+        IterativePE.__init__(self)
+        self.count = 0
+
+    def _process(self, data):
+        self.count += 1
+
+    def _postprocess(self):
+        self.write('output', self.count)
+
+
+def testStreamingPipeline():
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    results = simple_process.process_and_return(graph, inputs={prod: 5},
+                                                streaming=True)
+    tools.eq_({cons2.id: {'output': list(range(1, 6))}}, results)
+
+
+def testStreamingSquare():
+    graph = WorkflowGraph()
+    prod = TestProducer(2)
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    last = TestTwoInOneOut()
+    graph.connect(prod, 'output0', cons1, 'input')
+    graph.connect(prod, 'output1', cons2, 'input')
+    graph.connect(cons1, 'output', last, 'input0')
+    graph.connect(cons2, 'output', last, 'input1')
+    results = simple_process.process_and_return(graph, {prod: 1},
+                                                streaming=True)
+    tools.eq_({last.id: {'output': ['1', '1']}}, results)
+
+
+def testStreamingDepthFirst():
+    order = []
+    prod = TestProducer()
+    cons1 = OrderRecorder(order)
+    cons2 = OrderRecorder(order)
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    simple_process.process_and_return(graph, {prod: 3}, streaming=True)
+    tools.eq_([(cons1.id, 1), (cons2.id, 1),
+               (cons1.id, 2), (cons2.id, 2),
+               (cons1.id, 3), (cons2.id, 3)], order)
+    # with a buffer data items are processed in batches
+    del order[:]
+    simple_process.process_and_return(graph, {prod: 4}, streaming=True,
+                                      buffer_size=2)
+    tools.eq_([(cons1.id, 4), (cons1.id, 5), (cons2.id, 4), (cons2.id, 5),
+               (cons1.id, 6), (cons1.id, 7), (cons2.id, 6), (cons2.id, 7)],
+              order)
+
+
+def testStreamingPostprocess():
+    prod = TestProducer()
+    count = PostprocessWriter()
+    cons = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', count, 'input')
+    graph.connect(count, 'output', cons, 'input')
+    results = simple_process.process_and_return(graph, {prod: 5},
+                                                streaming=True)
+    tools.eq_({cons.id: {'output': [5]}}, results)
+
+
+def testProcessAndYield():
+    prod = TestProducer()
+    cons = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    results = simple_process.process_and_yield(graph, {prod: 5})
+    tools.eq_((cons.id, 'output', 1), next(results))
+    # the remaining input has not been processed yet
+    tools.eq_(1, prod.counter)
+    tools.eq_([(cons.id, 'output', i) for i in range(2, 6)], list(results))
+
+
+def testIterResults():
+    prod = TestProducer()
+    cons = TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    results = iter_results(graph, {prod: 5})
+    tools.eq_([(cons.id, 'output', i) for i in range(1, 6)], list(results))
+
+
+@tools.raises(Exception)
+def testIterResultsUnsupported():
+    graph = WorkflowGraph()
+    iter_results(graph, {}, 'dispel4py.new.mappings')
+
+
+def testBatch():
+    for streaming in (False, True):
+        prod = TestProducer()
+        cons1 = TestBatchOneInOneOut(batch_size=4)
+        cons2 = TestOneInOneOut()
+        graph = WorkflowGraph()
+        graph.connect(prod, 'output', cons1, 'input')
+        graph.connect(cons1, 'output', cons2, 'input')
+        results = simple_process.process_and_return(
+            graph, {prod: 10}, streaming=streaming)
+        tools.eq_({cons2.id: {'output': list(range(1, 11))}}, results)
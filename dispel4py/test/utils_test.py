@@ -0,0 +1,74 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for dispel4py utilities.
+
+Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
+
+    $ nosetests dispel4py/test/utils_test.py
+'''
+
+import numpy as np
+
+from dispel4py.utils import stable_hash, stable_hash_array, make_hash
+
+from nose import tools
+
+
+def test_stable_hash_values():
+    # the hashes must not change between processes or releases
+    tools.eq_(2839413211979453932, stable_hash('dispel4py'))
+    tools.eq_(17661420565428282140, stable_hash(42))
+    tools.eq_(8488282794440935372, stable_hash(('word', 3)))
+    tools.eq_(14473058622262901681, stable_hash('dispel4py', seed=1))
+
+
+def test_stable_hash_equal_values():
+    tools.eq_(stable_hash(1), stable_hash(1.0))
+    tools.eq_(stable_hash(1), stable_hash(np.int32(1)))
+    tools.eq_(stable_hash({'a': 1, 'b': [1, 2]}),
+              stable_hash({'b': [1, 2], 'a': 1}))
+    tools.eq_(stable_hash(set(range(100))),
+              stable_hash(set(range(99, -1, -1))))
+    tools.ok_(stable_hash((1, 2)) != stable_hash((2, 1)))
+    tools.ok_(0 <= stable_hash(-1) < 2**64)
+    tools.ok_(0 <= stable_hash(-2**100) < 2**64)
+
+
+def test_stable_hash_array():
+    for keys in [[1, -5, 2**63 - 1, -2**63, 0],
+                 ['a', 'hello', b'bytes', ''],
+                 [(1, 'a'), None, 2.5]]:
+        tools.eq_([stable_hash(k, 3) for k in keys],
+                  list(stable_hash_array(keys, 3)))
+    keys = np.arange(-50, 50)
+    tools.eq_([stable_hash(int(k)) for k in keys],
+              list(stable_hash_array(keys)))
+
+
+def test_stable_hash_array_strong():
+    keys = ['key%s' % i for i in range(10000)]
+    hashes = stable_hash_array(keys, strong=True)
+    tools.eq_(len(keys), len(set(hashes)))
+    tools.ok_(any(h >= 2**40 for h in hashes))
+    tools.eq_(list(hashes), list(stable_hash_array(keys, strong=True)))
+    tools.ok_(list(hashes) != list(stable_hash_array(keys, 1, strong=True)))
+    # other keys have the same hashes as with stable_hash
+    tools.eq_([stable_hash(k) for k in [1, 'a', None]],
+              list(stable_hash_array([1, 'a', None], strong=True)))
+
+
+def test_make_hash():
+    tools.eq_(make_hash({'a': {'b': 1}}), make_hash({'a': {'b': 1}}))
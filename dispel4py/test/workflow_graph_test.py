@@ -22,11 +22,14 @@ Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
 
 from nose import tools
 
+import copy
+
 from dispel4py.workflow_graph import WorkflowGraph
 from dispel4py.workflow_graph import draw
 from dispel4py.examples.graph_testing.testing_PEs \
-    import TestProducer, TestOneInOneOut
-from dispel4py.base import create_iterative_chain
+    import TestProducer, TestOneInOneOut, TestTwoInOneOut
+from dispel4py.base import create_iterative_chain, CompositePE
+from dispel4py.core import GenericPE
 
 
 def test_types():
@@ -67,3 +70,99 @@ def test_dot_composite():
     root_graph.connect(root_prod, 'output', graph, 'input')
     dot = draw(root_graph)
     tools.ok_('subgraph cluster_' in dot)
+
+
+def test_subgraph():
+    graph = WorkflowGraph()
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    sub = graph.subgraph([cons2, cons1])
+    tools.eq_([cons1, cons2],
+              [node.getContainedObject() for node in sub.graph.nodes()])
+    edges = [e[2]['DIRECTION'] for e in sub.graph.edges(data=True)]
+    tools.eq_([(cons1, cons2)], edges)
+    tools.eq_(3, len(graph.graph.nodes()))
+    # the copies of the PEs keep their ids
+    sub = graph.subgraph([cons1, cons2], copy=copy.copy)
+    copies = [node.getContainedObject() for node in sub.graph.nodes()]
+    tools.ok_(copies[0] is not cons1)
+    tools.eq_([pe.id for pe in copies], [cons1.id, cons2.id])
+    edges = [e[2]['DIRECTION'] for e in sub.graph.edges(data=True)]
+    tools.eq_([tuple(copies)], edges)
+
+
+def test_topology():
+    graph = WorkflowGraph()
+    prod = TestProducer()
+    cons1 = TestOneInOneOut()
+    cons2 = TestTwoInOneOut()
+    graph.connect(cons1, 'output', cons2, 'input1')
+    graph.connect(prod, 'output', cons2, 'input0')
+    graph.connect(prod, 'output', cons1, 'input')
+    topology = graph.topology()
+    tools.eq_([prod], topology.sources)
+    tools.eq_([cons2], topology.sinks)
+    tools.eq_([prod, cons1, cons2], topology.order)
+    tools.eq_([(prod, 'output')], topology.predecessors(cons2, 'input0'))
+    tools.eq_(set([(cons2, 'input0'), (cons1, 'input')]),
+              set(topology.successors(prod)))
+    # the topology is cached until the graph changes
+    tools.ok_(topology is graph.topology())
+    graph.connect(cons1, 'output', cons2, 'input0')
+    topology = graph.topology()
+    tools.eq_(2, len(topology.predecessors(cons2, 'input0')))
+    graph.graph.remove_edge(graph.objToNode[cons1], graph.objToNode[cons2])
+    tools.eq_([], graph.topology().successors(cons1))
+
+
+def test_topology_cycle():
+    graph = WorkflowGraph()
+    prod = TestProducer()
+    cons1 = TestTwoInOneOut()
+    cons2 = TestOneInOneOut()
+    graph.connect(prod, 'output', cons1, 'input0')
+    graph.connect(cons1, 'output', cons2, 'input')
+    graph.connect(cons2, 'output', cons1, 'input1')
+    topology = graph.topology()
+    tools.eq_([], topology.sinks)
+    # PEs in a cycle follow in the order of the graph
+    tools.eq_([prod, cons1, cons2], topology.order)
+
+
+def _create_composite(inner=None):
+    composite = CompositePE()
+    cons1 = TestOneInOneOut()
+    cons2 = TestOneInOneOut() if inner is None else inner
+    composite.connect(cons1, 'output', cons2, 'input')
+    composite._map_input('input', cons1, 'input')
+    composite._map_output('output', cons2, 'output')
+    return composite, cons1
+
+
+def test_flatten():
+    graph = WorkflowGraph()
+    prod1 = TestProducer()
+    prod2 = TestProducer()
+    # a composite that contains a composite
+    comp1, first1 = _create_composite(_create_composite()[0])
+    comp2, first2 = _create_composite()
+    cons = TestOneInOneOut()
+    graph.connect(prod1, 'output', comp1, 'input')
+    graph.connect(prod2, 'output', comp1, 'input')
+    graph.connect(comp1, 'output', comp2, 'input')
+    graph.connect(comp2, 'output', cons, 'input')
+    graph.flatten()
+    pes = graph.getContainedObjects()
+    tools.eq_(8, len(pes))
+    tools.ok_(all(isinstance(pe, GenericPE) for pe in pes))
+    topology = graph.topology()
+    # both producers are connected to the composite
+    tools.eq_(set([(prod1, 'output'), (prod2, 'output')]),
+              set(topology.predecessors(first1)))
+    tools.eq_([prod1, prod2], topology.sources)
+    tools.eq_([cons], topology.sinks)
+    tools.eq_(1, len(topology.predecessors(first2)))
+    tools.eq_(8, len(topology.order))
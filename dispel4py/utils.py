@@ -18,9 +18,22 @@ Collection of dispel4py utilities.
 
 from dispel4py.workflow_graph import WorkflowGraph
 
+from collections import deque
 from importlib import import_module
 from imp import load_source
+from itertools import chain
+from sys import getsizeof
+import hashlib
+import numbers
+import pickle
+import struct
 import traceback
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def findWorkflowGraph(mod, attr):
@@ -82,11 +95,6 @@ def load_graph(graph_source, attr=None):
           (graph_source, error_message))
 
 
-from sys import getsizeof
-from itertools import chain
-from collections import deque
-
-
 def dict_handler(d):
     return chain.from_iterable(d.items())
 
@@ -130,8 +138,6 @@ def total_size(o, handlers={}, verbose=False):
 
     return sizeof(o)
 
-import copy
-
 
 def make_hash(o):
 
@@ -146,8 +152,172 @@ def make_hash(o):
     if not isinstance(o, dict):
         return hash(o)
 
-    new_o = copy.deepcopy(o)
-    for k, v in new_o.items():
-        new_o[k] = make_hash(v)
-
+    new_o = {k: make_hash(v) for k, v in o.items()}
     return hash(tuple(frozenset(sorted(new_o.items()))))
+
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_FLOAT = struct.Struct('<d')
+_SALT = struct.Struct('<Q')
+
+
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def _mix64(x):
+    # multiplicative hashing, folding the high bits into the low bits
+    x = (x * _GOLDEN) & _MASK64
+    return x ^ (x >> 32)
+
+
+def _hash_int(o, seed):
+    if -2**63 <= o < 2**64:
+        return _mix64((o & _MASK64) ^ seed)
+    length = (o.bit_length() + 8) // 8
+    return _hash_bytes(o.to_bytes(length, 'little', signed=True), seed)
+
+
+def _hash_bytes(o, seed):
+    return _mix64(zlib.crc32(o, seed & 0xFFFFFFFF) ^ (len(o) << 32) ^ seed)
+
+
+def _hash_str(o, seed):
+    return _hash_bytes(o.encode('utf-8'), seed)
+
+
+def _hash_float(o, seed):
+    if o.is_integer():
+        # equal numbers must have the same hash
+        return _hash_int(int(o), seed)
+    return _hash_bytes(_FLOAT.pack(o), seed)
+
+
+def _hash_sequence(o, seed):
+    h = _mix64(len(o) ^ seed)
+    for e in o:
+        h = _mix64(h ^ stable_hash(e, seed))
+    return h
+
+
+def _hash_unordered(items, seed):
+    # the sum of the element hashes does not depend on the order
+    h = 0
+    for e in items:
+        h += stable_hash(e, seed)
+    return _mix64((h & _MASK64) ^ seed)
+
+
+def _hash_dict(o, seed):
+    return _hash_unordered(o.items(), seed)
+
+
+_HASHERS = {
+    int: _hash_int,
+    bool: _hash_int,
+    str: _hash_str,
+    bytes: _hash_bytes,
+    float: _hash_float,
+    tuple: _hash_sequence,
+    list: _hash_sequence,
+    set: _hash_unordered,
+    frozenset: _hash_unordered,
+    dict: _hash_dict,
+    type(None): lambda o, seed: _mix64(seed ^ 0x5555555555555555),
+}
+
+
+def stable_hash(o, seed=0):
+    '''
+    Returns a 64 bit hash of a value which, unlike the builtin `hash`,
+    is the same in all processes and Python versions, so that data can be
+    partitioned consistently across hosts and between executions.
+    Lists, tuples, sets and dictionaries are hashed by their contents.
+    Values of other types are hashed by their pickled representation, so
+    their hashes are only stable if the pickled data is.
+
+    Strings and bytes are hashed with a 32 bit CRC that is mixed with their
+    length, which is fast but has only about 32 bits of entropy: collisions
+    become likely above tens of thousands of distinct strings. This does
+    not matter for partitioning but it does for estimates that rely on
+    distinct hashes, which should use `stable_hash_array` with `strong`.
+
+    :param o: the value
+    :param seed: a non-negative integer that selects the hash function
+    :rtype: a non-negative integer smaller than 2**64
+    '''
+    t = type(o)
+    if t is str:
+        # the most common case of grouping keys
+        o = o.encode('utf-8')
+        x = (zlib.crc32(o, seed & 0xFFFFFFFF) ^ (len(o) << 32) ^ seed) \
+            * _GOLDEN & _MASK64
+        return x ^ (x >> 32)
+    if t is int and -2**63 <= o < 2**64:
+        x = ((o & _MASK64) ^ seed) * _GOLDEN & _MASK64
+        return x ^ (x >> 32)
+    try:
+        return _HASHERS[t](o, seed)
+    except KeyError:
+        pass
+    if isinstance(o, numbers.Integral):
+        return _hash_int(int(o), seed)
+    if isinstance(o, numbers.Real):
+        return _hash_float(float(o), seed)
+    for typ, hasher in _HASHERS.items():
+        if isinstance(o, typ):
+            return hasher(o, seed)
+    return _hash_bytes(pickle.dumps(o, 2), seed)
+
+
+def _mix64_array(x):
+    with np.errstate(over='ignore'):
+        x = x * np.uint64(_GOLDEN)
+        return x ^ (x >> np.uint64(32))
+
+
+def _hash_digest(o, seed):
+    if not isinstance(o, bytes):
+        o = o.encode('utf-8')
+    digest = hashlib.blake2b(o, digest_size=8,
+                             salt=_SALT.pack(seed & _MASK64)).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def stable_hash_array(keys, seed=0, strong=False):
+    '''
+    Returns the hashes of a list of keys, which are the same as the hashes
+    returned by :py:func:`stable_hash`. Integer keys are hashed with NumPy
+    operations on the whole array, and bytes or strings are checksummed
+    individually and mixed as an array.
+    If NumPy is not installed this returns a list.
+
+    :param keys: a list or NumPy array of keys
+    :param seed: a non-negative integer that selects the hash function
+    :param strong: if set, strings and bytes are hashed with a 64 bit
+        BLAKE2b digest instead of the 32 bit CRC. This is more than ten
+        times slower, and the hashes differ from those of `stable_hash`.
+    :rtype: a NumPy array of unsigned 64 bit integers
+    '''
+    if strong and isinstance(keys, list) and keys and \
+            set(type(k) for k in keys) <= set([str, bytes]):
+        hashes = [_hash_digest(k, seed) for k in keys]
+        return hashes if np is None else np.array(hashes, dtype=np.uint64)
+    if np is None:
+        return [stable_hash(k, seed) for k in keys]
+    if isinstance(keys, np.ndarray) and keys.dtype.kind in 'iub':
+        values = keys.astype(np.int64).view(np.uint64)
+        return _mix64_array(values ^ np.uint64(seed))
+    types = set(type(k) for k in keys)
+    if types <= set([int, bool]) and \
+            all(-2**63 <= k < 2**63 for k in keys):
+        values = np.array(keys, dtype=np.int64).view(np.uint64)
+        return _mix64_array(values ^ np.uint64(seed))
+    if types <= set([str, bytes]):
+        values = []
+        for k in keys:
+            if not isinstance(k, bytes):
+                k = k.encode('utf-8')
+            values.append(zlib.crc32(k, seed & 0xFFFFFFFF) ^ (len(k) << 32))
+        values = np.array(values, dtype=np.uint64)
+        return _mix64_array(values ^ np.uint64(seed))
+    return np.array([stable_hash(k, seed) for k in keys], dtype=np.uint64)
@@ -16,8 +16,10 @@
 The dispel4py workflow graph.
 '''
 
+import copy as _copy
 import networkx as nx
 import sys
+from collections import deque
 
 from dispel4py.core import GenericPE
 
@@ -77,14 +79,121 @@ TO_CONNECTION = 'to_connection'
 DIRECTION = 'direction'
 
 
+class _Graph(nx.DiGraph):
+    '''
+    A directed networkx graph that counts modifications, so that information
+    derived from the graph can be cached until the graph changes.
+    '''
+    version = 0
+
+
+def _modifies(name):
+    method = getattr(nx.DiGraph, name)
+
+    def modify(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+    modify.__name__ = name
+    modify.__doc__ = method.__doc__
+    return modify
+
+
+for _name in ['add_node', 'add_nodes_from', 'remove_node',
+              'remove_nodes_from', 'add_edge', 'add_edges_from',
+              'remove_edge', 'remove_edges_from', 'update', 'clear',
+              'clear_edges']:
+    setattr(_Graph, _name, _modifies(_name))
+
+
+class Topology(object):
+    '''
+    A directed index of the connections of a workflow graph, see
+    :py:func:`WorkflowGraph.topology`.
+
+    :ivar nodes: the PEs in the order of the graph
+    :ivar positions: a dictionary mapping each PE to its position in `nodes`
+    :ivar inputs: a dictionary mapping each PE to a list of its incoming
+        connections `(input_name, source, output_name)`
+    :ivar outputs: a dictionary mapping each PE to a list of its outgoing
+        connections `(output_name, dest, input_name)`
+    :ivar sources: the PEs that have no connected inputs
+    :ivar sinks: the PEs that have no connected outputs
+    :ivar order: the PEs in topological order. PEs in cycles, which are not
+        ordered, follow in the order of the graph.
+    '''
+
+    def __init__(self, graph):
+        self.nodes = [node.getContainedObject() for node in graph.nodes()]
+        self.positions = dict((pe, i) for i, pe in enumerate(self.nodes))
+        self.inputs = dict((pe, []) for pe in self.nodes)
+        self.outputs = dict((pe, []) for pe in self.nodes)
+        for edge in graph.edges(data=True):
+            source, dest = edge[2]['DIRECTION']
+            for (output_name, input_name) in edge[2]['ALL_CONNECTIONS']:
+                self.outputs[source].append((output_name, dest, input_name))
+                self.inputs[dest].append((input_name, source, output_name))
+        self.sources = [pe for pe in self.nodes if not self.inputs[pe]]
+        self.sinks = [pe for pe in self.nodes if not self.outputs[pe]]
+        num_inputs = dict((pe, len(self.inputs[pe])) for pe in self.nodes)
+        order = list(self.sources)
+        for pe in order:
+            for output_name, dest, input_name in self.outputs[pe]:
+                num_inputs[dest] -= 1
+                if not num_inputs[dest]:
+                    order.append(dest)
+        if len(order) < len(self.nodes):
+            ordered = set(order)
+            order.extend(pe for pe in self.nodes if pe not in ordered)
+        self.order = order
+
+    def predecessors(self, pe, input_name=None):
+        '''
+        Returns the PEs and their outputs that are connected to the inputs
+        of a PE, or to the given input.
+
+        :rtype: a list of tuples `(source, output_name)`
+        '''
+        return [(source, output_name)
+                for name, source, output_name in self.inputs[pe]
+                if input_name is None or name == input_name]
+
+    def successors(self, pe, output_name=None):
+        '''
+        Returns the PEs and their inputs that are connected to the outputs
+        of a PE, or to the given output.
+
+        :rtype: a list of tuples `(dest, input_name)`
+        '''
+        return [(dest, input_name)
+                for name, dest, input_name in self.outputs[pe]
+                if output_name is None or name == output_name]
+
+
 class WorkflowGraph(object):
     """
     A graph representing the workflow and related methods
     """
 
     def __init__(self):
-        self.graph = nx.Graph()
+        self.graph = _Graph()
         self.objToNode = {}
+        self._topology = None
+
+    def topology(self):
+        '''
+        Returns the directed connections between the PEs of the graph.
+        The result is cached until the graph is modified.
+
+        :rtype: Topology
+        '''
+        version = getattr(self.graph, 'version', None)
+        cached = getattr(self, '_topology', None)
+        if cached is not None and version is not None and \
+                cached[0] == version:
+            return cached[1]
+        topology = Topology(self.graph)
+        self._topology = version, topology
+        return topology
 
     def add(self, n):
         '''
@@ -125,6 +234,11 @@ class WorkflowGraph(object):
         if self.graph.has_edge(fromWfNode, toWfNode):
             self.graph[fromWfNode][toWfNode]['ALL_CONNECTIONS']\
                 .append((fromConnection, toConnection))
+            try:
+                # the connections of the edge changed
+                self.graph.version += 1
+            except AttributeError:
+                pass
         else:
             self.graph.add_edge(fromWfNode, toWfNode,
                                 **{'FROM_CONNECTION': fromConnection,
@@ -133,6 +247,44 @@ class WorkflowGraph(object):
                                    'ALL_CONNECTIONS': [
                                        (fromConnection, toConnection)]})
 
+    def subgraph(self, objects, copy=None):
+        '''
+        Returns a workflow graph that contains the given PEs of this graph
+        and the connections between them, in the same order as in this
+        graph. The subgraph is created without copying the workflow.
+
+        :param objects: the PEs of the subgraph
+        :param copy: a function that returns the PE of a node in the
+            subgraph given the PE in this graph (optional, by default the
+            subgraph contains the same PEs)
+        :rtype: WorkflowGraph
+        '''
+        topology = self.topology()
+        objects = sorted(set(objects), key=topology.positions.__getitem__)
+        sub = WorkflowGraph()
+        nodes = {}
+        for obj in objects:
+            node = self.objToNode[obj]
+            # the node is not created again as this would assign a new id
+            sub_node = _copy.copy(node)
+            if copy is not None:
+                sub_node.obj = copy(obj)
+            nodes[obj] = sub_node
+            sub.graph.add_node(sub_node)
+            sub.objToNode[sub_node.obj] = sub_node
+        for obj in objects:
+            for data in self.graph[self.objToNode[obj]].values():
+                source, dest = data['DIRECTION']
+                if source is obj and dest in nodes:
+                    source, dest = nodes[source], nodes[dest]
+                    sub.graph.add_edge(
+                        source, dest,
+                        **dict(data,
+                               DIRECTION=(source.obj, dest.obj),
+                               ALL_CONNECTIONS=list(
+                                   data['ALL_CONNECTIONS'])))
+        return sub
+
     def getContainedObjects(self):
         nodes = [node.getContainedObject() for node in self.graph.nodes()]
         return sorted(nodes, key=lambda x: x.id)
@@ -143,79 +295,97 @@ class WorkflowGraph(object):
         types from each node, starting from the root, and providing them to
         connected consumers.
         '''
-        visited = set()
-        for node in self.graph.nodes():
-            if node not in visited:
-                self.__assign_types(node, visited)
-
-    def __assign_types(self, node, visited):
-        pe = node.getContainedObject()
-        inputTypes = {}
-        for edge in self.graph[node].values():
-            if pe == edge['DIRECTION'][1]:
-                # pe is destination so look up the types produced by sources
-                source = edge['DIRECTION'][0]
-                sourceNode = self.objToNode[source]
-                if sourceNode not in visited:
-                    self.__assign_types(sourceNode, visited)
-                inType = source.getOutputTypes()[edge['FROM_CONNECTION']]
-                inputTypes[edge['TO_CONNECTION']] = inType
-        pe.setInputTypes(inputTypes)
-        visited.add(node)
-        # print "%s: Assigned inputs = %s, \
-        #       received outputs = %s" % \
-        #       (pe.__class__.__name__, inputTypes, pe.getOutputTypes())
+        topology = self.topology()
+        for pe in topology.order:
+            inputTypes = {}
+            for input_name, source, output_name in topology.inputs[pe]:
+                inputTypes[input_name] = source.getOutputTypes()[output_name]
+            pe.setInputTypes(inputTypes)
 
     def flatten(self):
         '''
         Subgraphs contained within composite PEs are added to the top level
         workflow.
+        The composites are expanded in one pass, including nested composites,
+        and connections to the ports of composites are replaced by
+        connections to the PEs that the ports are mapped to.
+        A composite object is expanded once even if it is contained in more
+        than one graph. Composites that are built from the same template are
+        expanded separately, because each of them contains its own PEs.
         '''
-        hasComposites = True
-        toRemove = set()
-        while hasComposites:
-            hasComposites = False
-            toRemove = set()
-            for node in list(self.graph.nodes()):
+        composites = deque(node for node in self.graph.nodes()
+                           if node.nodeType == WorkflowNode.WORKFLOW_NODE_CP)
+        if not composites:
+            return
+        # connections from or to composites
+        connections = []
+        for source_node, dest_node, data in self.graph.edges(data=True):
+            if source_node.nodeType == WorkflowNode.WORKFLOW_NODE_CP or \
+                    dest_node.nodeType == WorkflowNode.WORKFLOW_NODE_CP:
+                connections.append(data)
+        self.graph.remove_nodes_from(list(composites))
+        expanded = set()
+        while composites:
+            wfGraph = composites.popleft().getContainedObject()
+            if wfGraph in expanded:
+                # the composite is contained in more than one graph
+                continue
+            expanded.add(wfGraph)
+            for node in wfGraph.graph.nodes():
                 if node.nodeType == WorkflowNode.WORKFLOW_NODE_CP:
-                    hasComposites = True
-                    toRemove.add(node)
-                    wfGraph = node.getContainedObject()
-                    subgraph = wfGraph.graph
-                    self.graph.add_nodes_from(subgraph.nodes(data=True))
-                    self.graph.add_edges_from(subgraph.edges(data=True))
-                    self.objToNode.update(wfGraph.objToNode)
-                    for inputname in wfGraph.inputmappings:
-                        toPE, toConnection = wfGraph.inputmappings[inputname]
-                        edge = None
-                        fromPE, fromConnection = None, None
-                        for e in self.graph[node].values():
-                            if wfGraph == e['DIRECTION'][1] \
-                                    and inputname == e['TO_CONNECTION']:
-                                fromPE = e['DIRECTION'][0]
-                                fromConnection = e['FROM_CONNECTION']
-                                edge = self.objToNode[fromPE],\
-                                    self.objToNode[wfGraph]
-                                break
-                        if edge is not None:
-                            self.connect(fromPE, fromConnection,
-                                         toPE, toConnection)
-                    for outputname in wfGraph.outputmappings:
-                        fromPE, fromConnection = \
-                            wfGraph.outputmappings[outputname]
-                        destinations = []
-                        for e in self.graph[node].values():
-                            if wfGraph == e['DIRECTION'][0] \
-                                    and outputname == e['FROM_CONNECTION']:
-                                toPE = e['DIRECTION'][1]
-                                toConnection = e['TO_CONNECTION']
-                                destinations.append((toPE, toConnection))
-                        for (toPE, toConnection) in destinations:
-                            # print 'connecting output %s.%s' %\
-                            # (toPE, toConnection)
-                            self.connect(fromPE, fromConnection,
-                                         toPE, toConnection)
-            self.graph.remove_nodes_from(toRemove)
+                    composites.append(node)
+                else:
+                    self.graph.add_node(node)
+                    self.objToNode[node.getContainedObject()] = node
+            connections.extend(
+                data for _, _, data in wfGraph.graph.edges(data=True))
+        # the PEs and ports that the ports of composites are mapped to
+        inputs = {}
+        outputs = {}
+        for data in connections:
+            source, dest = data['DIRECTION']
+            for fromConnection, toConnection in data['ALL_CONNECTIONS']:
+                fromPE, fromConnection = _resolve_port(
+                    source, fromConnection, 'outputmappings', outputs)
+                toPE, toConnection = _resolve_port(
+                    dest, toConnection, 'inputmappings', inputs)
+                if fromPE is not None and toPE is not None:
+                    self.connect(fromPE, fromConnection, toPE, toConnection)
+
+
+def _resolve_port(obj, name, mappings, cache):
+    '''
+    Follows the port mappings of composites to a PE and returns the PE and
+    the name of its port, or `(None, None)` if a port is not mapped.
+    The results are stored in the cache.
+    '''
+    path = []
+    while isinstance(obj, WorkflowGraph):
+        key = obj, name
+        try:
+            obj, name = cache[key]
+            break
+        except KeyError:
+            pass
+        path.append(key)
+        try:
+            obj, name = getattr(obj, mappings)[name]
+        except (AttributeError, KeyError):
+            obj, name = None, None
+    for key in path:
+        cache[key] = obj, name
+    return obj, name
+
+
+def _edges(graph, node):
+    # the data of the outgoing and incoming edges of a node
+    edges = list(graph[node].values())
+    try:
+        edges.extend(graph.pred[node].values())
+    except AttributeError:
+        # the edges of an undirected graph are all in the adjacency
+        pass
+    return edges
 
 
 def _create_dot(graph, instanceNames={}, counter=0):
@@ -243,7 +413,7 @@ def _create_dot(graph, instanceNames={}, counter=0):
         # add inputs
         inputNames = []
         outputNames = []
-        for edge in graph.graph[node].values():
+        for edge in _edges(graph.graph, node):
             if pe == edge['DIRECTION'][1]:
                 inputName = edge['TO_CONNECTION']
                 dotName = "<in_" + inputName + ">" + inputName